@@ -1,31 +1,52 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from contextlib import nullcontext
+import asyncio
+import time
+from urllib.parse import quote
 import logging
 
 from ..models.schemas import (
 	QueryRequest,
 	QueryResponse,
+	BatchQueryRequest,
+	BatchQueryResponse,
 	HealthResponse,
 	TableListResponse,
 	TableSchemaResponse,
+	CacheStatsResponse,
+	QueryJobRequest,
+	QueryJobResponse,
+	QueryJobListResponse,
+	QueryJobResultsResponse,
 	ErrorResponse
 )
-from ..database import Database, get_database
+from ..database import ArrowStream, Database, get_database
+from ..metrics import CONTENT_TYPE, StageTimer, registry
 from ..services.query_service import QueryService
-from ..services.ml_service import MLService
+from ..services.ml_service import get_ml_service
+from ..services.profiling import get_slow_query_log
+from ..services.query_jobs import DONE, FAILED, JobQueueFull, QueryJob, get_query_job_manager
+from ..services.result_cache import canonicalize_sql, get_result_cache
+from ..services.schema_digest import SchemaDigest, get_schema_digest
+from ..services.singleflight import SingleFlight
+from ..services import result_formats
 from ..config import settings
 
 logger = logging.getLogger (__name__)
 
 router = APIRouter ()
-ml_service = MLService ()
+ml_service = get_ml_service ()
+executions = SingleFlight ()
+_background: set = set ()  # Strong references, the loop only keeps weak ones to tasks
 
 
 @router.get ("/health", response_model = HealthResponse, tags = ["Health"])
 async def health_check (db: Database = Depends (get_database)):
 	db_status = "connected"
 	try:
-		db.get_tables ()
+		await db.run (db.get_tables)
 	except Exception as e:
 		db_status = f"error: {str (e)}"
 		logger.error (f"Database health check failed: {e}")
@@ -41,7 +62,8 @@ async def health_check (db: Database = Depends (get_database)):
 	return HealthResponse (
 		status = "ok",
 		database = db_status,
-		ml_service = ml_status
+		ml_service = ml_status,
+		data_version = db.data_version
 	)
 
 
@@ -49,7 +71,7 @@ async def health_check (db: Database = Depends (get_database)):
 async def get_tables (db: Database = Depends (get_database)):
 	try:
 		query_service = QueryService (db)
-		tables = query_service.get_all_tables ()
+		tables = await db.run (query_service.get_all_tables)
 
 		return TableListResponse (
 			tables = tables,
@@ -65,7 +87,7 @@ async def get_tables (db: Database = Depends (get_database)):
 async def get_table_schema (table_name: str, db: Database = Depends (get_database)):
 	try:
 		query_service = QueryService (db)
-		table_info = query_service.get_table_info (table_name)
+		table_info = await db.run (query_service.get_table_info, table_name)
 
 		return TableSchemaResponse (**table_info)
 
@@ -77,59 +99,230 @@ async def get_table_schema (table_name: str, db: Database = Depends (get_databas
 		)
 
 
-@router.post ("/query", response_model = QueryResponse, tags = ["Query"])
-async def execute_query (
-		request: QueryRequest,
-		db: Database = Depends (get_database)
+def _timings (timer: Optional[StageTimer], include: bool) -> Optional[Dict[str, float]]:
+	"""Close the request's timer; the breakdown is only returned when the client asked for it"""
+	if timer is None:
+		return None
+	timings = timer.finish ()
+	return timings if include else None
+
+
+def _render_result (
+		result: Dict[str, Any],
+		result_format: str,
+		timer: Optional[StageTimer] = None,
+		include_timings: bool = False
 ):
-	question = request.text.strip ()
+	table = result.get ("table")
+	if timer is not None:
+		# Validation and execution were timed (and observed) by the query service
+		timer.merge (result.get ("stages"))
+	serialization = timer.stage ("serialization") if timer is not None else nullcontext ()
 
-	logger.info (f"Received question: {question}")
+	if result.get ("error") or table is None or result_format == result_formats.JSON:
+		with serialization:
+			rows = table.to_pylist () if table is not None else []
+		return QueryResponse (
+			question = result["question"],
+			sql = result["sql"],
+			results = rows,
+			columns = result["columns"],
+			row_count = result["row_count"],
+			truncated = result.get ("truncated", False),
+			total_count = result.get ("total_count"),
+			execution_time = result.get ("execution_time"),
+			cached = result.get ("cached", False),
+			error = result.get ("error"),
+			timings = _timings (timer, include_timings),
+			profile = result.get ("profile")
+		)
+
+	meta = {
+		"question": result["question"],
+		"sql": result["sql"],
+		"row_count": result["row_count"],
+		"truncated": result.get ("truncated", False),
+		"total_count": result.get ("total_count"),
+		"execution_time": result.get ("execution_time"),
+		"cached": result.get ("cached", False),
+		"error": None
+	}
+	if result.get ("profile"):
+		meta["profile"] = result["profile"]
+
+	if result_format == result_formats.COLUMNAR:
+		with serialization:
+			content = result_formats.to_columnar_json (meta, table)
+		timings = _timings (timer, include_timings)
+		return Response (
+			content = content,
+			media_type = result_formats.COLUMNAR_MEDIA_TYPE,
+			headers = {"Server-Timing": StageTimer.server_timing (timings)} if timings else None
+		)
+
+	with serialization:
+		content = result_formats.to_arrow_ipc (table, meta)
+	headers = {
+		"X-Query-SQL": quote (result["sql"]),
+		"X-Row-Count": str (result["row_count"]),
+		"X-Truncated": str (meta["truncated"]).lower (),
+		"X-Cached": str (meta["cached"]).lower ()
+	}
+	timings = _timings (timer, include_timings)
+	if timings:
+		headers["Server-Timing"] = StageTimer.server_timing (timings)
+
+	return Response (
+		content = content,
+		media_type = result_formats.ARROW_MEDIA_TYPE,
+		headers = headers
+	)
 
+
+async def _schema_digest (db: Database, question: str) -> SchemaDigest:
+	try:
+		return await db.run (get_schema_digest ().get, db, question)
+	except Exception as e:
+		# Without a digest the ml-service falls back to its built-in schema
+		logger.error (f"Failed to build schema digest: {e}")
+		return SchemaDigest (text = "", hash = db.schema_version, fingerprint = db.schema_version)
+
+
+async def _generate_sql (question: str, schema: SchemaDigest, timer: StageTimer) -> Tuple[Optional[str], Optional[str]]:
+	"""Returns (sql, error)"""
 	try:
 		logger.info ("Generating SQL using ML service...")
-		sql = await ml_service.text_to_sql (question)
+		with timer.stage ("ml"):
+			sql = await ml_service.text_to_sql (question, schema.text or None, schema.hash)
 
 		if not sql:
 			logger.error ("ML service failed to generate SQL")
-			return QueryResponse (
-				question = question,
-				sql = None,
-				results = [],
-				columns = [],
-				row_count = 0,
-				error = "Failed to generate SQL query. Try rephrasing the question."
-			)
+			return None, "Failed to generate SQL query. Try rephrasing the question."
 
-		sql = ml_service.clean_sql (sql)
+		with timer.stage ("cleaning"):
+			sql = ml_service.clean_sql (sql)
 		logger.info (f"Generated SQL: {sql}")
+		return sql, None
 
 	except Exception as e:
 		logger.error (f"SQL generation error: {e}")
+		return None, f"Error generating SQL: {str (e)}"
+
+
+async def _execute (
+		db: Database,
+		sql: str,
+		question: str,
+		include_total_count: bool = False,
+		profile: bool = False
+) -> Dict[str, Any]:
+	"""Run the query on the DuckDB pool; concurrent requests for the same SQL share one execution"""
+	key = (db.schema_version, canonicalize_sql (sql), include_total_count, profile)
+	query_service = QueryService (db)
+	result = await executions.do (key, lambda: _run_and_watch (db, query_service, sql, question, include_total_count, profile))
+	return dict (result, question = question, sql = sql)
+
+
+async def _run_and_watch (
+		db: Database,
+		query_service: QueryService,
+		sql: str,
+		question: str,
+		include_total_count: bool,
+		profile: bool
+) -> Dict[str, Any]:
+	"""Execute once and, if the execution was slow, log its profile (profiling it in the background if needed)"""
+	result = await db.run (query_service.execute_query, sql, question, include_total_count, profile)
+
+	slow_log = get_slow_query_log ()
+	execution_time = result["stages"].get ("execution", 0.0)
+	if result.get ("error") or not slow_log.is_slow (execution_time):
+		return result
+
+	first_run = slow_log.claim (canonicalize_sql (sql), db.schema_version)
+	if result.get ("profile"):
+		slow_log.record (question, sql, execution_time, result["profile"])
+	elif first_run:
+		# The caller does not wait for the second, profiled run
+		task = asyncio.ensure_future (_profile_slow_query (db, query_service, sql, question, execution_time))
+		_background.add (task)
+		task.add_done_callback (_background.discard)
+	return result
+
+
+async def _profile_slow_query (db: Database, query_service: QueryService, sql: str, question: str, execution_time: float):
+	try:
+		profile = await db.run (query_service.profile_query, sql)
+		get_slow_query_log ().record (question, sql, execution_time, profile)
+	except Exception as e:
+		logger.error (f"Failed to profile slow query: {e}")
+
+
+@router.get ("/ingest/report", tags = ["Database"])
+async def get_ingest_report (db: Database = Depends (get_database)):
+	return db.ingest_report
+
+
+@router.get ("/ingest/indexes", tags = ["Database"])
+async def get_index_progress (db: Database = Depends (get_database)):
+	"""Background build of the lookup indexes: state per column"""
+	return db.indexes.stats ()
+
+
+@router.post ("/ingest/refresh", tags = ["Database"])
+async def refresh_data (db: Database = Depends (get_database)):
+	"""Pick up data file changes now instead of at the next watcher poll"""
+	changes = await asyncio.to_thread (db.refresh_data)
+	return {"data_version": db.data_version, "changes": changes, "report": db.ingest_report}
+
+
+@router.post ("/query", response_model = QueryResponse, tags = ["Query"])
+async def execute_query (
+		request: QueryRequest,
+		db: Database = Depends (get_database),
+		result_format: Optional[str] = Query (
+			None,
+			alias = "format",
+			description = "json (default, row objects), columnar (column arrays) or arrow (Arrow IPC stream)"
+		),
+		accept: Optional[str] = Header (None)
+):
+	question = request.text.strip ()
+
+	try:
+		result_format = result_formats.negotiate_format (result_format, accept)
+	except ValueError as e:
+		raise HTTPException (status_code = 400, detail = str (e))
+
+	logger.info (f"Received question: {question}")
+	timer = StageTimer ()
+
+	with timer.stage ("schema"):
+		schema = await _schema_digest (db, question)
+	sql, error = await _generate_sql (question, schema, timer)
+	if error:
 		return QueryResponse (
 			question = question,
 			sql = None,
 			results = [],
 			columns = [],
 			row_count = 0,
-			error = f"Error generating SQL: {str (e)}"
+			error = error,
+			timings = _timings (timer, request.include_timings)
 		)
 
 	# Execute SQL query
 	try:
 		logger.info ("Executing SQL query...")
-		query_service = QueryService (db)
-		result = query_service.execute_query (sql, question)
+		result = await _execute (db, sql, question, request.include_total_count, request.profile)
 
-		return QueryResponse (
-			question = result["question"],
-			sql = result["sql"],
-			results = result["results"],
-			columns = result["columns"],
-			row_count = result["row_count"],
-			execution_time = result.get ("execution_time"),
-			error = result.get ("error")
-		)
+		if result.get ("error"):
+			# Do not keep serving SQL that failed against the current data
+			ml_service.forget (question, schema.hash, sql)
+		else:
+			ml_service.remember (question, sql)
+
+		return _render_result (result, result_format, timer, request.include_timings)
 
 	except Exception as e:
 		logger.error (f"Query execution error: {e}")
@@ -139,5 +332,357 @@ async def execute_query (
 			results = [],
 			columns = [],
 			row_count = 0,
-			error = f"Error executing query: {str (e)}"
+			error = f"Error executing query: {str (e)}",
+			timings = _timings (timer, request.include_timings)
 		)
+
+
+@router.post ("/query/batch", response_model = BatchQueryResponse, tags = ["Query"])
+async def execute_batch (request: BatchQueryRequest, db: Database = Depends (get_database)):
+	"""
+	Answer many questions in one call. Duplicate questions (and questions that produce the same SQL)
+	run once, SQL is generated in batches and the queries run concurrently on the DuckDB pool.
+	A failed question gets its own error, the rest of the batch is unaffected.
+	"""
+	start_time = time.time ()
+	questions = [question.strip () for question in request.questions]
+	unique_questions = list (dict.fromkeys (question for question in questions if question))
+
+	if len (unique_questions) > settings.batch_max_questions:
+		raise HTTPException (
+			status_code = 400,
+			detail = f"Too many questions in batch: {len (unique_questions)} (max {settings.batch_max_questions})"
+		)
+
+	logger.info (f"Received batch of {len (questions)} questions ({len (unique_questions)} unique)")
+
+	# One digest for the whole batch, relevant to all of its questions
+	schema = await _schema_digest (db, " ".join (unique_questions))
+	try:
+		generated = await ml_service.text_to_sql_batch (unique_questions, schema.text or None, schema.hash)
+	except Exception as e:
+		logger.error (f"Batch SQL generation error: {e}")
+		generated = {question: (None, str (e)) for question in unique_questions}
+
+	batch_executions: Dict[str, asyncio.Future] = {}
+	answers: Dict[str, Tuple[Optional[str], Optional[str], Optional[asyncio.Future]]] = {}
+
+	for question in unique_questions:
+		sql, error = generated.get (question, (None, None))
+		if not sql:
+			answers[question] = (None, f"Failed to generate SQL query. {error or 'Try rephrasing the question.'}", None)
+			continue
+
+		sql = ml_service.clean_sql (sql)
+		key = canonicalize_sql (sql)
+		if key not in batch_executions:
+			batch_executions[key] = asyncio.ensure_future (_execute (db, sql, question, request.include_total_count))
+		answers[question] = (sql, None, batch_executions[key])
+
+	if batch_executions:
+		await asyncio.gather (*batch_executions.values (), return_exceptions = True)
+
+	rendered: Dict[str, QueryResponse] = {}
+	for question, (sql, error, execution) in answers.items ():
+		if execution is None:
+			rendered[question] = QueryResponse (question = question, error = error)
+			continue
+
+		if execution.exception () is not None:
+			logger.error (f"Query execution error: {execution.exception ()}")
+			rendered[question] = QueryResponse (question = question, sql = sql, error = f"Error executing query: {str (execution.exception ())}")
+			continue
+
+		result = dict (execution.result (), question = question, sql = sql)
+		if result.get ("error"):
+			ml_service.forget (question, schema.hash, sql)
+		else:
+			ml_service.remember (question, sql)
+		rendered[question] = _render_result (result, result_formats.JSON)
+
+	results = [rendered.get (question) or QueryResponse (question = question, error = "Empty question") for question in questions]
+	return BatchQueryResponse (
+		results = results,
+		count = len (results),
+		unique_questions = len (unique_questions),
+		execution_time = round (time.time () - start_time, 3)
+	)
+
+
+async def _stream_body (
+		stream: ArrowStream,
+		db: Database,
+		stream_format: str,
+		meta: Dict[str, Any]
+) -> AsyncIterator[bytes]:
+	# One batch is read per chunk the client accepts, so a slow reader slows the query down instead of buffering
+	start_time = time.time ()
+	row_count = 0
+	encoder = None
+
+	try:
+		if stream_format == result_formats.NDJSON:
+			yield result_formats.ndjson_line ({
+				"type": "meta",
+				**meta,
+				"columns": stream.schema.names
+			})
+		else:
+			encoder = result_formats.ArrowStreamEncoder (stream.schema, meta)
+
+		while True:
+			batch = await db.run (stream.read_next)
+			if batch is None:
+				break
+
+			row_count += batch.num_rows
+			if encoder is not None:
+				yield encoder.encode (batch)
+			else:
+				yield result_formats.ndjson_batch (batch)
+
+		if encoder is not None:
+			yield encoder.finish ()
+		else:
+			yield result_formats.ndjson_line ({
+				"type": "end",
+				"row_count": row_count,
+				"execution_time": round (time.time () - start_time, 3)
+			})
+
+		logger.info (f"Streamed {row_count} rows in {round (time.time () - start_time, 3)}s")
+
+	except Exception as e:
+		logger.error (f"Streaming error after {row_count} rows: {e}")
+		if encoder is None:
+			yield result_formats.ndjson_line ({"type": "error", "error": f"SQL execution error: {str (e)}"})
+
+	finally:
+		stream.close ()
+
+
+@router.post ("/query/stream", response_model = QueryResponse, tags = ["Query"])
+async def stream_query (
+		request: QueryRequest,
+		db: Database = Depends (get_database),
+		stream_format: Optional[str] = Query (
+			None,
+			alias = "format",
+			description = "ndjson (default: meta line, one line per batch with column arrays, end line) or arrow (Arrow IPC stream)"
+		),
+		accept: Optional[str] = Header (None)
+):
+	"""
+	Stream the full result without building it in memory.
+	Generation and validation errors are returned as a regular QueryResponse.
+	"""
+	question = request.text.strip ()
+
+	try:
+		stream_format = result_formats.negotiate_stream_format (stream_format, accept)
+	except ValueError as e:
+		raise HTTPException (status_code = 400, detail = str (e))
+
+	logger.info (f"Received streaming question: {question}")
+	timer = StageTimer ()
+
+	with timer.stage ("schema"):
+		schema = await _schema_digest (db, question)
+	sql, error = await _generate_sql (question, schema, timer)
+	if error:
+		return QueryResponse (question = question, error = error, timings = _timings (timer, request.include_timings))
+
+	try:
+		with timer.stage ("validation"):
+			is_valid, error_msg = await db.run (db.validate_sql, sql)
+		if not is_valid:
+			ml_service.forget (question, schema.hash, sql)
+			return QueryResponse (
+				question = question, sql = sql, error = f"Invalid SQL query: {error_msg}",
+				timings = _timings (timer, request.include_timings)
+			)
+
+		with timer.stage ("execution"):
+			# Rollup rewrite and partition pruning, as on /query
+			stream = await db.run (db.open_stream, db.execution_sql (sql), settings.stream_batch_rows, settings.stream_max_rows)
+		ml_service.remember (question, sql)
+
+	except Exception as e:
+		logger.error (f"Query execution error: {e}")
+		return QueryResponse (
+			question = question, sql = sql, error = f"Error executing query: {str (e)}",
+			timings = _timings (timer, request.include_timings)
+		)
+
+	meta = {"question": question, "sql": sql}
+	# Time to the first batch; the stream itself reports its own execution_time at the end
+	timings = _timings (timer, request.include_timings)
+	if timings:
+		meta["timings"] = timings
+	if stream_format == result_formats.ARROW:
+		return StreamingResponse (
+			_stream_body (stream, db, stream_format, meta),
+			media_type = result_formats.ARROW_MEDIA_TYPE,
+			headers = {"X-Query-SQL": quote (sql)}
+		)
+
+	return StreamingResponse (
+		_stream_body (stream, db, stream_format, meta),
+		media_type = result_formats.NDJSON_MEDIA_TYPE
+	)
+
+
+def _job_response (job: QueryJob) -> QueryJobResponse:
+	data = job.to_dict ()
+	return QueryJobResponse (**{name: data[name] for name in QueryJobResponse.model_fields})
+
+
+@router.post ("/query/jobs", response_model = QueryJobResponse, status_code = 202, tags = ["Query"])
+async def submit_query_job (request: QueryJobRequest, db: Database = Depends (get_database)):
+	"""
+	Answer a question in the background and return its job ID at once.
+	The full result (not cut off at max_result_rows) is kept on disk for query_jobs_ttl seconds;
+	poll GET /query/jobs/{job_id} and page through GET /query/jobs/{job_id}/results once it is done.
+	"""
+	question = request.text.strip ()
+	schema_hash = ""
+
+	async def prepare () -> Tuple[Optional[str], Optional[str]]:
+		nonlocal schema_hash
+		timer = StageTimer ()
+		with timer.stage ("schema"):
+			schema = await _schema_digest (db, question)
+		schema_hash = schema.hash
+		sql, error = await _generate_sql (question, schema, timer)
+		if error:
+			return None, error
+
+		with timer.stage ("validation"):
+			is_valid, error_msg = await db.run (db.validate_sql, sql)
+		if not is_valid:
+			ml_service.forget (question, schema_hash, sql)
+			return sql, f"Invalid SQL query: {error_msg}"
+		return sql, None
+
+	def finished (job: QueryJob):
+		if job.state == DONE:
+			ml_service.remember (question, job.sql)
+		elif job.state == FAILED and job.sql:
+			ml_service.forget (question, schema_hash, job.sql)
+
+	try:
+		job = get_query_job_manager ().submit (db, question, prepare, finished)
+	except JobQueueFull as e:
+		raise HTTPException (status_code = 429, detail = str (e))
+	return _job_response (job)
+
+
+@router.get ("/query/jobs", response_model = QueryJobListResponse, tags = ["Query"])
+async def list_query_jobs (limit: int = Query (50, ge = 1, le = 500)):
+	"""Recent jobs, newest first"""
+	manager = get_query_job_manager ()
+	jobs = await asyncio.to_thread (manager.recent, limit)
+	return QueryJobListResponse (jobs = [_job_response (job) for job in jobs], stats = manager.stats ())
+
+
+@router.get ("/query/jobs/{job_id}", response_model = QueryJobResponse, tags = ["Query"])
+async def get_query_job (job_id: str):
+	"""State and progress (stage, rows written, elapsed time) of a job"""
+	job = get_query_job_manager ().get (job_id)
+	if job is None:
+		raise HTTPException (status_code = 404, detail = f"Job '{job_id}' not found or expired")
+	return _job_response (job)
+
+
+@router.delete ("/query/jobs/{job_id}", response_model = QueryJobResponse, tags = ["Query"])
+async def cancel_query_job (job_id: str):
+	"""Cancel a queued or running job; the result of a finished job is deleted"""
+	job = get_query_job_manager ().cancel (job_id)
+	if job is None:
+		raise HTTPException (status_code = 404, detail = f"Job '{job_id}' not found or expired")
+	return _job_response (job)
+
+
+@router.get ("/query/jobs/{job_id}/results", response_model = QueryJobResultsResponse, tags = ["Query"])
+async def get_query_job_results (
+		job_id: str,
+		offset: int = Query (0, ge = 0),
+		limit: Optional[int] = Query (None, ge = 1, le = 100000, description = "Rows per page, query_jobs_page_rows by default"),
+		result_format: Optional[str] = Query (
+			None,
+			alias = "format",
+			description = "json (default, row objects), columnar (column arrays) or arrow (Arrow IPC stream)"
+		),
+		accept: Optional[str] = Header (None)
+):
+	"""One page of the result of a finished job"""
+	try:
+		result_format = result_formats.negotiate_format (result_format, accept)
+	except ValueError as e:
+		raise HTTPException (status_code = 400, detail = str (e))
+
+	manager = get_query_job_manager ()
+	job = manager.get (job_id)
+	if job is None:
+		raise HTTPException (status_code = 404, detail = f"Job '{job_id}' not found or expired")
+	if job.state != DONE:
+		raise HTTPException (status_code = 409, detail = f"Job '{job_id}' is {job.state}" + (f": {job.error}" if job.error else ""))
+
+	limit = limit or settings.query_jobs_page_rows
+	try:
+		table, total_rows = await asyncio.to_thread (manager.read_page, job_id, offset, limit)
+	except FileNotFoundError:
+		raise HTTPException (status_code = 404, detail = f"Result of job '{job_id}' expired")
+
+	next_offset = offset + table.num_rows if offset + table.num_rows < total_rows else None
+	meta = {
+		"job_id": job_id,
+		"offset": offset,
+		"row_count": table.num_rows,
+		"total_rows": total_rows,
+		"next_offset": next_offset
+	}
+
+	if result_format == result_formats.COLUMNAR:
+		return Response (content = result_formats.to_columnar_json (meta, table), media_type = result_formats.COLUMNAR_MEDIA_TYPE)
+	if result_format == result_formats.ARROW:
+		return Response (
+			content = result_formats.to_arrow_ipc (table, meta),
+			media_type = result_formats.ARROW_MEDIA_TYPE,
+			headers = {"X-Total-Rows": str (total_rows), "X-Next-Offset": str (next_offset) if next_offset is not None else ""}
+		)
+
+	return QueryJobResultsResponse (columns = table.column_names, results = table.to_pylist (), **meta)
+
+
+@router.get ("/metrics", response_class = PlainTextResponse, tags = ["Health"])
+async def metrics ():
+	"""Latency histograms in Prometheus text format"""
+	return PlainTextResponse (registry.render (), media_type = CONTENT_TYPE)
+
+
+@router.get ("/slow-queries", tags = ["Database"])
+async def get_slow_queries (limit: int = Query (20, ge = 1, le = 100)):
+	"""Most recent slow queries with their operator profiles, newest first"""
+	slow_log = get_slow_query_log ()
+	return {**slow_log.stats (), "queries": slow_log.recent (limit)}
+
+
+@router.get ("/cache/stats", response_model = CacheStatsResponse, tags = ["Cache"])
+async def get_cache_stats ():
+	db = get_database ()
+	question_cache = ml_service.question_cache
+	result_cache = get_result_cache ()
+	return CacheStatsResponse (
+		question_cache = question_cache.stats () if question_cache is not None else None,
+		result_cache = result_cache.stats () if result_cache is not None else None,
+		ml_client = ml_service.pool_stats (),
+		query_history = ml_service.history.stats () if ml_service.history is not None else None,
+		rollups = db.rollups.stats (),
+		partitions = db.partitions.stats (),
+		coalescing = {
+			"sql_generation": ml_service.inflight.stats (),
+			"execution": executions.stats ()
+		},
+		validation = dict (db.validation_stats)
+	)
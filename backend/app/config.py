@@ -1,5 +1,6 @@
 from functools import lru_cache
 
+from pydantic import AliasChoices, Field
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -9,12 +10,65 @@ class Settings(BaseSettings):
 	log_level: str = "INFO"
 	cors_origins: str = "http://localhost:3000,http://localhost"
 	max_result_rows: int = 1000
+	stream_batch_rows: int = 10000  # Rows per chunk on /query/stream
+	stream_max_rows: int = 0  # Hard cap for /query/stream, 0 = unlimited
 	ml_service_timeout: int = 60
+	ml_service_connect_timeout: float = 5.0  # in seconds
+	ml_service_health_timeout: float = 5.0  # in seconds, /health and /model-info calls
+	ml_service_max_connections: int = 100
+	ml_service_max_keepalive: int = 20  # Idle connections kept open for reuse
+	ml_service_keepalive_expiry: float = 30.0  # in seconds
+	ml_service_http2: bool = False  # Requires the ml-service to be served over HTTP/2
+	ml_service_batch_size: int = 20  # Questions per /generate-sql/batch call
+	ml_service_batch_timeout: int = 300  # in seconds, per /generate-sql/batch call
+	ml_service_batch_concurrency: int = 8  # Parallel /generate-sql calls when the batch endpoint is unavailable
+	batch_max_questions: int = 500  # Max questions per /query/batch request
 
+	question_cache_enabled: bool = True
+	question_cache_size: int = 1024  # Max cached questions
+	question_cache_ttl: int = 3600  # in seconds, 0 = no expiry
+	question_cache_similarity: float = 0.9  # Min n-gram similarity for near-duplicates (which must also have the same content words), 0 = exact only
+	schema_digest_max_values: int = 12  # Distinct values listed in the prompt for low-cardinality text columns
+	schema_digest_top_tables: int = 5  # With more tables, only the most relevant ones go into the prompt
+	schema_digest_top_columns: int = 40  # Same for the columns of wider tables
 
-	duckdb_mode: str = ":memory:"  # Options: ":memory:", "persistent"
+
+	duckdb_mode: str = ":memory:"  # Options: ":memory:" (parquet views), "persistent" (native tables in duckdb_file), "shared" (read-only snapshots written by python -m app.ingest)
+	duckdb_file: str = "app/data/analytics.duckdb"  # Used in persistent mode, ingested files are tracked in it; shared snapshots are named analytics.<version>.duckdb next to it
+	shared_version_file: str = "app/data/data_version.json"  # Shared mode: the published snapshot and data version, polled by every worker
+	shared_keep_snapshots: int = 2  # Shared mode: snapshots kept by the writer, older ones are deleted
+	# Worker processes for python -m app.main, WEB_CONCURRENCY is what uvicorn --workers defaults to;
+	# more than one needs duckdb_mode ":memory:" or "shared"
+	workers: int = Field(1, validation_alias=AliasChoices("workers", "web_concurrency"))
 	duckdb_memory_limit: str = "4GB"  # e.g., "4GB", "512MB"
 	duckdb_threads: int = 4  # Number of threads for DuckDB operations
+	data_watch_interval: float = 5.0  # in seconds, poll database_path for added, changed and removed files, 0 = only at startup
+
+	rollups_enabled: bool = True
+	rollup_source_table: str = "transactions"
+	rollup_measure_column: str = "TransactionAmount"
+	rollup_date_column: str = "TransactionDate"
+	rollup_dimension_sets: str = "MerchantID,Channel,Location,TransactionType;Channel,Location,TransactionType;"  # ";"-separated, empty set = date only
+	rollup_grains: str = "day,month"
+
+	indexes_enabled: bool = True  # ART indexes on lookup columns of the materialized table (persistent mode only)
+	index_table: str = "transactions"
+	index_columns: str = "AccountID,TransactionID,MerchantID,DeviceID,IP Address"
+	index_max_rows_per_key: int = 200  # Columns with more rows per value are not indexed, a scan is as fast
+
+	validation_cache_size: int = 4096  # Cached validation verdicts (by SQL hash)
+
+	result_cache_enabled: bool = True
+	result_cache_memory_mb: int = 256  # In-memory budget for cached results
+	result_cache_spill_path: str = ""  # Directory for the on-disk tier, empty = disabled. Keep it outside database_path
+	result_cache_disk_mb: int = 2048
+
+	query_jobs_path: str = "query_jobs"  # Results and metadata of /query/jobs, shared by the workers. Keep it outside database_path
+	query_jobs_concurrency: int = 2  # Jobs executing at once, on a pool separate from interactive queries
+	query_jobs_max_pending: int = 100  # Unfinished jobs per worker, more are rejected
+	query_jobs_ttl: int = 86400  # in seconds, finished jobs and their results are deleted after it, 0 = kept
+	query_jobs_max_rows: int = 0  # Hard cap for a job result, 0 = unlimited
+	query_jobs_page_rows: int = 1000  # Default page size of /query/jobs/{job_id}/results
 
 	api_key: str = ""
 	secret_key: str = ""
@@ -24,8 +78,15 @@ class Settings(BaseSettings):
 
 	log_sql_queries: bool = True
 	log_results: bool = False
-	save_query_history: bool = True
-	query_history_path: str = "app/data/query_history.json"
+	save_query_history: bool = True  # Successful question -> SQL pairs, used as prompt examples
+	query_history_path: str = "app/data/query_history.jsonl"
+	query_history_max_entries: int = 5000
+	history_examples: int = 3  # Nearest past pairs sent with each question, 0 = none
+	history_example_similarity: float = 0.3  # Min question similarity for an example
+	history_reuse_enabled: bool = True  # Answer questions differing from a past one only in literals without the model
+	history_reuse_similarity: float = 0.9
+	slow_query_threshold: float = 1.0  # in seconds, slower executions are profiled once and logged, 0 = disabled
+	slow_query_log_path: str = "app/data/slow_queries.jsonl"  # Empty = keep the recent ones in memory only
 
 	dev_mode: bool = True
 	enable_docs: bool = True
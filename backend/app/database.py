@@ -1,27 +1,197 @@
+import asyncio
+import functools
+import hashlib
+import json
 import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
 import duckdb
+import pyarrow as pa
 
 from .config import settings
+from .services.indexes import IndexManager
+from .services.partitions import PartitionPruner, PartitionedTable, read_layout
+from .services.rollups import RollupManager
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Table functions that read files or other databases; generated SQL only goes through the registered tables
+_EXTERNAL_FUNCTION_PREFIXES = ("read_", "parquet_", "sqlite_", "postgres_", "mysql_", "iceberg_", "delta_")
+_EXTERNAL_FUNCTIONS = {"glob", "sniff_csv"}
+
+
+def _table_functions(node: Any) -> List[str]:
+	"""Names of the table functions in the FROM clauses of a json_serialize_sql tree"""
+	found = []
+	if isinstance(node, dict):
+		if node.get("type") == "TABLE_FUNCTION":
+			found.append((node.get("function") or {}).get("function_name", ""))
+		for value in node.values():
+			found.extend(_table_functions(value))
+	elif isinstance(node, list):
+		for value in node:
+			found.extend(_table_functions(value))
+	return found
+
+
+def _partition_files(path: Path) -> List[Path]:
+	return sorted(
+		file for file in path.glob("**/*.parquet")
+		if not any(part.startswith(".") for part in file.relative_to(path).parts)
+	)
+
+
+def read_shared_version(path: Path) -> Optional[Dict[str, Any]]:
+	"""State published by the writer: version, snapshot file name, source signatures and ingest report"""
+	try:
+		state = json.loads(path.read_text(encoding="utf-8"))
+	except FileNotFoundError:
+		return None
+	except (OSError, ValueError) as e:
+		logger.warning(f"Unreadable data version file {path}: {e}")
+		return None
+	return state if isinstance(state, dict) and state.get("file") else None
+
+
+def data_sources(data_path: Path) -> Dict[str, Path]:
+	"""
+	Table name -> data source: every *.parquet file, and every directory holding parquet files
+	(a hive-partitioned dataset such as transactions/year=2023/month=5/Channel=ATM/*.parquet).
+	Hidden entries (staging directories of the converter, DuckDB temp files) are skipped.
+	"""
+	sources: Dict[str, Path] = {}
+	for path in sorted(data_path.iterdir()):
+		if path.name.startswith("."):
+			continue
+		if path.is_file() and path.suffix == ".parquet":
+			sources.setdefault(path.stem, path)
+		elif path.is_dir() and _partition_files(path):
+			if path.name in sources:
+				logger.warning(f"Both {sources[path.name]} and {path} found, the partitioned dataset is used")
+			sources[path.name] = path
+	return dict(sorted(sources.items()))
+
+
+def source_signature(path: Path) -> tuple:
+	"""Changes whenever a file of the source is added, removed or rewritten"""
+	try:
+		if not path.is_dir():
+			stat = path.stat()
+			return str(path), stat.st_size, stat.st_mtime_ns
+		stats = [file.stat() for file in _partition_files(path)]
+		return str(path), len(stats), sum(stat.st_size for stat in stats), max((stat.st_mtime_ns for stat in stats), default=0)
+	except OSError:
+		# Removed while being scanned, the next poll sees the final state
+		return str(path), "missing"
+
+
+def _read_parquet_sql(path: Path, files: Optional[List[str]] = None) -> str:
+	"""read_parquet over a file, a partitioned directory or an explicit list of its files"""
+	def literal(value: str) -> str:
+		return "'" + value.replace("'", "''") + "'"
+
+	if not path.is_dir():
+		return f"read_parquet({literal(str(path))})"
+	target = "[" + ", ".join(literal(file) for file in files) + "]" if files is not None else literal(str(path / "**" / "*.parquet"))
+	return f"read_parquet({target}, hive_partitioning = true)"
+
+
+class ArrowStream:
+	"""Record batches of one query, pulled on demand from a dedicated cursor"""
+
+	def __init__(self, cursor: duckdb.DuckDBPyConnection, reader: pa.RecordBatchReader):
+		self._cursor = cursor
+		self._reader = reader
+		self._lock = threading.Lock()
+		self._closed = False
+
+	@property
+	def schema(self) -> pa.Schema:
+		return self._reader.schema
+
+	def read_next(self) -> Optional[pa.RecordBatch]:
+		with self._lock:
+			if self._closed:
+				return None
+			try:
+				return self._reader.read_next_batch()
+			except StopIteration:
+				self._close_locked()
+				return None
+
+	def close(self):
+		# Waits for an in-flight read_next, so it is safe to call from any thread
+		with self._lock:
+			self._close_locked()
+
+	def _close_locked(self):
+		if not self._closed:
+			self._closed = True
+			self._cursor.close()
+
+
 class Database:
 
-	def __init__(self):
+	def __init__(self, mode: Optional[str] = None, database_file: Optional[str] = None):
 		self.connection = None
 		self.data_path = Path(settings.database_path)
+		self.schema_version = ""
+		self.registered_files: Dict[str, Path] = {}
+		self.mode = mode or settings.duckdb_mode
+		self.database_file = database_file or settings.duckdb_file
+		self.persistent = self.mode == "persistent"
+		# Read-only snapshots published by the single writer (app.ingest), one per data version
+		self.shared = self.mode == "shared"
+		self.ingest_report: Dict[str, Any] = {}
+		self.rollups = RollupManager()
+		self.partitions = PartitionPruner()
+		self.indexes = IndexManager()
+		self._executor: Optional[ThreadPoolExecutor] = None
+		self._local = threading.local()
+		self._cursors: List[duckdb.DuckDBPyConnection] = []
+		self._cursors_lock = threading.Lock()
+		self._verdicts: "OrderedDict[Tuple[str, str], Tuple[bool, Optional[str]]]" = OrderedDict()
+		self._verdicts_lock = threading.Lock()
+		self.validation_stats = {"hits": 0, "misses": 0}
+		self._known_tables: Tuple[str, frozenset] = ("", frozenset())
+		# Bumped on every registration that changed something; part of data_fingerprint
+		self.data_version = 0
+		self.watching = False
+		self._signatures: Dict[str, tuple] = {}
+		self._fingerprint = ""
+		# Identifies the data itself rather than this process's data_version; the schema digest is stored under it
+		self.catalog_key = ""
+		self._refresh_lock = threading.Lock()
+		# Cursors are recreated after a snapshot switch; the previous snapshot is closed one switch later
+		self._generation = 0
+		self._retired: List[duckdb.DuckDBPyConnection] = []
 
 	def connect(self) -> duckdb.DuckDBPyConnection:
 		try:
-			self.connection = duckdb.connect(database=settings.duckdb_mode, read_only=False)
+			if self.shared:
+				# Placeholder until the published snapshot is opened by _register_parquet_files
+				self.connection = duckdb.connect(database=":memory:")
+			else:
+				database = self.database_file if self.persistent else self.mode
+				if self.persistent:
+					Path(database).parent.mkdir(parents=True, exist_ok=True)
+				self.connection = duckdb.connect(database=database, read_only=False)
 
-			self.connection.execute(f"SET memory_limit='{settings.duckdb_memory_limit}';")
-			self.connection.execute(f"SET threads={settings.duckdb_threads};")
+			self._configure(self.connection)
 
-			logger.info("Connected to DuckDB database in %s mode", settings.duckdb_mode)
+			logger.info("Connected to DuckDB database in %s mode", self.mode)
+
+			# Queries run off the event loop, at most duckdb_threads of them at once
+			self._executor = ThreadPoolExecutor(max_workers=settings.duckdb_threads, thread_name_prefix="duckdb")
 
 			self._register_parquet_files()
 
@@ -31,28 +201,378 @@ class Database:
 			logger.error("Failed to connect to DuckDB database: %s", e)
 			raise
 
+	@staticmethod
+	def _configure(connection: duckdb.DuckDBPyConnection):
+		connection.execute(f"SET memory_limit='{settings.duckdb_memory_limit}';")
+		connection.execute(f"SET threads={settings.duckdb_threads};")
+
+	def _cursor(self) -> duckdb.DuckDBPyConnection:
+		"""Cursor owned by the calling thread; DuckDB connections must not be shared between threads"""
+		cursor = getattr(self._local, "cursor", None)
+		if cursor is None or self._local.generation != self._generation:
+			cursor = self.connection.cursor()
+			self._local.cursor = cursor
+			self._local.generation = self._generation
+			with self._cursors_lock:
+				self._cursors.append(cursor)
+		return cursor
+
+	async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+		"""Run a blocking database call on the query pool"""
+		if not self.connection:
+			self.connect()
+
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
 	def _register_parquet_files(self):
 
+		if self.shared:
+			if not self.refresh_data():
+				logger.warning(f"No data snapshot published in {settings.shared_version_file} yet, run python -m app.ingest")
+			return
+
 		if not self.data_path.exists():
 			logger.warning(f"Data path {self.data_path} does not exist.")
 			return
 
-		parquet_files = list(self.data_path.glob("*.parquet"))
-
-		if not parquet_files:
+		self.refresh_data()
+		if not self.registered_files:
 			logger.warning(f"No Parquet files found in {self.data_path}.")
-			return
 
-		for parquet_file in parquet_files:
-			table_name = parquet_file.stem
+	def refresh_data(self) -> Dict[str, List[str]]:
+		"""
+		Register the data sources added, changed or removed since the last call; unchanged ones are left alone.
+		Every view or table is replaced by a single statement, so queries keep running on their cursors meanwhile.
+		Returns the affected table names per kind of change, empty if nothing changed.
+		"""
+		if self.shared:
+			return self._switch_snapshot()
+
+		with self._refresh_lock:
+			sources = data_sources(self.data_path) if self.data_path.exists() else {}
+			signatures = {table_name: source_signature(path) for table_name, path in sources.items()}
+			changes = {
+				"added": sorted(set(signatures) - set(self._signatures)),
+				"changed": sorted(name for name in signatures if name in self._signatures and signatures[name] != self._signatures[name]),
+				"removed": sorted(set(self._signatures) - set(signatures))
+			}
+			if self.data_version and not any(changes.values()):
+				return {}
+
+			if self.persistent:
+				self._materialize_parquet_files(sources)
+			else:
+				self._register_parquet_views(
+					{table_name: sources[table_name] for table_name in changes["added"] + changes["changed"]},
+					changes["removed"]
+				)
+			self._signatures = signatures
+
+			touched = set(changes["added"] + changes["changed"] + changes["removed"])
+			if settings.rollups_enabled and (not self.data_version or settings.rollup_source_table in touched):
+				self._refresh_rollups()
+			# Point lookups on parquet views are scans either way, indexes need the native table
+			if self.persistent and settings.indexes_enabled and (not self.data_version or settings.index_table in touched):
+				self.indexes.start(self.connection, self._refresh_lock)
+
+			self.data_version += 1
+			self._fingerprint = self._compute_fingerprint(signatures)
+			# Changes whenever a data file is added, removed or rewritten; keys caches of generated SQL
+			self.schema_version = self._fingerprint
+			self.catalog_key = self._signature_hash(signatures)
+
+			if self.data_version > 1:
+				logger.info(
+					"Data version %s: added %s, changed %s, removed %s",
+					self.data_version, changes["added"], changes["changed"], changes["removed"]
+				)
+			return changes
+
+	def _switch_snapshot(self) -> Dict[str, List[str]]:
+		"""
+		Open the snapshot named in the shared version file if the writer published a newer one.
+		Every worker keys its caches on the published version, so they all invalidate on the same change.
+		"""
+		with self._refresh_lock:
+			state = read_shared_version(Path(settings.shared_version_file))
+			if state is None or state["version"] == self.data_version:
+				return {}
+
+			path = Path(self.database_file).with_name(state["file"])
+			connection = duckdb.connect(database=str(path), read_only=True)
+			self._configure(connection)
+
+			# Queries still running on the previous snapshot keep it until the next switch
+			with self._cursors_lock:
+				for retired in self._retired:
+					retired.close()
+				self._retired = self._cursors + [self.connection]
+				self._cursors = []
+			self.connection = connection
+			self._generation += 1
+
+			report = state.get("report", {})
+			self.data_version = state["version"]
+			self._fingerprint = f"{state['version']}-{state['file']}"
+			self.schema_version = self._fingerprint
+			self.ingest_report = {
+				"mode": "shared",
+				"version": state["version"],
+				"snapshot": state["file"],
+				"published_at": state.get("published_at"),
+				"writer": report
+			}
+			if settings.rollups_enabled:
+				# The writer built them, a read-only snapshot can only use the existing ones
+				try:
+					self.rollups.refresh(connection, rebuild=False, read_only=True)
+				except Exception as e:
+					logger.error(f"Failed to load rollups: {e}")
+			# The writer's signatures of the same sources, so the digest it stored in the snapshot is found
+			self.catalog_key = self._signature_hash(state.get("sources", {}))
+
+			logger.info(f"Switched to data snapshot {path} (version {state['version']})")
+			return {
+				"added": [],
+				"changed": sorted(report.get("reloaded", []) + report.get("appended", [])),
+				"removed": sorted(report.get("dropped", []))
+			}
+
+	async def watch(self, interval: float):
+		"""Poll the data directory every interval seconds and apply the changes, until cancelled"""
+		self.watching = True
+		logger.info(f"Watching {self.data_path} for data changes every {interval}s")
+		try:
+			while True:
+				await asyncio.sleep(interval)
+				try:
+					# Off the query pool: a persistent re-ingest may take a while
+					await asyncio.to_thread(self.refresh_data)
+				except Exception as e:
+					logger.error(f"Data refresh failed: {e}")
+		finally:
+			self.watching = False
+
+	def _refresh_rollups(self):
+		source = settings.rollup_source_table
+		# Persistent rollups stay valid until their source table is re-ingested or appended to
+		changed = self.ingest_report.get("reloaded", []) + self.ingest_report.get("appended", [])
+		rebuild = not self.persistent or source in changed
+		try:
+			self.rollups.refresh(self.connection, rebuild=rebuild)
+		except Exception as e:
+			logger.error(f"Failed to refresh rollups: {e}")
+
+	def _register_parquet_views(self, sources: Dict[str, Path], removed: Optional[List[str]] = None):
+		registered = []
+		failed = []
+		dropped = []
+
+		for table_name, path in sources.items():
 			try:
-				sql = f"CREATE OR REPLACE VIEW {table_name} AS SELECT * FROM read_parquet('{parquet_file}')"
+				# The glob is expanded on every query, so partitions added later are visible right away
+				sql = f"CREATE OR REPLACE VIEW {table_name} AS SELECT * FROM {_read_parquet_sql(path)}"
 				self.connection.execute(sql)
-				logger.info(f"Registered Parquet file {parquet_file} as table {table_name}")
+				self.registered_files[table_name] = path
+				registered.append(table_name)
+				logger.info(f"Registered {'partitioned dataset' if path.is_dir() else 'Parquet file'} {path} as table {table_name}")
+			except Exception as e:
+				failed.append(table_name)
+				logger.error(f"Failed to register Parquet source {path}: {e}")
+
+		for table_name in removed or []:
+			try:
+				self.connection.execute(f"DROP VIEW IF EXISTS {table_name}")
+				self.registered_files.pop(table_name, None)
+				dropped.append(table_name)
+				logger.info(f"Dropped view {table_name}, its data source is gone")
 			except Exception as e:
-				logger.error(f"Failed to register Parquet file {parquet_file}: {e}")
+				logger.error(f"Failed to drop view {table_name}: {e}")
+
+		partitioned = [
+			PartitionedTable(table_name, path, *read_layout(path))
+			for table_name, path in self.registered_files.items() if path.is_dir()
+		]
+		self.partitions.refresh(partitioned)
+		self.ingest_report = {
+			"mode": "view",
+			"registered": registered,
+			"dropped": dropped,
+			"failed": failed,
+			"partitioned": {table.name: table.keys for table in partitioned}
+		}
+
+	def _materialize_parquet_files(self, sources: Dict[str, Path]):
+		"""
+		Load every parquet source into a native DuckDB table of the persistent database.
+		Sources whose size and mtime match the ingest manifest are reused as they are;
+		a partitioned dataset that only gained files gets just the new files appended.
+		"""
+		start_time = time.time()
+		report = {"mode": "persistent", "reused": [], "reloaded": [], "appended": [], "dropped": [], "failed": []}
+
+		self.connection.execute("""
+			CREATE TABLE IF NOT EXISTS _ingest_manifest (
+				table_name VARCHAR PRIMARY KEY,
+				source_path VARCHAR,
+				file_size BIGINT,
+				file_mtime_ns BIGINT,
+				row_count BIGINT,
+				ingested_at TIMESTAMP
+			)
+		""")
+		# Files of partitioned datasets already in their table
+		self.connection.execute("""
+			CREATE TABLE IF NOT EXISTS _ingest_files (
+				table_name VARCHAR,
+				file_path VARCHAR,
+				file_size BIGINT,
+				file_mtime_ns BIGINT
+			)
+		""")
+		manifest = {
+			row[0]: (row[1], row[2], row[3])
+			for row in self.connection.execute(
+				"SELECT table_name, source_path, file_size, file_mtime_ns FROM _ingest_manifest"
+			).fetchall()
+		}
+		existing = {
+			row[0]: row[1] for row in self.connection.execute(
+				"SELECT table_name, table_type FROM information_schema.tables WHERE table_schema = 'main'"
+			).fetchall()
+		}
+		existing_tables = {name for name, table_type in existing.items() if table_type != "VIEW"}
+
+		for table_name, path in sources.items():
+			files = _partition_files(path) if path.is_dir() else [path]
+			stats = {str(file): (stat.st_size, stat.st_mtime_ns) for file, stat in ((file, file.stat()) for file in files)}
+			fingerprint = (
+				str(path),
+				sum(size for size, _ in stats.values()),
+				max((mtime for _, mtime in stats.values()), default=0)
+			)
+
+			if manifest.get(table_name) == fingerprint and table_name in existing_tables:
+				self.registered_files[table_name] = path
+				report["reused"].append(table_name)
+				continue
+
+			try:
+				file_start = time.time()
+				self.connection.execute("BEGIN TRANSACTION")
+
+				new_files = None
+				if path.is_dir() and table_name in existing_tables and manifest.get(table_name, ("",))[0] == str(path):
+					ingested = {
+						row[0]: (row[1], row[2])
+						for row in self.connection.execute(
+							"SELECT file_path, file_size, file_mtime_ns FROM _ingest_files WHERE table_name = ?", [table_name]
+						).fetchall()
+					}
+					# Append only when every ingested file is still there unchanged
+					if ingested and len(stats) > len(ingested) and all(stats.get(file) == stat for file, stat in ingested.items()):
+						new_files = [file for file in stats if file not in ingested]
+
+				if new_files is not None:
+					self.connection.execute(
+						f"INSERT INTO {table_name} BY NAME SELECT * FROM {_read_parquet_sql(path, new_files)}"
+					)
+				else:
+					# DuckDB refuses DROP VIEW IF EXISTS when the name is a table
+					if existing.get(table_name) == "VIEW":
+						self.connection.execute(f"DROP VIEW {table_name}")
+					self.connection.execute(
+						f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM {_read_parquet_sql(path, list(stats))}"
+					)
+					self.connection.execute("DELETE FROM _ingest_files WHERE table_name = ?", [table_name])
+					new_files = list(stats) if path.is_dir() else []
+
+				if new_files:
+					self.connection.executemany(
+						"INSERT INTO _ingest_files VALUES (?, ?, ?, ?)",
+						[[table_name, file, *stats[file]] for file in new_files]
+					)
+				row_count = self.connection.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+				self.connection.execute(
+					"INSERT OR REPLACE INTO _ingest_manifest VALUES (?, ?, ?, ?, ?, now())",
+					[table_name, *fingerprint, row_count]
+				)
+				self.connection.execute("COMMIT")
+
+				self.registered_files[table_name] = path
+				appended = table_name in existing_tables and path.is_dir() and len(new_files) < len(stats)
+				report["appended" if appended else "reloaded"].append(table_name)
+				logger.info(
+					f"Ingested {path} into table {table_name}: "
+					f"{len(new_files) if appended else len(stats)} file(s), {row_count} rows in {time.time() - file_start:.2f}s"
+				)
+			except Exception as e:
+				self.connection.execute("ROLLBACK")
+				report["failed"].append(table_name)
+				logger.error(f"Failed to ingest Parquet source {path}: {e}")
+
+		# Tables whose source disappeared
+		for table_name in sorted(set(manifest) - set(sources)):
+			self.connection.execute(f"DROP TABLE IF EXISTS {table_name}")
+			self.connection.execute("DELETE FROM _ingest_manifest WHERE table_name = ?", [table_name])
+			self.connection.execute("DELETE FROM _ingest_files WHERE table_name = ?", [table_name])
+			self.registered_files.pop(table_name, None)
+			report["dropped"].append(table_name)
+
+		if report["reloaded"] or report["appended"] or report["dropped"]:
+			self.connection.execute("CHECKPOINT")
+
+		report["duration"] = round(time.time() - start_time, 3)
+		self.ingest_report = report
+		logger.info(
+			"Ingest report: reused %s, reloaded %s, appended %s, dropped %s, failed %s (%.2fs)",
+			report["reused"], report["reloaded"], report["appended"], report["dropped"], report["failed"], report["duration"]
+		)
+
+	def data_fingerprint(self) -> str:
+		"""
+		Data version and a hash of name, size and mtime of every registered data source.
+		While the watcher runs it keeps the stored value current, so queries do not stat the files;
+		in shared mode it is the published version.
+		Without it a partitioned dataset counts by its directory, whose mtime changes when the converter
+		rewrites its layout file, so the per-query cost does not grow with the number of partitions.
+		"""
+		if self.watching or self.shared:
+			return self._fingerprint
+
+		signatures = {}
+		for table_name, path in self.registered_files.items():
+			try:
+				stat = path.stat()
+				signatures[table_name] = (stat.st_size, stat.st_mtime_ns)
+			except OSError:
+				signatures[table_name] = ("missing",)
+		return self._compute_fingerprint(signatures)
+
+	def _compute_fingerprint(self, signatures: Dict[str, tuple]) -> str:
+		return f"{self.data_version}-{self._signature_hash(signatures)}"
+
+	@staticmethod
+	def _signature_hash(signatures: Dict[str, Any]) -> str:
+		fingerprint = hashlib.sha1()
+		for table_name, signature in sorted(signatures.items()):
+			fingerprint.update(f"{table_name}:{':'.join(map(str, signature))};".encode())
+		return fingerprint.hexdigest()[:12]
+
+	def execution_sql(self, sql: str) -> str:
+		"""The query as it runs: routed to a rollup, or with partition predicates added, or unchanged"""
+		return self.rollups.rewrite(sql) or self.partitions.rewrite(sql) or sql
 
 	def execute_query(self, query: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+		table, _ = self.execute_arrow(query)
+		return table.to_pylist(), table.column_names
+
+	def execute_arrow(self, query: str, max_rows: Optional[int] = None) -> Tuple[pa.Table, bool]:
+		"""
+		Execute a query and return (Arrow table, truncated).
+		The row limit is pushed into the query so DuckDB stops producing rows past it.
+		"""
 		if not self.connection:
 			self.connect()
 
@@ -60,22 +580,76 @@ class Database:
 			if settings.log_sql_queries:
 				logger.info("Executing SQL query: %s", query)
 
-			result = self.connection.execute(query)
-			columns = [desc[0] for desc in result.description] if result.description else []
+			table, truncated = self._fetch_limited(self._cursor(), query, max_rows)
+			logger.info(f"Query executed successfully, returned {table.num_rows} rows.")
+			return table, truncated
+		except Exception as e:
+			logger.error("Failed to execute query: %s", e)
+			raise
+
+	def execute_profiled(self, query: str, max_rows: Optional[int] = None) -> Tuple[pa.Table, bool, Dict[str, Any]]:
+		"""
+		execute_arrow with DuckDB profiling enabled; also returns the JSON profile (operator tree).
+		Profiling is a per-connection setting, so it runs on a cursor of its own.
+		"""
+		if not self.connection:
+			self.connect()
 
-			rows = result.fetchall()
+		descriptor, profile_path = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+		os.close(descriptor)
+		cursor = self.connection.cursor()
+		try:
+			cursor.execute("PRAGMA enable_profiling='json'")
+			cursor.execute(f"PRAGMA profiling_output='{profile_path}'")
+			table, truncated = self._fetch_limited(cursor, query, max_rows)
+
+			with open(profile_path, encoding="utf-8") as file:
+				profile = json.load(file)
+			return table, truncated, profile
+		finally:
+			cursor.close()
+			os.unlink(profile_path)
+
+	def _fetch_limited(self, cursor: duckdb.DuckDBPyConnection, query: str, max_rows: Optional[int]) -> Tuple[pa.Table, bool]:
+		limit = settings.max_result_rows if max_rows is None else max_rows
+
+		# One extra row tells whether the result was cut off
+		limited_query = f"SELECT * FROM (\n{query}\n) AS _limited LIMIT {limit + 1}"
+		table = cursor.execute(limited_query).arrow()
+
+		truncated = table.num_rows > limit
+		if truncated:
+			logger.warning("Query result exceeds max rows (%d). Truncated.", limit)
+			table = table.slice(0, limit)
+		return table, truncated
+
+	def open_stream(self, query: str, batch_rows: int, max_rows: int = 0, cursor: Optional[duckdb.DuckDBPyConnection] = None) -> ArrowStream:
+		"""
+		Start a query whose result is consumed incrementally; the caller must close the stream.
+		A cursor passed in (one another thread can interrupt) is owned by the stream from here on.
+		"""
+		if not self.connection:
+			self.connect()
 
-			if len(rows) > settings.max_result_rows:
-				logger.warning("Query result exceeds max rows (%d). Truncating to %d rows.", len(rows), settings.max_result_rows)
-				rows = rows[:settings.max_result_rows]
+		if max_rows > 0:
+			query = f"SELECT * FROM (\n{query}\n) AS _limited LIMIT {max_rows}"
 
-			results = [dict(zip(columns, row)) for row in rows]
+		if settings.log_sql_queries:
+			logger.info("Streaming SQL query: %s", query)
 
-			logger.info(f"Query executed successfully, returned {len(results)} rows.")
-			return results, columns
-		except Exception as e:
-			logger.error("Failed to execute query: %s", e)
+		cursor = cursor or self.connection.cursor()
+		try:
+			reader = cursor.execute(query).fetch_record_batch(batch_rows)
+		except Exception:
+			cursor.close()
 			raise
+		return ArrowStream(cursor, reader)
+
+	def count_rows(self, query: str) -> int:
+		if not self.connection:
+			self.connect()
+
+		return self._cursor().execute(f"SELECT COUNT(*) FROM (\n{query}\n) AS _counted").fetchone()[0]
 
 	def get_tables(self) -> List[str]:
 		if not self.connection:
@@ -85,10 +659,10 @@ class Database:
 			sql = """
 				SELECT table_name
 				FROM information_schema.tables
-				WHERE table_schema = 'main'
+				WHERE table_schema = 'main' AND NOT starts_with(table_name, '_')
 				ORDER BY table_name
 			"""
-			result = self.connection.execute(sql).fetchall()
+			result = self._cursor().execute(sql).fetchall()
 			tables = [row[0] for row in result]
 
 			logger.info(f"📋 Found tables: {len(tables)}")
@@ -104,7 +678,7 @@ class Database:
 
 		try:
 			sql = f"DESCRIBE {table_name}"
-			result = self.connection.execute(sql).fetchall()
+			result = self._cursor().execute(sql).fetchall()
 
 			schema = [
 				{"name": row[0], "type": row[1]}
@@ -132,29 +706,93 @@ class Database:
 			return []
 
 	def validate_sql(self, sql: str) -> Tuple[bool, Optional[str]]:
-		sql_upper = sql.strip().upper()
-		dangerous_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE', 'TRUNCATE']
-
-		for keyword in dangerous_keywords:
-			if keyword in sql_upper:
-				return False, f"Forbidden operation: {keyword}. Only SELECT queries are allowed."
-
-		if not sql_upper.startswith('SELECT'):
-			return False, "Only SELECT queries are allowed."
-
+		"""
+		Parse-only check: a single SELECT statement over known tables, without file-reading table functions.
+		Binding and planning happen once, when the statement is executed; binder errors surface there.
+		Verdicts are cached by SQL hash per schema version.
+		"""
 		if not self.connection:
 			self.connect()
 
+		key = (self.schema_version, hashlib.sha1(sql.encode("utf-8")).hexdigest())
+		with self._verdicts_lock:
+			verdict = self._verdicts.get(key)
+			if verdict is not None:
+				self._verdicts.move_to_end(key)
+				self.validation_stats["hits"] += 1
+				return verdict
+			self.validation_stats["misses"] += 1
+
+		verdict = self._parse_sql(sql)
+		with self._verdicts_lock:
+			self._verdicts[key] = verdict
+			while len(self._verdicts) > settings.validation_cache_size:
+				self._verdicts.popitem(last=False)
+		return verdict
+
+	def _parse_sql(self, sql: str) -> Tuple[bool, Optional[str]]:
+		cursor = self._cursor()
 		try:
-			self.connection.execute(f"EXPLAIN {sql}")
-			return True, None
+			# json_serialize_sql only parses, and only serializes SELECT statements
+			literal = "'" + sql.replace("'", "''") + "'"
+			tree = json.loads(cursor.execute(f"SELECT json_serialize_sql({literal})").fetchone()[0])
+		except Exception as e:
+			return False, f"Invalid SQL: {str(e)}"
+
+		if tree.get("error"):
+			message = tree.get("error_message", "")
+			if "Only SELECT" in message:
+				return False, "Only SELECT queries are allowed."
+			return False, f"Invalid SQL: {message}"
+
+		if len(tree.get("statements", [])) != 1:
+			return False, "Only a single SELECT statement is allowed."
+
+		for function in _table_functions(tree["statements"]):
+			name = function.lower()
+			if name.startswith(_EXTERNAL_FUNCTION_PREFIXES) or name in _EXTERNAL_FUNCTIONS:
+				return False, f"Forbidden table function: {function}. Query the registered tables instead."
 
+		try:
+			# CTE names are not reported, only catalog references
+			referenced = cursor.get_table_names(sql)
 		except Exception as e:
 			return False, f"Invalid SQL: {str(e)}"
 
+		known = self._catalog_tables(cursor)
+		missing = sorted(name for name in referenced if name.lower() not in known)
+		if missing:
+			return False, f"Invalid SQL: Catalog Error: Table with name {missing[0]} does not exist!"
+
+		return True, None
+
+	def _catalog_tables(self, cursor: duckdb.DuckDBPyConnection) -> frozenset:
+		"""Lower-cased table and view names, read once per schema version"""
+		version, tables = self._known_tables
+		if version != self.schema_version or not tables:
+			rows = cursor.execute("SELECT table_name FROM information_schema.tables").fetchall()
+			tables = frozenset(row[0].lower() for row in rows)
+			self._known_tables = (self.schema_version, tables)
+		return tables
+
 	def close(self):
+		# A build in progress holds a cursor of the connection
+		self.indexes.wait()
+
+		if self._executor:
+			self._executor.shutdown(wait=True)
+			self._executor = None
+
+		with self._cursors_lock:
+			for cursor in self._cursors + self._retired:
+				cursor.close()
+			self._cursors.clear()
+			self._retired.clear()
+		self._local = threading.local()
+
 		if self.connection:
 			self.connection.close()
+			self.connection = None
 			logger.info("🔌 DuckDB connection closed")
 
 
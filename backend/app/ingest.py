@@ -0,0 +1,148 @@
+"""
+Single writer for duckdb_mode = "shared"
+
+Workers open the published DuckDB snapshot read-only, and DuckDB does not let a writer open a file
+that readers hold, so every ingest goes to a new snapshot: the current one is copied, the changed
+data sources are ingested into the copy (incrementally, as in persistent mode), rollups, lookup
+indexes and the schema digest are built, and the snapshot is published by atomically replacing
+the shared version file.
+Workers notice the new version on their next poll and switch to it.
+
+Usage (from backend/): python -m app.ingest [--watch SECONDS] [--force]
+"""
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .config import settings
+from .database import Database, data_sources, read_shared_version, source_signature
+from .services.schema_digest import get_schema_digest
+
+logger = logging.getLogger (__name__)
+
+
+def _snapshot_path (version: int) -> Path:
+	base = Path (settings.duckdb_file)
+	return base.with_name (f"{base.stem}.{version}{base.suffix}")
+
+
+def _current_signatures () -> Dict[str, list]:
+	data_path = Path (settings.database_path)
+	if not data_path.exists ():
+		return {}
+	# Lists, as they come back from the JSON version file
+	return {table_name: list (source_signature (path)) for table_name, path in data_sources (data_path).items ()}
+
+
+def _publish (version_file: Path, state: Dict[str, Any]):
+	partial = version_file.with_name (f".{version_file.name}.partial")
+	partial.write_text (json.dumps (state, ensure_ascii = False, default = str), encoding = "utf-8")
+	partial.replace (version_file)
+
+
+def _remove_old_snapshots (version: int):
+	"""Keep the newest shared_keep_snapshots; workers still reading an older one keep it open until they switch"""
+	base = Path (settings.duckdb_file)
+	for path in base.parent.glob (f"{base.stem}.*{base.suffix}*"):
+		number = path.name[len (base.stem) + 1:].split (".", 1)[0]
+		if number.isdigit () and int (number) <= version - max (settings.shared_keep_snapshots, 1):
+			path.unlink (missing_ok = True)
+			logger.info (f"Removed old snapshot {path}")
+
+
+def ingest_once (force: bool = False) -> Optional[int]:
+	"""Publish a new snapshot if a data source changed since the last one; returns its version or None"""
+	version_file = Path (settings.shared_version_file)
+	state = read_shared_version (version_file) or {"version": 0, "sources": {}}
+	signatures = _current_signatures ()
+
+	if state.get ("file") and signatures == state.get ("sources") and not force:
+		logger.info (f"Data unchanged since version {state['version']}")
+		return None
+
+	version = state["version"] + 1
+	target = _snapshot_path (version)
+	target.parent.mkdir (parents = True, exist_ok = True)
+
+	# Start from the current snapshot (or a persistent-mode file) so unchanged tables are reused
+	previous = target.with_name (state["file"]) if state.get ("file") else Path (settings.duckdb_file)
+	if previous.exists ():
+		shutil.copyfile (previous, target)
+
+	start_time = time.time ()
+	db = Database (mode = "persistent", database_file = str (target))
+	try:
+		db.connect ()
+		db.indexes.wait ()
+		# Workers open the snapshot read-only and load the digest instead of scanning every table
+		get_schema_digest ().refresh (db)
+		db.connection.execute ("CHECKPOINT")
+		report = dict (db.ingest_report)
+		indexes = db.indexes.stats ()
+	except Exception:
+		db.close ()
+		target.unlink (missing_ok = True)
+		raise
+	db.close ()
+
+	if report.get ("failed"):
+		logger.warning (f"Failed to ingest {report['failed']}, their previous data is kept in the snapshot")
+
+	_publish (version_file, {
+		"version": version,
+		"file": target.name,
+		"published_at": time.time (),
+		"sources": signatures,
+		"report": report,
+		"indexes": indexes
+	})
+	logger.info (f"Published snapshot {target} as data version {version} in {time.time () - start_time:.2f}s")
+
+	_remove_old_snapshots (version)
+	return version
+
+
+def main () -> int:
+	parser = argparse.ArgumentParser (description = "Ingest data files into a new shared DuckDB snapshot")
+	parser.add_argument ("--watch", type = float, default = 0, metavar = "SECONDS", help = "Keep running and ingest changes every SECONDS")
+	parser.add_argument ("--force", action = "store_true", help = "Publish a new snapshot even if no data file changed")
+	args = parser.parse_args ()
+
+	logging.basicConfig (level = settings.log_level, format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+	# One writer at a time: a second one would publish a snapshot missing the first one's changes
+	lock_path = Path (settings.shared_version_file).with_suffix (".lock")
+	lock_path.parent.mkdir (parents = True, exist_ok = True)
+	lock_file = open (lock_path, "w")
+	try:
+		fcntl.flock (lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+	except BlockingIOError:
+		logger.error (f"Another writer holds {lock_path}")
+		return 1
+	lock_file.write (str (os.getpid ()))
+	lock_file.flush ()
+
+	try:
+		ingest_once (force = args.force)
+		while args.watch > 0:
+			time.sleep (args.watch)
+			try:
+				ingest_once ()
+			except Exception as e:
+				logger.error (f"Ingest failed: {e}")
+		return 0
+	finally:
+		fcntl.flock (lock_file, fcntl.LOCK_UN)
+		lock_file.close ()
+
+
+if __name__ == "__main__":
+	sys.exit (main ())
@@ -6,11 +6,16 @@ FastAPI приложение для text-to-SQL чат-бота
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
+import time
 from logging.config import dictConfig
 
 from .config import settings
 from .database import get_database
+from .metrics import REQUEST_DURATION
+from .services.ml_service import get_ml_service
+from .services.query_jobs import get_query_job_manager
 from .api import router
 
 # Настройка логирования
@@ -50,21 +55,51 @@ async def lifespan (app: FastAPI):
 	logger.info (f"🤖 ML сервис: {settings.ml_service_url}")
 
 	# Подключаемся к БД
+	watcher = None
+	if settings.workers > 1 and settings.duckdb_mode == "persistent":
+		# Каждый воркер открыл бы файл БД на запись: второй процесс не получит блокировку
+		raise RuntimeError ("persistent режим открывает файл БД на запись одним процессом, для нескольких воркеров нужен DUCKDB_MODE=shared")
 	try:
 		db = get_database ()
 		tables = db.get_tables ()
+		logger.info (f"📦 Загрузка данных: {db.ingest_report}")
 		logger.info (f"✅ База данных подключена. Таблиц: {len (tables)}")
 		if tables:
 			logger.info (f"📋 Доступные таблицы: {', '.join (tables)}")
 		else:
 			logger.warning ("⚠️  Нет доступных таблиц в БД")
+		# Новые, измененные и удаленные файлы данных подхватываются без перезапуска
+		if settings.data_watch_interval > 0:
+			watcher = asyncio.create_task (db.watch (settings.data_watch_interval))
 	except Exception as e:
 		logger.error (f"❌ Ошибка подключения к БД: {e}")
 
+	# Один HTTP клиент с пулом соединений на всё время жизни приложения
+	await get_ml_service ().start ()
+
+	# Фоновые запросы: незавершенные задачи предыдущего запуска помечаются failed, истекшие удаляются
+	try:
+		get_query_job_manager ()
+	except Exception as e:
+		logger.error (f"❌ Ошибка инициализации фоновых запросов: {e}")
+
 	yield
 
 	# Shutdown
 	logger.info ("🛑 Остановка Agentic Analyst Backend...")
+	if watcher is not None:
+		watcher.cancel ()
+		try:
+			await watcher
+		except asyncio.CancelledError:
+			pass
+	await get_ml_service ().close ()
+	try:
+		# Выполняющиеся задачи прерываются, следующий запуск пометит их failed
+		await asyncio.to_thread (get_query_job_manager ().close)
+	except Exception as e:
+		logger.error (f"❌ Ошибка при остановке фоновых запросов: {e}")
+
 	try:
 		db = get_database ()
 		db.close ()
@@ -111,8 +146,16 @@ async def root ():
 			"docs": "/docs",
 			"health": "/health",
 			"query": "/query",
+			"query_stream": "/query/stream",
+			"query_batch": "/query/batch",
+			"query_jobs": "/query/jobs",
 			"tables": "/tables",
-			"schema": "/schema/{table_name}"
+			"schema": "/schema/{table_name}",
+			"cache_stats": "/cache/stats",
+			"metrics": "/metrics",
+			"slow_queries": "/slow-queries",
+			"ingest_refresh": "/ingest/refresh",
+			"ingest_indexes": "/ingest/indexes"
 		}
 	}
 
@@ -120,10 +163,18 @@ async def root ():
 # Middleware для логирования запросов
 @app.middleware ("http")
 async def log_requests (request, call_next):
-	"""Логирование всех HTTP запросов"""
+	"""Логирование всех HTTP запросов с длительностью"""
 	logger.info (f"📨 {request.method} {request.url.path}")
+	start_time = time.perf_counter ()
 	response = await call_next (request)
-	logger.info (f"📤 {request.method} {request.url.path} - {response.status_code}")
+	duration = time.perf_counter () - start_time
+
+	# Route template instead of the raw path, so /schema/{table_name} is one series
+	route = request.scope.get ("route")
+	path = route.path if route is not None else "unmatched"
+	REQUEST_DURATION.observe (duration, request.method, path, str (response.status_code))
+
+	logger.info (f"📤 {request.method} {request.url.path} - {response.status_code} ({duration * 1000:.1f} ms)")
 	return response
 
 
@@ -134,6 +185,8 @@ if __name__ == "__main__":
 		"app.main:app",
 		host = "0.0.0.0",
 		port = 8000,
-		reload = settings.dev_mode,
+		# Reload runs a single process
+		reload = settings.dev_mode and settings.workers == 1,
+		workers = settings.workers,
 		log_level = settings.log_level.lower ()
 	)
\ No newline at end of file
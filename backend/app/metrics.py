@@ -0,0 +1,130 @@
+"""
+Latency histograms in Prometheus text format and per-request stage timers
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Seconds, from a cached answer to a slow model call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape (value: str) -> str:
+	return value.replace ("\\", "\\\\").replace ("\n", "\\n").replace ('"', '\\"')
+
+
+def _format_labels (pairs: List[Tuple[str, str]]) -> str:
+	if not pairs:
+		return ""
+	return "{" + ",".join (f'{name}="{_escape (value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+	"""Cumulative bucket counts, sum and count per label set; observed from the event loop and the DuckDB pool"""
+
+	def __init__ (self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+		self.name = name
+		self.documentation = documentation
+		self.label_names = label_names
+		self.buckets = tuple (sorted (buckets))
+		self._series: Dict[Tuple[str, ...], List[float]] = {}
+		self._lock = threading.Lock ()
+
+	def observe (self, value: float, *label_values: str):
+		# Per series: one count per bucket plus +Inf, then the sum
+		index = bisect.bisect_left (self.buckets, value)
+		with self._lock:
+			series = self._series.get (label_values)
+			if series is None:
+				series = self._series[label_values] = [0.0] * (len (self.buckets) + 2)
+			series[index] += 1
+			series[-1] += value
+
+	def render (self) -> List[str]:
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+		with self._lock:
+			series = {labels: list (values) for labels, values in self._series.items ()}
+
+		for label_values, values in sorted (series.items ()):
+			labels = list (zip (self.label_names, label_values))
+			cumulative = 0
+			for bound, count in zip (self.buckets + (float ("inf"),), values):
+				cumulative += count
+				le = "+Inf" if bound == float ("inf") else repr (bound)
+				lines.append (f"{self.name}_bucket{_format_labels (labels + [('le', le)])} {int (cumulative)}")
+			lines.append (f"{self.name}_sum{_format_labels (labels)} {values[-1]}")
+			lines.append (f"{self.name}_count{_format_labels (labels)} {int (cumulative)}")
+		return lines
+
+
+class MetricsRegistry:
+	def __init__ (self):
+		self._metrics: List[Histogram] = []
+
+	def histogram (self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+		metric = Histogram (name, documentation, label_names, buckets)
+		self._metrics.append (metric)
+		return metric
+
+	def render (self) -> str:
+		return "\n".join (line for metric in self._metrics for line in metric.render ()) + "\n"
+
+
+registry = MetricsRegistry ()
+
+REQUEST_DURATION = registry.histogram (
+	"http_request_duration_seconds",
+	"HTTP request duration until the response headers are sent",
+	("method", "path", "status")
+)
+QUERY_STAGE_DURATION = registry.histogram (
+	"query_stage_duration_seconds",
+	"Duration of one stage of answering a question",
+	("stage",)
+)
+
+
+class StageTimer:
+	"""
+	Durations of the stages of one request. Every stage is observed into QUERY_STAGE_DURATION;
+	stages measured elsewhere (and already observed there) are merged with observe = False.
+	"""
+
+	def __init__ (self):
+		self.started = time.perf_counter ()
+		self.stages: Dict[str, float] = {}
+
+	@contextmanager
+	def stage (self, name: str) -> Iterator[None]:
+		started = time.perf_counter ()
+		try:
+			yield
+		finally:
+			self.add (name, time.perf_counter () - started)
+
+	def add (self, name: str, seconds: float, observe: bool = True):
+		self.stages[name] = self.stages.get (name, 0.0) + seconds
+		if observe:
+			QUERY_STAGE_DURATION.observe (seconds, name)
+
+	def merge (self, stages: Optional[Dict[str, float]]):
+		for name, seconds in (stages or {}).items ():
+			self.add (name, seconds, observe = False)
+
+	def finish (self) -> Dict[str, float]:
+		"""Stage durations and the total in milliseconds"""
+		total = time.perf_counter () - self.started
+		QUERY_STAGE_DURATION.observe (total, "total")
+		timings = {name: round (seconds * 1000, 2) for name, seconds in self.stages.items ()}
+		timings["total"] = round (total * 1000, 2)
+		return timings
+
+	@staticmethod
+	def server_timing (timings: Dict[str, float]) -> str:
+		"""Server-Timing header value, shown by browser dev tools"""
+		return ", ".join (f"{name};dur={duration}" for name, duration in timings.items ())
@@ -6,6 +6,9 @@ from pydantic import BaseModel, Field
 
 class QueryRequest(BaseModel):
 	text: str = Field(..., description="The text to be processed", min_length=1)
+	include_total_count: bool = Field(False, description="Count all rows of a truncated result (runs an extra COUNT query)")
+	include_timings: bool = Field (False, description = "Return the duration of every stage (in the Server-Timing header for columnar and arrow results)")
+	profile: bool = Field (False, description = "Run the query with DuckDB profiling, bypassing the result cache, and return the operator tree")
 
 	class Config:
 		json_schema_extra = {
@@ -21,8 +24,13 @@ class QueryResponse(BaseModel):
 	results: List[Dict[str, Any]] = Field(default_factory=list, description="The result of the query execution")
 	columns: List[str] = Field (default_factory = list, description = "Names of the columns in the result set")
 	row_count: int = Field (0, description = "Count of rows in the result set")
+	truncated: bool = Field (False, description = "True if the result was cut off at max_result_rows")
+	total_count: Optional[int] = Field (None, description = "Exact number of rows before truncation, if requested")
 	execution_time: Optional[float] = Field (None, description = "Execution time of the query in seconds")
+	cached: bool = Field (False, description = "True if the result was served from the result cache")
 	error: Optional[str] = Field (None, description = "Error message if query failed")
+	timings: Optional[Dict[str, float]] = Field (None, description = "Stage durations in milliseconds, if requested")
+	profile: Optional[Dict[str, Any]] = Field (None, description = "DuckDB operator tree with time (seconds) and cardinality per operator, if requested")
 
 	class Config:
 		json_schema_extra = {
@@ -35,12 +43,78 @@ class QueryResponse(BaseModel):
 				],
 				"columns": ["merchant_name", "revenue"],
 				"row_count": 2,
+				"truncated": False,
+				"total_count": None,
 				"execution_time": 0.15,
+				"cached": False,
 				"error": None
 			}
 		}
 
 
+class BatchQueryRequest (BaseModel):
+	questions: List[str] = Field (..., description = "Questions to answer, duplicates are answered once", min_length = 1)
+	include_total_count: bool = Field (False, description = "Count all rows of truncated results")
+
+	class Config:
+		json_schema_extra = {
+			"example": {
+				"questions": ["Top 5 merchants by revenue", "Transactions per channel"]
+			}
+		}
+
+
+class BatchQueryResponse (BaseModel):
+	results: List[QueryResponse] = Field (default_factory = list, description = "One result per question, in request order")
+	count: int = Field (0, description = "Number of questions")
+	unique_questions: int = Field (0, description = "Questions left after deduplication")
+	execution_time: Optional[float] = Field (None, description = "Total time of the batch in seconds")
+
+
+class QueryJobRequest (BaseModel):
+	text: str = Field (..., description = "Question to answer in the background", min_length = 1)
+
+	class Config:
+		json_schema_extra = {
+			"example": {
+				"text": "All transactions of 2023 with their merchants"
+			}
+		}
+
+
+class QueryJobResponse (BaseModel):
+	"""State and progress of a background query"""
+	job_id: str = Field (..., description = "Job ID for polling, cancelling and fetching results")
+	question: str = Field (..., description = "The original question text")
+	state: str = Field (..., description = "queued, running, done, failed or cancelled")
+	stage: str = Field (..., description = "generating, waiting (for an execution slot), executing or writing")
+	sql: Optional[str] = Field (None, description = "The generated SQL query, once generated")
+	error: Optional[str] = Field (None, description = "Error message if the job failed")
+	columns: List[str] = Field (default_factory = list, description = "Names of the columns in the result set")
+	row_count: int = Field (0, description = "Rows written so far; all rows once done")
+	submitted_at: float = Field (..., description = "Unix time of submission")
+	started_at: Optional[float] = Field (None, description = "Unix time the query started executing")
+	finished_at: Optional[float] = Field (None, description = "Unix time the job finished")
+	expires_at: Optional[float] = Field (None, description = "Unix time the job and its result are deleted")
+	elapsed: Optional[float] = Field (None, description = "Execution time so far in seconds")
+	data_version: int = Field (0, description = "Data version the job was submitted at")
+
+
+class QueryJobListResponse (BaseModel):
+	jobs: List[QueryJobResponse] = Field (default_factory = list, description = "Jobs of all workers, newest first")
+	stats: Dict[str, Any] = Field (default_factory = dict, description = "Job pool of this worker: running and queued jobs, counters")
+
+
+class QueryJobResultsResponse (BaseModel):
+	job_id: str = Field (..., description = "Job ID")
+	columns: List[str] = Field (default_factory = list, description = "Names of the columns in the result set")
+	results: List[Dict[str, Any]] = Field (default_factory = list, description = "Rows of this page")
+	offset: int = Field (0, description = "Position of the first row of the page")
+	row_count: int = Field (0, description = "Rows in this page")
+	total_rows: int = Field (0, description = "Rows in the whole result")
+	next_offset: Optional[int] = Field (None, description = "Offset of the next page, null after the last one")
+
+
 class ErrorResponse (BaseModel):
 	"""Standard error format"""
 	error: str = Field (..., description = "Error description")
@@ -63,6 +137,7 @@ class HealthResponse (BaseModel):
 	timestamp: datetime = Field (default_factory = datetime.now)
 	database: str = Field ("connected", description = "Database status")
 	ml_service: str = Field ("unknown", description = "ML service status")
+	data_version: int = Field (0, description = "Incremented whenever registered data files change")
 
 
 class TableInfo (BaseModel):
@@ -107,3 +182,15 @@ class TableSchemaResponse (BaseModel):
 				]
 			}
 		}
+
+
+class CacheStatsResponse (BaseModel):
+	"""Cache counters"""
+	question_cache: Optional[Dict[str, Any]] = Field (None, description = "Question -> SQL cache stats, null if disabled")
+	result_cache: Optional[Dict[str, Any]] = Field (None, description = "Query result cache stats, null if disabled")
+	ml_client: Dict[str, Any] = Field (default_factory = dict, description = "ML service connection pool stats")
+	query_history: Optional[Dict[str, Any]] = Field (None, description = "Stored question -> SQL examples and reused answers, null if disabled")
+	rollups: Dict[str, Any] = Field (default_factory = dict, description = "Rollup tables (row counts) and rewritten query count")
+	partitions: Dict[str, Any] = Field (default_factory = dict, description = "Partitioned tables (partition keys) and queries given partition filters")
+	coalescing: Dict[str, Any] = Field (default_factory = dict, description = "Requests that shared an in-flight SQL generation or execution")
+	validation: Dict[str, Any] = Field (default_factory = dict, description = "Cached SQL validation verdicts: hits and misses")
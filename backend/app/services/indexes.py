@@ -0,0 +1,145 @@
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import duckdb
+
+from ..config import settings
+
+logger = logging.getLogger (__name__)
+
+
+def _quote (identifier: str) -> str:
+	return '"' + identifier.replace ('"', '""') + '"'
+
+
+def index_name (table: str, column: str) -> str:
+	return f"_idx_{table}_{re.sub (r'[^0-9a-zA-Z]+', '_', column).strip ('_').lower ()}"
+
+
+class IndexManager:
+	"""
+	ART indexes on the point-lookup columns of a materialized table (persistent mode), so
+	"all transactions of account X" reads a few rows instead of scanning the table.
+	Built one column at a time on a background thread while queries keep running.
+	Columns with many rows per value are skipped: DuckDB's ART build time grows steeply
+	with duplicate keys, and such lookups return enough rows that a scan is as fast.
+	"""
+
+	def __init__ (self):
+		self.table = settings.index_table
+		self.columns = [column.strip () for column in settings.index_columns.split (",") if column.strip ()]
+		self.max_rows_per_key = settings.index_max_rows_per_key
+		self.state = "idle"
+		self.progress: Dict[str, Dict[str, Any]] = {}
+		self.started_at: Optional[float] = None
+		self.finished_at: Optional[float] = None
+		self._thread: Optional[threading.Thread] = None
+		self._rerun = False
+		self._lock = threading.Lock ()
+
+	def start (self, connection: duckdb.DuckDBPyConnection, table_lock: threading.Lock):
+		"""
+		Build the missing indexes in the background; table_lock is held per column so the
+		table is not replaced halfway through. A call during a build queues one more pass.
+		"""
+		if not self.columns:
+			return
+		with self._lock:
+			if self._thread is not None and self._thread.is_alive ():
+				self._rerun = True
+				return
+			self._thread = threading.Thread (
+				target = self._run, args = (connection.cursor (), table_lock), name = "duckdb-indexes", daemon = True
+			)
+			self._thread.start ()
+
+	def wait (self, timeout: Optional[float] = None):
+		thread = self._thread
+		if thread is not None:
+			thread.join (timeout)
+
+	def _run (self, cursor: duckdb.DuckDBPyConnection, table_lock: threading.Lock):
+		try:
+			while True:
+				self._build_all (cursor, table_lock)
+				with self._lock:
+					if not self._rerun:
+						self._thread = None
+						return
+					self._rerun = False
+		except Exception as e:
+			self.state = "failed"
+			logger.error (f"Index build failed: {e}")
+			with self._lock:
+				self._thread = None
+		finally:
+			cursor.close ()
+
+	def _build_all (self, cursor: duckdb.DuckDBPyConnection, table_lock: threading.Lock):
+		self.state = "building"
+		self.started_at, self.finished_at = time.time (), None
+		self.progress = {column: {"state": "pending"} for column in self.columns}
+
+		try:
+			columns = {row[0].lower (): row[0] for row in cursor.execute (f"DESCRIBE {self.table}").fetchall ()}
+		except duckdb.Error:
+			self.state = "skipped"
+			logger.info (f"Indexes skipped: no table {self.table}")
+			return
+
+		for column in self.columns:
+			entry = self.progress[column]
+			name = columns.get (column.lower ())
+			if name is None:
+				entry.update (state = "skipped", reason = "no such column")
+				continue
+
+			with table_lock:
+				entry["state"] = "building"
+				started = time.perf_counter ()
+				try:
+					entry.update (self._build (cursor, name))
+				except duckdb.Error as e:
+					entry.update (state = "failed", error = str (e))
+					logger.error (f"Failed to index {self.table}.{name}: {e}")
+				entry["seconds"] = round (time.perf_counter () - started, 3)
+
+		self.state = "ready"
+		self.finished_at = time.time ()
+		logger.info (
+			"Lookup indexes on %s: %s",
+			self.table, ", ".join (f"{column} {entry['state']}" for column, entry in self.progress.items ())
+		)
+
+	def _build (self, cursor: duckdb.DuckDBPyConnection, column: str) -> Dict[str, Any]:
+		name = index_name (self.table, column)
+		existing = cursor.execute (
+			"SELECT COUNT(*) FROM duckdb_indexes() WHERE table_name = ? AND index_name = ?", [self.table, name]
+		).fetchone ()[0]
+		if existing:
+			return {"state": "ready", "index": name}
+
+		rows, distinct = cursor.execute (
+			f"SELECT COUNT(*), approx_count_distinct ({_quote (column)}) FROM {self.table}"
+		).fetchone ()
+		rows_per_key = round (rows / distinct, 1) if distinct else float (rows)
+		if rows_per_key > self.max_rows_per_key:
+			return {"state": "skipped", "reason": f"{rows_per_key} rows per value", "rows_per_key": rows_per_key}
+
+		cursor.execute (f"CREATE INDEX IF NOT EXISTS {name} ON {self.table} ({_quote (column)})")
+		return {"state": "ready", "index": name, "rows_per_key": rows_per_key}
+
+	def stats (self) -> Dict[str, Any]:
+		progress = dict (self.progress)
+		done = sum (1 for entry in progress.values () if entry["state"] not in ("pending", "building"))
+		return {
+			"table": self.table,
+			"state": self.state,
+			"done": done,
+			"total": len (progress),
+			"columns": progress,
+			"elapsed": round ((self.finished_at or time.time ()) - self.started_at, 3) if self.started_at else None
+		}
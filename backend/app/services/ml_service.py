@@ -1,40 +1,368 @@
+import asyncio
 import httpx
 import logging
-from typing import Optional, Dict, Any
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Set, Tuple
 from ..config import settings
+from .similarity import NgramIndex, literal_tokens, normalize_question, same_content_words
+from .query_history import get_query_history
+from .singleflight import SingleFlight
 
 logger = logging.getLogger (__name__)
 
 
+@dataclass
+class _CacheEntry:
+	sql: str
+	normalized: str
+	created_at: float
+
+
+class QuestionCache:
+	"""
+	LRU + TTL cache of question -> SQL, keyed by normalized question and schema version.
+	Near-duplicates are found through a character n-gram index and only served when both
+	questions have the same content words (spelling and spacing aside); questions whose
+	numbers / IDs / dates differ never match each other.
+	"""
+
+	def __init__ (self, max_entries: int, ttl: float, similarity: float):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.similarity = similarity
+		self._entries: "OrderedDict[Tuple[str, str], _CacheEntry]" = OrderedDict ()
+		self._index = NgramIndex ()
+		self.hits = 0
+		self.near_hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get (self, question: str, schema_version: str = "") -> Optional[str]:
+		normalized = normalize_question (question)
+		key = (schema_version, normalized)
+
+		entry = self._live_entry (key)
+		if entry is not None:
+			self.hits += 1
+			return entry.sql
+
+		if self.similarity > 0:
+			literals = literal_tokens (normalized)
+			for candidate, score in self._index.search (normalized, min_score = self.similarity):
+				if candidate[0] != schema_version:
+					continue
+				entry = self._live_entry (candidate)
+				if entry is None or literal_tokens (entry.normalized) != literals:
+					continue
+				# Trigrams barely change between "ascending" and "descending"
+				if not same_content_words (normalized, entry.normalized):
+					continue
+				logger.info (f"Question cache near-duplicate hit ({score:.2f}): '{entry.normalized}'")
+				self.near_hits += 1
+				return entry.sql
+
+		self.misses += 1
+		return None
+
+	def put (self, question: str, sql: str, schema_version: str = ""):
+		normalized = normalize_question (question)
+		key = (schema_version, normalized)
+
+		self._entries[key] = _CacheEntry (sql = sql, normalized = normalized, created_at = time.monotonic ())
+		self._entries.move_to_end (key)
+		self._index.add (key, normalized)
+
+		while len (self._entries) > self.max_entries:
+			old_key, _ = self._entries.popitem (last = False)
+			self._index.remove (old_key)
+			self.evictions += 1
+
+	def invalidate (self, question: str, schema_version: str = ""):
+		key = (schema_version, normalize_question (question))
+		if self._entries.pop (key, None) is not None:
+			self._index.remove (key)
+
+	def clear (self):
+		self._entries.clear ()
+		self._index.clear ()
+
+	def stats (self) -> Dict[str, Any]:
+		lookups = self.hits + self.near_hits + self.misses
+		return {
+			"entries": len (self._entries),
+			"max_entries": self.max_entries,
+			"hits": self.hits,
+			"near_hits": self.near_hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+			"hit_rate": round ((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0
+		}
+
+	def _live_entry (self, key: Tuple[str, str]) -> Optional[_CacheEntry]:
+		entry = self._entries.get (key)
+		if entry is None:
+			return None
+
+		if self.ttl > 0 and time.monotonic () - entry.created_at > self.ttl:
+			del self._entries[key]
+			self._index.remove (key)
+			self.evictions += 1
+			return None
+
+		self._entries.move_to_end (key)
+		return entry
+
+
 class MLService:
 	def __init__ (self):
 		self.ml_url = settings.ml_service_url
 		self.timeout = settings.ml_service_timeout
+		self.question_cache: Optional[QuestionCache] = None
+		self.inflight = SingleFlight ()
+		self.history = get_query_history ()
+		self._known_schemas: Set[str] = set ()
+		self._client: Optional[httpx.AsyncClient] = None
+		self.requests_total = 0
+		self.transport_errors = 0
+		self.in_flight = 0
+
+		if settings.question_cache_enabled:
+			self.question_cache = QuestionCache (
+				max_entries = settings.question_cache_size,
+				ttl = settings.question_cache_ttl,
+				similarity = settings.question_cache_similarity
+			)
+
+	async def text_to_sql (
+			self,
+			question: str,
+			schema_context: Optional[str] = None,
+			schema_version: str = ""
+	) -> Optional[str]:
+		"""schema_version identifies schema_context (its digest hash); cached SQL is keyed by it"""
+		if self.question_cache is not None:
+			cached_sql = self.question_cache.get (question, schema_version)
+			if cached_sql:
+				logger.info (f"Question cache hit: {question}")
+				return cached_sql
+
+		sql = self._reuse_from_history (question)
+		if sql:
+			if self.question_cache is not None:
+				self.question_cache.put (question, sql, schema_version)
+			return sql
+
+		# Identical questions asked at the same time share one ml-service call
+		key = (schema_version, normalize_question (question))
+		examples = self._examples (question)
+		sql = await self.inflight.do (key, lambda: self._request_sql (question, schema_context, schema_version, examples))
+
+		if sql and self.question_cache is not None:
+			self.question_cache.put (question, sql, schema_version)
+
+		return sql
+
+	async def text_to_sql_batch (
+			self,
+			questions: List[str],
+			schema_context: Optional[str] = None,
+			schema_version: str = ""
+	) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+		"""
+		question -> (sql, error) for unique questions. Cached questions are answered locally,
+		the rest go to /generate-sql/batch in chunks sent concurrently.
+		"""
+		results: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+		pending = []
+
+		for question in dict.fromkeys (questions):
+			cached_sql = self.question_cache.get (question, schema_version) if self.question_cache is not None else None
+			if cached_sql:
+				results[question] = (cached_sql, None)
+				continue
+
+			reused_sql = self._reuse_from_history (question)
+			if reused_sql:
+				if self.question_cache is not None:
+					self.question_cache.put (question, reused_sql, schema_version)
+				results[question] = (reused_sql, None)
+			else:
+				pending.append (question)
+
+		if not pending:
+			return results
+
+		size = max (1, settings.ml_service_batch_size)
+		chunks = [pending[i:i + size] for i in range (0, len (pending), size)]
+		generated: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+		failed = []
+		for chunk, chunk_result in zip (chunks, await asyncio.gather (*(self._request_sql_batch (chunk, schema_context, schema_version) for chunk in chunks))):
+			if chunk_result is None:
+				failed.extend (chunk)
+			else:
+				generated.update (chunk_result)
+
+		if failed:
+			# Older ml-service without the batch endpoint, or the call failed: one request per question
+			semaphore = asyncio.Semaphore (settings.ml_service_batch_concurrency)
+
+			async def request_one (question: str) -> Tuple[Optional[str], Optional[str]]:
+				async with semaphore:
+					sql = await self._request_sql (question, schema_context, schema_version, self._examples (question))
+					return sql, None if sql else "ML service returned no SQL"
+
+			generated.update (zip (failed, await asyncio.gather (*(request_one (question) for question in failed))))
 
-	async def text_to_sql (self, question: str, schema_context: Optional[str] = None) -> Optional[str]:
+		for question, (sql, error) in generated.items ():
+			if sql and self.question_cache is not None:
+				self.question_cache.put (question, sql, schema_version)
+			results[question] = (sql, error)
+
+		return results
+
+	async def start (self):
+		if self._client is not None:
+			return
+
+		self._client = httpx.AsyncClient (
+			base_url = self.ml_url,
+			http2 = settings.ml_service_http2,
+			limits = httpx.Limits (
+				max_connections = settings.ml_service_max_connections,
+				max_keepalive_connections = settings.ml_service_max_keepalive,
+				keepalive_expiry = settings.ml_service_keepalive_expiry
+			),
+			timeout = httpx.Timeout (self.timeout, connect = settings.ml_service_connect_timeout)
+		)
+		logger.info (
+			f"ML service client started (max connections: {settings.ml_service_max_connections}, "
+			f"keep-alive: {settings.ml_service_max_keepalive}, http2: {settings.ml_service_http2})"
+		)
+
+	async def close (self):
+		if self._client is None:
+			return
+
+		await self._client.aclose ()
+		self._client = None
+		logger.info ("ML service client closed")
+
+	def pool_stats (self) -> Dict[str, Any]:
+		stats = {
+			"requests": self.requests_total,
+			"transport_errors": self.transport_errors,
+			"in_flight": self.in_flight,
+			"connections": 0,
+			"idle_connections": 0
+		}
+
+		# httpx does not expose pool state publicly, read it from the httpcore pool when present
+		pool = getattr (getattr (self._client, "_transport", None), "_pool", None)
+		connections = list (getattr (pool, "connections", []))
+		stats["connections"] = len (connections)
+		stats["idle_connections"] = sum (1 for connection in connections if connection.is_idle ())
+		return stats
+
+	async def _send (self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+		if self._client is None:
+			# Used outside of the app lifespan (scripts, tests)
+			await self.start ()
+
+		if timeout is not None:
+			kwargs["timeout"] = httpx.Timeout (timeout, connect = settings.ml_service_connect_timeout)
+
+		self.requests_total += 1
+		self.in_flight += 1
 		try:
-			logger.info (f"Sending request to ML service: {question}")
+			return await self._client.request (method, path, **kwargs)
+		except httpx.HTTPError:
+			self.transport_errors += 1
+			raise
+		finally:
+			self.in_flight -= 1
+
+	def remember (self, question: str, sql: str):
+		"""Keep a pair that executed successfully as an example for future questions"""
+		if self.history is not None:
+			self.history.record (question, sql)
+
+	def forget (self, question: str, schema_version: str = "", sql: Optional[str] = None):
+		if self.question_cache is not None:
+			self.question_cache.invalidate (question, schema_version)
+		if sql and self.history is not None:
+			self.history.discard (sql)
 
-			payload = {"question": question}
-			if schema_context:
+	def _reuse_from_history (self, question: str) -> Optional[str]:
+		if self.history is None or not settings.history_reuse_enabled:
+			return None
+		return self.history.reuse (question, settings.history_reuse_similarity)
+
+	def _examples (self, question: str) -> List[Dict[str, str]]:
+		if self.history is None or settings.history_examples <= 0:
+			return []
+		return [
+			{"question": entry.question, "sql": entry.sql}
+			for entry in self.history.examples (question, settings.history_examples, settings.history_example_similarity)
+		]
+
+	async def _post_with_schema (
+			self,
+			path: str,
+			payload: Dict[str, Any],
+			schema_context: Optional[str],
+			schema_hash: Optional[str],
+			timeout: Optional[float] = None
+	) -> httpx.Response:
+		"""
+		Sends the schema once per hash, afterwards only the hash. The ml-service answers 409
+		for a hash it does not know (restart, eviction), then the full schema is sent again.
+		"""
+		if schema_context and schema_hash:
+			payload["schema_hash"] = schema_hash
+			if schema_hash not in self._known_schemas:
 				payload["schema"] = schema_context
+		elif schema_context:
+			payload["schema"] = schema_context
+
+		response = await self._send ("POST", path, timeout = timeout, json = payload)
 
-			async with httpx.AsyncClient (timeout = self.timeout) as client:
-				response = await client.post (
-					f"{self.ml_url}/generate-sql",
-					json = payload
-				)
+		if response.status_code == 409 and schema_context and "schema" not in payload:
+			logger.info (f"ML service does not know schema {schema_hash}, sending it in full")
+			self._known_schemas.discard (schema_hash)
+			payload["schema"] = schema_context
+			response = await self._send ("POST", path, timeout = timeout, json = payload)
 
-				response.raise_for_status ()
-				data = response.json ()
-				sql = data.get ("sql")
+		if response.is_success and schema_context and schema_hash:
+			self._known_schemas.add (schema_hash)
+		return response
 
-				if not sql:
-					logger.error ("ML service returned empty SQL")
-					return None
+	async def _request_sql (
+			self,
+			question: str,
+			schema_context: Optional[str] = None,
+			schema_hash: Optional[str] = None,
+			examples: Optional[List[Dict[str, str]]] = None
+	) -> Optional[str]:
+		try:
+			logger.info (f"Sending request to ML service: {question}")
+
+			# The ml-service gives up on the model call once we would have stopped waiting anyway
+			payload = {"question": question, "timeout": self.timeout}
+			if examples:
+				payload["examples"] = examples
+			response = await self._post_with_schema ("/generate-sql", payload, schema_context, schema_hash)
+			response.raise_for_status ()
+			data = response.json ()
+			sql = data.get ("sql")
 
-				logger.info (f"ML service returned SQL: {sql[:100]}...")
-				return sql
+			if not sql:
+				logger.error ("ML service returned empty SQL")
+				return None
+
+			logger.info (f"ML service returned SQL: {sql[:100]}...")
+			return sql
 
 		except httpx.TimeoutException:
 			logger.error (f"Timeout while contacting ML service ({self.timeout}s)")
@@ -48,11 +376,39 @@ class MLService:
 			logger.error (f"Unexpected error while contacting ML service: {e}")
 			return None
 
+	async def _request_sql_batch (
+			self,
+			questions: List[str],
+			schema_context: Optional[str] = None,
+			schema_hash: Optional[str] = None
+	) -> Optional[Dict[str, Tuple[Optional[str], Optional[str]]]]:
+		try:
+			logger.info (f"Sending batch of {len (questions)} questions to ML service")
+
+			payload = {"questions": questions}
+			examples = {question: self._examples (question) for question in questions}
+			if any (examples.values ()):
+				payload["examples"] = {question: items for question, items in examples.items () if items}
+
+			response = await self._post_with_schema (
+				"/generate-sql/batch",
+				payload,
+				schema_context,
+				schema_hash,
+				timeout = settings.ml_service_batch_timeout
+			)
+			response.raise_for_status ()
+			items = {item["question"]: (item.get ("sql"), item.get ("error")) for item in response.json ().get ("results", [])}
+			return {question: items.get (question, (None, "Missing from ML service batch response")) for question in questions}
+
+		except Exception as e:
+			logger.warning (f"Batch SQL generation failed, falling back to single requests: {e}")
+			return None
+
 	async def check_health (self) -> bool:
 		try:
-			async with httpx.AsyncClient (timeout = 5) as client:
-				response = await client.get (f"{self.ml_url}/health")
-				return response.status_code == 200
+			response = await self._send ("GET", "/health", timeout = settings.ml_service_health_timeout)
+			return response.status_code == 200
 		except Exception as e:
 			logger.warning (f"ML service is unavailable: {e}")
 			return False
@@ -69,10 +425,21 @@ class MLService:
 
 	async def get_model_info (self) -> Dict[str, Any]:
 		try:
-			async with httpx.AsyncClient (timeout = 5) as client:
-				response = await client.get (f"{self.ml_url}/model-info")
-				response.raise_for_status ()
-				return response.json ()
+			response = await self._send ("GET", "/model-info", timeout = settings.ml_service_health_timeout)
+			response.raise_for_status ()
+			return response.json ()
 		except Exception as e:
 			logger.error (f"Error retrieving model info: {e}")
 			return {"error": str (e)}
+
+
+_ml_service_instance: Optional[MLService] = None
+
+
+def get_ml_service () -> MLService:
+	global _ml_service_instance
+
+	if _ml_service_instance is None:
+		_ml_service_instance = MLService ()
+
+	return _ml_service_instance
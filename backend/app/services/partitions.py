@@ -0,0 +1,240 @@
+import datetime
+import json
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .sql_tokens import Token, date_literal_at, ends_operand, tokenize
+
+logger = logging.getLogger (__name__)
+
+# Written next to the partition directories by convert_csv_to_parquet.py
+LAYOUT_FILE = "_partitioning.json"
+
+_DATE_RE = re.compile (r"^'(\d{4})-(\d{2})-(\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?)?'$")
+_PARTITION_DIR_RE = re.compile (r"^([^=]+)=")
+# Keywords ending the WHERE clause of a plain SELECT
+_CLAUSE_END = {"group", "order", "having", "limit", "offset", "qualify", "window"}
+
+
+@dataclass
+class PartitionedTable:
+	name: str
+	path: Path
+	keys: List[str]
+	date_column: Optional[str] = None  # year/month keys are derived from it
+
+
+def read_layout (path: Path) -> Tuple[List[str], Optional[str]]:
+	"""Partition keys and the date column of a dataset directory; keys from the directory names without a layout file"""
+	layout_file = path / LAYOUT_FILE
+	if layout_file.exists ():
+		try:
+			layout = json.loads (layout_file.read_text (encoding = "utf-8"))
+			return list (layout.get ("keys", [])), layout.get ("date_column")
+		except (OSError, ValueError) as e:
+			logger.warning (f"Unreadable partition layout {layout_file}: {e}")
+
+	keys = []
+	first_file = next (path.glob ("**/*.parquet"), None)
+	if first_file is not None:
+		for part in first_file.relative_to (path).parts[:-1]:
+			match = _PARTITION_DIR_RE.match (part)
+			if match:
+				keys.append (match.group (1))
+	return keys, None
+
+
+def _month_key (literal: str, upper: bool, inclusive: bool) -> Optional[Tuple[int, int]]:
+	"""(year, month) bound of a date literal; an exclusive upper bound at midnight of the 1st ends the previous month"""
+	match = _DATE_RE.match (literal)
+	if not match:
+		return None
+	year, month, day = int (match.group (1)), int (match.group (2)), int (match.group (3))
+	try:
+		datetime.date (year, month, day)
+	except ValueError:
+		return None
+
+	midnight = not any (int (part or 0) for part in match.group (4, 5, 6))
+	if upper and not inclusive and day == 1 and midnight:
+		return (year - 1, 12) if month == 1 else (year, month - 1)
+	return year, month
+
+
+class PartitionPruner:
+	"""
+	Adds predicates on the year/month partition columns to queries filtering the date column
+	of a partitioned table, so DuckDB skips whole partition files instead of reading every footer.
+	Filters on other partition columns (e.g. Channel) prune files by themselves.
+	Only single-table SELECTs whose WHERE clause is a plain AND of conditions are touched.
+	"""
+
+	def __init__ (self):
+		self.tables: Dict[str, PartitionedTable] = {}
+		self.rewrites = 0
+
+	def refresh (self, tables: List[PartitionedTable]):
+		self.tables = {table.name.lower (): table for table in tables}
+
+	def rewrite (self, sql: str) -> Optional[str]:
+		"""SQL with partition predicates added, or None if nothing can be pruned"""
+		if not self.tables or "--" in sql or "/*" in sql:
+			return None
+
+		tokens = tokenize (sql)
+		if tokens is None:
+			return None
+		words = [text.lower () if kind == "word" else None for kind, text, _, _ in tokens]
+
+		if not words or words[0] != "select" or words.count ("select") != 1:
+			return None
+		if {"join", "union", "intersect", "except", "with"} & set (words):
+			return None
+
+		table = self._table (tokens, words)
+		if table is None or table.date_column is None or "year" not in table.keys:
+			return None
+
+		where = self._where_span (tokens, words)
+		if where is None:
+			return None
+		start, end = where
+
+		lower, upper = self._date_bounds (tokens[start:end], words[start:end], table.date_column)
+		if lower is None and upper is None:
+			return None
+
+		predicate = self._predicate (table, lower, upper)
+		insert_at = tokens[end - 1].end
+		self.rewrites += 1
+		return f"{sql[:insert_at]} AND {predicate}{sql[insert_at:]}"
+
+	def stats (self) -> Dict[str, object]:
+		return {
+			"tables": {table.name: table.keys for table in self.tables.values ()},
+			"rewrites": self.rewrites
+		}
+
+	def _table (self, tokens: List[Token], words: List[Optional[str]]) -> Optional[PartitionedTable]:
+		if "from" not in words:
+			return None
+		i = words.index ("from") + 1
+		if i >= len (tokens):
+			return None
+		kind, text = tokens[i][:2]
+		name = text[1:-1].replace ('""', '"') if kind == "quoted" else text
+		# A comma after the table (optionally aliased) means a second table
+		following = [token[1] for token in tokens[i + 1:i + 4]]
+		if "," in following[:3] or "." in following[:1]:
+			return None
+		return self.tables.get (name.lower ())
+
+	@staticmethod
+	def _where_span (tokens: List[Token], words: List[Optional[str]]) -> Optional[Tuple[int, int]]:
+		"""Token range of the WHERE condition; None if it is missing or has a top-level OR"""
+		depth = 0
+		start = None
+		for i, (kind, text, _, _) in enumerate (tokens):
+			if text == "(":
+				depth += 1
+			elif text == ")":
+				depth -= 1
+			elif depth == 0 and words[i] == "where":
+				start = i + 1
+			elif depth == 0 and start is not None:
+				if words[i] in _CLAUSE_END:
+					return (start, i) if i > start else None
+				if words[i] == "or":
+					return None
+		if start is None or start >= len (tokens):
+			return None
+		return start, len (tokens)
+
+	@staticmethod
+	def _date_bounds (tokens: List[Token], words: List[Optional[str]], date_column: str) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+		"""Tightest (year, month) range implied by top-level comparisons of the date column with date literals"""
+		lower = upper = None
+		column = date_column.lower ()
+
+		def column_at (i: int) -> Optional[int]:
+			# Index after the column reference (bare, quoted or alias-qualified) or None
+			if i + 2 < len (tokens) and tokens[i][0] in ("word", "quoted") and tokens[i + 1][1] == ".":
+				i += 2
+			kind, text = tokens[i][:2]
+			name = text[1:-1].replace ('""', '"') if kind == "quoted" else text
+			return i + 1 if kind in ("word", "quoted") and name.lower () == column else None
+
+		def tighten (bound, value, pick):
+			return value if bound is None else pick (bound, value)
+
+		depth = 0
+		i = 0
+		while i < len (tokens):
+			text = tokens[i][1]
+			if text == "(":
+				depth += 1
+			elif text == ")":
+				depth -= 1
+			if depth != 0 or (i > 0 and words[i - 1] == "not"):
+				i += 1
+				continue
+
+			after = column_at (i)
+			if after is None or after >= len (tokens):
+				i += 1
+				continue
+
+			operator = words[after] or tokens[after][1]
+			if operator == "between":
+				low, j = date_literal_at (tokens, after + 1)
+				if low is None or j >= len (tokens) or words[j] != "and":
+					i = after
+					continue
+				high, j = date_literal_at (tokens, j + 1)
+				low_key = _month_key (low, upper = False, inclusive = True)
+				# Arithmetic after the upper literal (DATE '...' + INTERVAL 10 DAY) moves the bound
+				high_key = _month_key (high, upper = True, inclusive = True) if high and ends_operand (tokens, j) else None
+				if low_key:
+					lower = tighten (lower, low_key, max)
+				if high_key:
+					upper = tighten (upper, high_key, min)
+				i = j
+				continue
+
+			if operator in (">=", ">", "<", "<=", "="):
+				literal, j = date_literal_at (tokens, after + 1)
+				if literal is not None and ends_operand (tokens, j):
+					if operator in (">=", ">", "="):
+						key = _month_key (literal, upper = False, inclusive = True)
+						if key:
+							lower = tighten (lower, key, max)
+					if operator in ("<", "<=", "="):
+						key = _month_key (literal, upper = True, inclusive = operator != "<")
+						if key:
+							upper = tighten (upper, key, min)
+					i = j
+					continue
+			i = after
+
+		return lower, upper
+
+	@staticmethod
+	def _predicate (table: PartitionedTable, lower: Optional[Tuple[int, int]], upper: Optional[Tuple[int, int]]) -> str:
+		# One expression over partition columns only; DuckDB evaluates it per file (File Filters)
+		if "month" in table.keys:
+			expression = "(year * 100 + month)"
+			low = lower[0] * 100 + lower[1] if lower else None
+			high = upper[0] * 100 + upper[1] if upper else None
+		else:
+			expression = "year"
+			low = lower[0] if lower else None
+			high = upper[0] if upper else None
+
+		if low is not None and high is not None:
+			return f"{expression} BETWEEN {low} AND {high}"
+		if low is not None:
+			return f"{expression} >= {low}"
+		return f"{expression} <= {high}"
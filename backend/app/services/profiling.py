@@ -0,0 +1,118 @@
+import json
+import logging
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..config import settings
+
+logger = logging.getLogger (__name__)
+
+
+def _clean_extra_info (text: str) -> str:
+	parts = [part.strip ().replace ("\n", " ") for part in text.split ("[INFOSEPARATOR]")]
+	return "; ".join (" ".join (part.split ()) for part in parts if part.strip ())
+
+
+def _operator (node: Dict[str, Any]) -> Dict[str, Any]:
+	return {
+		"operator": node.get ("name", "").strip (),
+		"time": node.get ("timing", 0.0),
+		"cardinality": node.get ("cardinality", 0),
+		"extra_info": _clean_extra_info (node.get ("extra_info", "")),
+		"children": [_operator (child) for child in node.get ("children", [])]
+	}
+
+
+def _flatten (operators: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	flat = []
+	for operator in operators:
+		flat.append (operator)
+		flat.extend (_flatten (operator["children"]))
+	return flat
+
+
+def operator_tree (profile: Dict[str, Any], slowest: int = 3) -> Dict[str, Any]:
+	"""
+	Compact form of DuckDB's JSON profile: the operator tree with time (seconds) and output
+	cardinality per operator, plus the slowest operators to see at a glance where the time went
+	"""
+	operators = [_operator (child) for child in profile.get ("children", [])]
+	ranked = sorted (_flatten (operators), key = lambda operator: -operator["time"])
+	return {
+		"total_time": profile.get ("timing", 0.0),
+		"operators": operators,
+		"slowest": [
+			{"operator": operator["operator"], "time": operator["time"], "cardinality": operator["cardinality"]}
+			for operator in ranked[:slowest]
+		]
+	}
+
+
+class SlowQueryLog:
+	"""
+	Profiles of slow queries with their question and SQL, appended to a JSON lines file.
+	Every SQL is profiled once per data version, repeated slow runs only count.
+	"""
+
+	def __init__ (self, path: str, threshold: float, keep: int = 100):
+		self.path = Path (path) if path else None
+		self.threshold = threshold
+		self._recent = deque (maxlen = keep)
+		self._profiled: Set[Tuple[str, str]] = set ()
+		self.slow = 0
+		self.logged = 0
+
+	def is_slow (self, seconds: float) -> bool:
+		return self.threshold > 0 and seconds >= self.threshold
+
+	def claim (self, sql_key: str, fingerprint: str) -> bool:
+		"""True for the first slow run of this SQL on this data, the caller then profiles it"""
+		self.slow += 1
+		key = (sql_key, fingerprint)
+		if key in self._profiled:
+			return False
+		if len (self._profiled) > 10000:
+			self._profiled.clear ()
+		self._profiled.add (key)
+		return True
+
+	def record (self, question: str, sql: str, execution_time: float, profile: Dict[str, Any]):
+		entry = {
+			"timestamp": time.time (),
+			"question": question,
+			"sql": sql,
+			"execution_time": round (execution_time, 4),
+			"profile": profile
+		}
+		self._recent.append (entry)
+		self.logged += 1
+		logger.warning (f"Slow query ({execution_time:.2f}s): {sql}")
+
+		if self.path is None:
+			return
+		try:
+			self.path.parent.mkdir (parents = True, exist_ok = True)
+			with self.path.open ("a", encoding = "utf-8") as file:
+				file.write (json.dumps (entry, ensure_ascii = False, default = str) + "\n")
+		except OSError as e:
+			logger.error (f"Failed to write slow query log {self.path}: {e}")
+
+	def recent (self, limit: int) -> List[Dict[str, Any]]:
+		return list (self._recent)[-limit:][::-1]
+
+	def stats (self) -> Dict[str, Any]:
+		return {"threshold": self.threshold, "slow": self.slow, "logged": self.logged}
+
+
+_slow_query_log_instance: Optional[SlowQueryLog] = None
+
+
+def get_slow_query_log () -> SlowQueryLog:
+	global _slow_query_log_instance
+
+	if _slow_query_log_instance is None:
+		_slow_query_log_instance = SlowQueryLog (settings.slow_query_log_path, settings.slow_query_threshold)
+
+	return _slow_query_log_instance
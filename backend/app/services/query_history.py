@@ -0,0 +1,206 @@
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..config import settings
+from .similarity import NgramIndex, normalize_question
+
+logger = logging.getLogger (__name__)
+
+# Dates stay one literal, so they can be swapped as a whole
+_QUESTION_LITERAL_RE = re.compile (r"\d{4}-\d{2}-\d{2}|\w*\d\w*", re.UNICODE)
+_PLACEHOLDER = " __ "
+
+
+@dataclass
+class HistoryEntry:
+	question: str
+	sql: str
+	created_at: float
+
+
+def question_template (question: str) -> Tuple[str, List[str]]:
+	"""Normalized question with literals replaced by a placeholder, and the literals in order"""
+	text = unicodedata.normalize ("NFKC", question)
+	literals = _QUESTION_LITERAL_RE.findall (text)
+	return normalize_question (_QUESTION_LITERAL_RE.sub (_PLACEHOLDER, text)), literals
+
+
+def substitute_literals (sql: str, old: List[str], new: List[str]) -> Optional[str]:
+	"""
+	Swap the question literals that changed in the SQL. Every changed literal has to occur
+	exactly once, otherwise the SQL may hold derived values (e.g. the end of a date range)
+	and is not reused.
+	"""
+	if len (old) != len (new):
+		return None
+
+	replacements = []
+	for old_literal, new_literal in zip (old, new):
+		if old_literal == new_literal:
+			continue
+		pattern = re.compile (rf"(?<![\w-]){re.escape (old_literal)}(?![\w-])", re.IGNORECASE)
+		matches = list (pattern.finditer (sql))
+		if len (matches) != 1:
+			return None
+		replacements.append ((matches[0].start (), matches[0].end (), new_literal))
+
+	replacements.sort ()
+	for (_, end, _), (start, _, _) in zip (replacements, replacements[1:]):
+		if start < end:
+			return None
+
+	for start, end, literal in reversed (replacements):
+		sql = sql[:start] + literal + sql[end:]
+	return sql
+
+
+class QueryHistory:
+	"""
+	Question -> SQL pairs that executed successfully, appended to a JSON lines file and
+	indexed by question n-grams. Serves nearest examples for the prompt and, for a question
+	that only differs from a stored one in its literals, the stored SQL with the literals swapped.
+	"""
+
+	def __init__ (self, path: str, max_entries: int):
+		self.path = Path (path)
+		self.max_entries = max_entries
+		self._entries: "OrderedDict[str, HistoryEntry]" = OrderedDict ()
+		self._index = NgramIndex ()
+		self._lines = 0
+		self.reused = 0
+		self._load ()
+
+	def __len__ (self) -> int:
+		return len (self._entries)
+
+	def record (self, question: str, sql: str):
+		template, _ = question_template (question)
+		if not template:
+			return
+
+		previous = self._entries.get (template)
+		if previous is not None and previous.sql == sql and previous.question == question:
+			self._entries.move_to_end (template)
+			return
+
+		entry = HistoryEntry (question = question, sql = sql, created_at = time.time ())
+		self._store (template, entry)
+		self._append (entry)
+
+	def discard (self, sql: str):
+		"""Drop pairs whose SQL stopped working, e.g. after a schema change"""
+		stale = [template for template, entry in self._entries.items () if entry.sql == sql]
+		for template in stale:
+			del self._entries[template]
+			self._index.remove (template)
+		if stale:
+			self._rewrite ()
+
+	def examples (self, question: str, limit: int, min_score: float) -> List[HistoryEntry]:
+		template, _ = question_template (question)
+		return [
+			self._entries[key]
+			for key, _ in self._index.search (template, limit = limit, min_score = min_score)
+			if key in self._entries
+		]
+
+	def reuse (self, question: str, min_score: float) -> Optional[str]:
+		template, literals = question_template (question)
+		match = self._index.best (template, min_score = min_score)
+		if match is None:
+			return None
+
+		key, score = match
+		entry = self._entries.get (key)
+		# Same words in the same order: "august" vs "september" or "from A to B" vs "from B to A" is not a literal difference
+		if entry is None or key != template:
+			return None
+
+		_, stored_literals = question_template (entry.question)
+		sql = substitute_literals (entry.sql, stored_literals, literals)
+		if sql is not None:
+			self.reused += 1
+			logger.info (f"Reusing SQL of '{entry.question}' ({score:.2f})")
+		return sql
+
+	def stats (self) -> Dict[str, int]:
+		return {"entries": len (self._entries), "reused": self.reused}
+
+	def _store (self, template: str, entry: HistoryEntry):
+		self._entries[template] = entry
+		self._entries.move_to_end (template)
+		self._index.add (template, template)
+
+		while len (self._entries) > self.max_entries:
+			old_template, _ = self._entries.popitem (last = False)
+			self._index.remove (old_template)
+
+	def _load (self):
+		if not self.path.exists ():
+			return
+
+		try:
+			with self.path.open (encoding = "utf-8") as file:
+				for line in file:
+					self._lines += 1
+					try:
+						entry = HistoryEntry (**json.loads (line))
+					except (ValueError, TypeError):
+						continue
+					template, _ = question_template (entry.question)
+					if template:
+						self._store (template, entry)
+		except OSError as e:
+			logger.error (f"Failed to read query history {self.path}: {e}")
+			return
+
+		logger.info (f"Query history loaded: {len (self._entries)} examples")
+		if self._lines > 2 * self.max_entries:
+			self._rewrite ()
+
+	def _append (self, entry: HistoryEntry):
+		try:
+			self.path.parent.mkdir (parents = True, exist_ok = True)
+			with self.path.open ("a", encoding = "utf-8") as file:
+				file.write (json.dumps (asdict (entry), ensure_ascii = False) + "\n")
+			self._lines += 1
+		except OSError as e:
+			logger.error (f"Failed to append to query history {self.path}: {e}")
+			return
+
+		# Superseded and evicted lines pile up in an append-only file
+		if self._lines > 2 * self.max_entries:
+			self._rewrite ()
+
+	def _rewrite (self):
+		temporary = self.path.with_suffix (self.path.suffix + ".tmp")
+		try:
+			with temporary.open ("w", encoding = "utf-8") as file:
+				for entry in self._entries.values ():
+					file.write (json.dumps (asdict (entry), ensure_ascii = False) + "\n")
+			temporary.replace (self.path)
+			self._lines = len (self._entries)
+		except OSError as e:
+			logger.error (f"Failed to compact query history {self.path}: {e}")
+
+
+_query_history_instance: Optional[QueryHistory] = None
+
+
+def get_query_history () -> Optional[QueryHistory]:
+	global _query_history_instance
+
+	if not settings.save_query_history:
+		return None
+
+	if _query_history_instance is None:
+		_query_history_instance = QueryHistory (settings.query_history_path, settings.query_history_max_entries)
+
+	return _query_history_instance
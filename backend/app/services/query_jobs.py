@@ -0,0 +1,398 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ..config import settings
+from ..database import Database
+
+logger = logging.getLogger (__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobQueueFull (Exception):
+	pass
+
+
+class _Cancelled (Exception):
+	pass
+
+
+@dataclass
+class QueryJob:
+	job_id: str
+	question: str
+	state: str = QUEUED
+	stage: str = "generating"  # generating -> waiting (for an execution slot) -> executing -> writing
+	sql: Optional[str] = None
+	error: Optional[str] = None
+	columns: List[str] = field (default_factory = list)
+	row_count: int = 0  # Rows written so far
+	submitted_at: float = field (default_factory = time.time)
+	started_at: Optional[float] = None
+	finished_at: Optional[float] = None
+	expires_at: Optional[float] = None
+	data_version: int = 0
+	worker: int = field (default_factory = os.getpid)
+
+	def to_dict (self) -> Dict[str, Any]:
+		data = asdict (self)
+		end = self.finished_at or time.time ()
+		data["elapsed"] = round (end - self.started_at, 3) if self.started_at else None
+		return data
+
+
+class QueryJobManager:
+	"""
+	Long-running queries executed in the background: submit returns a job ID at once, SQL is
+	generated and the full result is written to a parquet file on a pool of its own, so at most
+	`concurrency` heavy scans run and interactive queries keep the DuckDB pool.
+	Job metadata is a JSON file next to the result, so any worker can report status and serve
+	pages; finished jobs are deleted after ttl seconds.
+	"""
+
+	def __init__ (self, path: str, concurrency: int, ttl: int, max_pending: int, max_rows: int = 0):
+		self.path = Path (path)
+		self.concurrency = max (concurrency, 1)
+		self.ttl = ttl
+		self.max_pending = max_pending
+		self.max_rows = max_rows
+		self._active: Dict[str, QueryJob] = {}
+		self._tasks: Dict[str, asyncio.Task] = {}
+		self._cursors: Dict[str, duckdb.DuckDBPyConnection] = {}
+		self._cancel_requested: set = set ()
+		self._executor: Optional[ThreadPoolExecutor] = None
+		self._lock = threading.Lock ()
+		self.submitted = 0
+		self.completed = 0
+		self.failed = 0
+		self.cancelled = 0
+
+		self.path.mkdir (parents = True, exist_ok = True)
+		self.sweep ()
+
+	def submit (
+			self,
+			db: Database,
+			question: str,
+			prepare: Callable[[], Awaitable[Tuple[Optional[str], Optional[str]]]],
+			on_finished: Optional[Callable[[QueryJob], None]] = None
+	) -> QueryJob:
+		"""
+		Start a job; prepare returns (sql, error) and runs on the event loop, the query on the job pool.
+		on_finished is called with the job once it is done, failed or cancelled.
+		"""
+		self.sweep ()
+		if self.max_pending > 0 and len (self._active) >= self.max_pending:
+			raise JobQueueFull (f"Too many unfinished jobs: {len (self._active)} (max {self.max_pending})")
+
+		if self._executor is None:
+			self._executor = ThreadPoolExecutor (max_workers = self.concurrency, thread_name_prefix = "query-job")
+
+		job = QueryJob (job_id = uuid.uuid4 ().hex, question = question, data_version = db.data_version)
+		self._active[job.job_id] = job
+		self._save (job)
+		self.submitted += 1
+
+		task = asyncio.ensure_future (self._run (job, db, prepare, on_finished))
+		self._tasks[job.job_id] = task
+		task.add_done_callback (lambda _: self._tasks.pop (job.job_id, None))
+		logger.info (f"Query job {job.job_id} submitted: {question}")
+		return job
+
+	def get (self, job_id: str) -> Optional[QueryJob]:
+		job = self._active.get (job_id)
+		if job is not None:
+			return job
+
+		job = self._load (self._meta_path (job_id))
+		if job is not None and job.expires_at is not None and job.expires_at <= time.time ():
+			self._remove (job_id)
+			return None
+		return job
+
+	def recent (self, limit: int = 50) -> List[QueryJob]:
+		self.sweep ()
+		jobs = [self._active.get (path.stem) or self._load (path) for path in self.path.glob ("*.json")]
+		jobs = sorted ((job for job in jobs if job is not None), key = lambda job: job.submitted_at, reverse = True)
+		return jobs[:limit]
+
+	def cancel (self, job_id: str) -> Optional[QueryJob]:
+		"""Cancel an unfinished job, delete the result of a finished one"""
+		job = self.get (job_id)
+		if job is None:
+			return None
+
+		if job.state in FINISHED:
+			self._remove (job_id)
+			return job
+
+		if job_id not in self._active:
+			# Owned by another worker, which checks for the marker between batches
+			self._cancel_marker (job_id).touch ()
+			return job
+
+		self._cancel_requested.add (job_id)
+		task = self._tasks.get (job_id)
+		if job.stage == "generating" and task is not None:
+			task.cancel ()
+		cursor = self._cursors.get (job_id)
+		if cursor is not None:
+			cursor.interrupt ()
+		return job
+
+	def result_path (self, job_id: str) -> Path:
+		return self.path / f"{job_id}.parquet"
+
+	def read_page (self, job_id: str, offset: int, limit: int) -> Tuple[pa.Table, int]:
+		"""Rows [offset, offset + limit) of a finished job and the total row count; only the row groups covering them are read"""
+		parquet_file = pq.ParquetFile (self.result_path (job_id))
+		metadata = parquet_file.metadata
+		total = metadata.num_rows
+
+		groups = []
+		first_row = None
+		position = 0
+		for index in range (metadata.num_row_groups):
+			rows = metadata.row_group (index).num_rows
+			if position + rows > offset and position < offset + limit:
+				groups.append (index)
+				if first_row is None:
+					first_row = position
+			position += rows
+
+		if not groups:
+			return parquet_file.schema_arrow.empty_table (), total
+
+		table = parquet_file.read_row_groups (groups)
+		return table.slice (offset - first_row, limit), total
+
+	def sweep (self):
+		"""Delete expired jobs; jobs left unfinished by an exited worker are marked failed"""
+		now = time.time ()
+		for path in self.path.glob ("*.json"):
+			job_id = path.stem
+			if job_id in self._active:
+				continue
+			job = self._load (path)
+			if job is None:
+				continue
+
+			if job.state in FINISHED:
+				if job.expires_at is not None and job.expires_at <= now:
+					self._remove (job_id)
+				continue
+
+			# A job of this process that is not active was left by a previous process with the same pid
+			if job.worker == os.getpid () or not _process_alive (job.worker):
+				job.state, job.error = FAILED, "Interrupted: the worker running the job exited"
+				job.finished_at = now
+				job.expires_at = now + self.ttl if self.ttl > 0 else None
+				self._save (job)
+				self.result_path (job_id).with_suffix (".parquet.partial").unlink (missing_ok = True)
+
+	def stats (self) -> Dict[str, Any]:
+		states = [job.state for job in self._active.values ()]
+		return {
+			"concurrency": self.concurrency,
+			"queued": states.count (QUEUED),
+			"running": states.count (RUNNING),
+			"submitted": self.submitted,
+			"completed": self.completed,
+			"failed": self.failed,
+			"cancelled": self.cancelled
+		}
+
+	def close (self):
+		# Unfinished jobs are marked failed by the next sweep
+		for cursor in list (self._cursors.values ()):
+			cursor.interrupt ()
+		if self._executor is not None:
+			self._executor.shutdown (wait = True, cancel_futures = True)
+			self._executor = None
+
+	async def _run (
+			self,
+			job: QueryJob,
+			db: Database,
+			prepare: Callable[[], Awaitable[Tuple[Optional[str], Optional[str]]]],
+			on_finished: Optional[Callable[[QueryJob], None]]
+	):
+		try:
+			sql, error = await prepare ()
+			job.sql = sql
+			if error:
+				self._finish (job, FAILED, error)
+			elif job.job_id in self._cancel_requested:
+				self._finish (job, CANCELLED)
+			else:
+				job.stage = "waiting"
+				self._save (job)
+				await asyncio.get_running_loop ().run_in_executor (self._executor, self._execute, job, db, sql)
+				self._finish (job, DONE)
+		except (_Cancelled, asyncio.CancelledError):
+			self._finish (job, CANCELLED)
+		except Exception as e:
+			if job.job_id in self._cancel_requested:
+				self._finish (job, CANCELLED)
+			elif isinstance (e, (duckdb.BinderException, duckdb.CatalogException, duckdb.ParserException)):
+				# Validation only parses, unknown columns surface when the query is planned
+				logger.warning (f"Query job {job.job_id}: invalid SQL: {e}")
+				self._finish (job, FAILED, f"Invalid SQL query: {str (e)}")
+			else:
+				logger.error (f"Query job {job.job_id} failed: {e}")
+				self._finish (job, FAILED, f"SQL execution error: {str (e)}")
+
+		if on_finished is not None:
+			try:
+				on_finished (job)
+			except Exception as e:
+				logger.error (f"Query job {job.job_id} callback failed: {e}")
+
+	def _execute (self, job: QueryJob, db: Database, sql: str):
+		if self._is_cancelled (job):
+			raise _Cancelled ()
+		if not db.connection:
+			db.connect ()
+
+		job.state, job.stage, job.started_at = RUNNING, "executing", time.time ()
+		self._save (job)
+
+		execution_sql = db.execution_sql (sql)
+		partial = self.result_path (job.job_id).with_suffix (".parquet.partial")
+		cursor = db.connection.cursor ()
+		self._cursors[job.job_id] = cursor
+		stream = None
+		writer = None
+		try:
+			stream = db.open_stream (execution_sql, settings.stream_batch_rows, self.max_rows, cursor = cursor)
+			job.columns, job.stage = stream.schema.names, "writing"
+			# One row group per batch, so a page reads only the groups it covers
+			writer = pq.ParquetWriter (partial, stream.schema)
+			saved_at = time.time ()
+
+			while True:
+				batch = stream.read_next ()
+				if batch is None:
+					break
+				writer.write_batch (batch)
+				job.row_count += batch.num_rows
+				if self._is_cancelled (job):
+					raise _Cancelled ()
+				if time.time () - saved_at >= 1.0:
+					self._save (job)
+					saved_at = time.time ()
+
+			writer.close ()
+			writer = None
+			partial.replace (self.result_path (job.job_id))
+
+		finally:
+			self._cursors.pop (job.job_id, None)
+			if writer is not None:
+				writer.close ()
+			if stream is not None:
+				stream.close ()
+			else:
+				cursor.close ()
+			partial.unlink (missing_ok = True)
+
+	def _is_cancelled (self, job: QueryJob) -> bool:
+		if job.job_id in self._cancel_requested:
+			return True
+		if self._cancel_marker (job.job_id).exists ():
+			self._cancel_requested.add (job.job_id)
+			return True
+		return False
+
+	def _finish (self, job: QueryJob, state: str, error: Optional[str] = None):
+		job.state, job.error = state, error
+		job.finished_at = time.time ()
+		job.expires_at = job.finished_at + self.ttl if self.ttl > 0 else None
+		if state != DONE:
+			self.result_path (job.job_id).unlink (missing_ok = True)
+		self._save (job)
+
+		self._active.pop (job.job_id, None)
+		self._cancel_requested.discard (job.job_id)
+		self._cancel_marker (job.job_id).unlink (missing_ok = True)
+		if state == DONE:
+			self.completed += 1
+		elif state == FAILED:
+			self.failed += 1
+		else:
+			self.cancelled += 1
+		logger.info (f"Query job {job.job_id} {state}: {job.row_count} rows" + (f", {error}" if error else ""))
+
+	def _meta_path (self, job_id: str) -> Path:
+		return self.path / f"{job_id}.json"
+
+	def _cancel_marker (self, job_id: str) -> Path:
+		return self.path / f"{job_id}.cancel"
+
+	def _save (self, job: QueryJob):
+		# Replaced atomically, other workers may be reading it
+		with self._lock:
+			path = self._meta_path (job.job_id)
+			partial = path.with_name (f".{path.name}.partial")
+			try:
+				partial.write_text (json.dumps (asdict (job), ensure_ascii = False, default = str), encoding = "utf-8")
+				partial.replace (path)
+			except OSError as e:
+				logger.error (f"Failed to save query job {job.job_id}: {e}")
+
+	@staticmethod
+	def _load (path: Path) -> Optional[QueryJob]:
+		try:
+			return QueryJob (**json.loads (path.read_text (encoding = "utf-8")))
+		except (OSError, ValueError, TypeError):
+			return None
+
+	def _remove (self, job_id: str):
+		for path in (self._meta_path (job_id), self.result_path (job_id), self._cancel_marker (job_id)):
+			path.unlink (missing_ok = True)
+
+
+def _process_alive (pid: int) -> bool:
+	try:
+		os.kill (pid, 0)
+	except ProcessLookupError:
+		return False
+	except (PermissionError, OverflowError, ValueError):
+		return True
+	return True
+
+
+_query_job_manager_instance: Optional[QueryJobManager] = None
+
+
+def get_query_job_manager () -> QueryJobManager:
+	global _query_job_manager_instance
+
+	if _query_job_manager_instance is None:
+		_query_job_manager_instance = QueryJobManager (
+			settings.query_jobs_path,
+			concurrency = settings.query_jobs_concurrency,
+			ttl = settings.query_jobs_ttl,
+			max_pending = settings.query_jobs_max_pending,
+			max_rows = settings.query_jobs_max_rows
+		)
+
+	return _query_job_manager_instance
@@ -1,8 +1,15 @@
 import time
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+import duckdb
+import pyarrow as pa
+
 from ..database import Database
 from ..config import settings
+from ..metrics import StageTimer
+from .profiling import operator_tree
+from .result_cache import get_result_cache
 
 logger = logging.getLogger (__name__)
 
@@ -10,57 +17,113 @@ logger = logging.getLogger (__name__)
 class QueryService:
 	def __init__ (self, db: Database):
 		self.db = db
-
-	def execute_query (self, sql: str, original_question: str) -> Dict[str, Any]:
+		self.result_cache = get_result_cache ()
+
+	def execute_query (self, sql: str, original_question: str, include_total_count: bool = False, profile: bool = False) -> Dict[str, Any]:
+		"""
+		Run the query; the result is returned as an Arrow table under "table"
+		and the stage durations in seconds under "stages".
+		With profile the query runs with DuckDB profiling (never from the cache) and the operator tree is under "profile".
+		"""
 		start_time = time.time ()
+		timer = StageTimer ()
 
 		try:
-			is_valid, error_msg = self.db.validate_sql (sql)
+			fingerprint = self.db.data_fingerprint () if self.result_cache is not None else ""
+			if self.result_cache is not None and not profile:
+				with timer.stage ("cache"):
+					cached = self.result_cache.get (sql, fingerprint)
+				if cached is not None:
+					table, truncated = cached
+					total_count = None
+					if include_total_count:
+						with timer.stage ("execution"):
+							total_count = self._total_count (self.db.execution_sql (sql), table, truncated)
+					execution_time = round (time.time () - start_time, 3)
+					logger.info (f"Result cache hit: {table.num_rows} rows in {execution_time}s")
+					return self._build_response (
+						original_question, sql, table, execution_time,
+						truncated = truncated, total_count = total_count, cached = True, stages = timer.stages
+					)
+
+			with timer.stage ("validation"):
+				is_valid, error_msg = self.db.validate_sql (sql)
 			if not is_valid:
 				logger.warning (f"Invalid SQL: {error_msg}")
-				return {
-					"question": original_question,
-					"sql": sql,
-					"results": [],
-					"columns": [],
-					"row_count": 0,
-					"execution_time": None,
-					"error": f"Invalid SQL query: {error_msg}"
-				}
-
-			results, columns = self.db.execute_query (sql)
+				return self._build_response (original_question, sql, None, None, error = f"Invalid SQL query: {error_msg}", stages = timer.stages)
+
+			profile_tree = None
+			with timer.stage ("execution"):
+				execution_sql = self.db.execution_sql (sql)
+				if profile:
+					table, truncated, raw_profile = self.db.execute_profiled (execution_sql)
+					profile_tree = operator_tree (raw_profile)
+				else:
+					table, truncated = self.db.execute_arrow (execution_sql)
+				total_count = self._total_count (execution_sql, table, truncated) if include_total_count else None
 			execution_time = round (time.time () - start_time, 3)
 
-			response = {
-				"question": original_question,
-				"sql": sql,
-				"results": results,
-				"columns": columns,
-				"row_count": len (results),
-				"execution_time": execution_time,
-				"error": None
-			}
+			if self.result_cache is not None:
+				self.result_cache.put (sql, fingerprint, table, truncated)
 
 			if settings.log_sql_queries:
-				logger.info (f"Query executed successfully: {len (results)} rows in {execution_time}s")
+				logger.info (f"Query executed successfully: {table.num_rows} rows in {execution_time}s")
 
-			return response
+			return self._build_response (
+				original_question, sql, table, execution_time,
+				truncated = truncated, total_count = total_count, stages = timer.stages, profile = profile_tree
+			)
 
 		except Exception as e:
 			execution_time = round (time.time () - start_time, 3)
 			error_msg = str (e)
 
+			# Validation only parses, so unknown columns and type errors are reported by the single planning pass here
+			if isinstance (e, (duckdb.BinderException, duckdb.CatalogException, duckdb.ParserException)):
+				logger.warning (f"Invalid SQL: {error_msg}")
+				return self._build_response (original_question, sql, None, execution_time, error = f"Invalid SQL query: Invalid SQL: {error_msg}", stages = timer.stages)
+
 			logger.error (f"Query execution error: {error_msg}")
 
-			return {
-				"question": original_question,
-				"sql": sql,
-				"results": [],
-				"columns": [],
-				"row_count": 0,
-				"execution_time": execution_time,
-				"error": f"SQL execution error: {error_msg}"
-			}
+			return self._build_response (original_question, sql, None, execution_time, error = f"SQL execution error: {error_msg}", stages = timer.stages)
+
+	def profile_query (self, sql: str) -> Dict[str, Any]:
+		"""Operator tree of the query as it would run now, rollup rewrite included"""
+		execution_sql = self.db.execution_sql (sql)
+		_, _, raw_profile = self.db.execute_profiled (execution_sql)
+		return operator_tree (raw_profile)
+
+	def _total_count (self, sql: str, table: pa.Table, truncated: bool) -> int:
+		# The full count needs a second pass, so it only runs when the result was cut off
+		return self.db.count_rows (sql) if truncated else table.num_rows
+
+	@staticmethod
+	def _build_response (
+			question: str,
+			sql: str,
+			table: Optional[pa.Table],
+			execution_time: Optional[float],
+			truncated: bool = False,
+			total_count: Optional[int] = None,
+			cached: bool = False,
+			error: Optional[str] = None,
+			stages: Optional[Dict[str, float]] = None,
+			profile: Optional[Dict[str, Any]] = None
+	) -> Dict[str, Any]:
+		return {
+			"question": question,
+			"sql": sql,
+			"table": table,
+			"columns": table.column_names if table is not None else [],
+			"row_count": table.num_rows if table is not None else 0,
+			"truncated": truncated,
+			"total_count": total_count,
+			"execution_time": execution_time,
+			"cached": cached,
+			"error": error,
+			"stages": dict (stages or {}),
+			"profile": profile
+		}
 
 	def get_all_tables (self) -> List[str]:
 		try:
@@ -0,0 +1,275 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ..config import settings
+
+logger = logging.getLogger (__name__)
+
+MB = 1024 * 1024
+
+
+def canonicalize_sql (sql: str) -> str:
+	"""Lowercase and collapse whitespace outside of quoted literals and identifiers"""
+	parts = []
+	quote = None
+	pending_space = False
+
+	for char in sql.strip ().rstrip (";"):
+		if quote:
+			parts.append (char)
+			if char == quote:
+				quote = None
+			continue
+
+		if char.isspace ():
+			pending_space = True
+			continue
+
+		if pending_space and parts:
+			parts.append (" ")
+		pending_space = False
+
+		if char in ("'", '"'):
+			quote = char
+		parts.append (char.lower ())
+
+	return "".join (parts)
+
+
+@dataclass
+class _CachedResult:
+	table: pa.Table
+	truncated: bool
+	size: int
+
+
+class ResultCache:
+	"""
+	Two-tier cache of query results keyed by canonical SQL and data fingerprint.
+	Memory tier is LRU under a byte budget; evicted entries spill to parquet files
+	when a spill directory is configured. Any data file change flushes both tiers.
+	Spill files are written outside the lock, so lookups never wait behind a parquet write.
+	"""
+
+	def __init__ (self, memory_budget: int, spill_path: str = "", disk_budget: int = 0):
+		self.memory_budget = memory_budget
+		self.disk_budget = disk_budget
+		self.spill_path = Path (spill_path) if spill_path else None
+		self._memory: "OrderedDict[str, _CachedResult]" = OrderedDict ()
+		self._memory_size = 0
+		self._disk: "OrderedDict[str, Tuple[Path, int, bool]]" = OrderedDict ()
+		self._disk_size = 0
+		self._spilling: Dict[str, _CachedResult] = {}  # Evicted, parquet file being written
+		self._generation = 0  # Bumped on clear, spills started before it are dropped
+		self._fingerprint: Optional[str] = None
+		self._lock = threading.Lock ()
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+		if self.spill_path:
+			self.spill_path.mkdir (parents = True, exist_ok = True)
+			for stale in self.spill_path.glob ("*.parquet"):
+				stale.unlink (missing_ok = True)
+
+	def get (self, sql: str, fingerprint: str) -> Optional[Tuple[pa.Table, bool]]:
+		key = self._key (sql, fingerprint)
+
+		with self._lock:
+			self._check_fingerprint (fingerprint)
+
+			entry = self._memory.get (key)
+			if entry is not None:
+				self._memory.move_to_end (key)
+				self.hits += 1
+				return entry.table, entry.truncated
+
+			entry = self._spilling.get (key)
+			if entry is not None:
+				self.hits += 1
+				return entry.table, entry.truncated
+
+			spilled = self._disk.pop (key, None)
+			if spilled is None:
+				self.misses += 1
+				return None
+
+			path, size, truncated = spilled
+			self._disk_size -= size
+
+		try:
+			table = pq.read_table (path)
+			path.unlink (missing_ok = True)
+		except Exception as e:
+			logger.warning (f"Failed to load spilled result {path}: {e}")
+			with self._lock:
+				self.misses += 1
+			return None
+
+		with self._lock:
+			self.disk_hits += 1
+			spills, generation = self._store (key, _CachedResult (table, truncated, table.nbytes)), self._generation
+		self._spill (spills, generation)
+		return table, truncated
+
+	def put (self, sql: str, fingerprint: str, table: pa.Table, truncated: bool = False):
+		key = self._key (sql, fingerprint)
+		entry = _CachedResult (table, truncated, table.nbytes)
+
+		with self._lock:
+			self._check_fingerprint (fingerprint)
+			spills, generation = self._store (key, entry), self._generation
+		self._spill (spills, generation)
+
+	def clear (self):
+		with self._lock:
+			self._clear_locked ()
+
+	def stats (self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"memory_entries": len (self._memory),
+				"memory_mb": round (self._memory_size / MB, 2),
+				"memory_budget_mb": round (self.memory_budget / MB, 2),
+				"disk_entries": len (self._disk),
+				"disk_mb": round (self._disk_size / MB, 2),
+				"spilling": len (self._spilling),
+				"hits": self.hits,
+				"disk_hits": self.disk_hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"invalidations": self.invalidations
+			}
+
+	def _key (self, sql: str, fingerprint: str) -> str:
+		return hashlib.sha1 (f"{fingerprint}\0{canonicalize_sql (sql)}".encode ()).hexdigest ()
+
+	def _check_fingerprint (self, fingerprint: str):
+		if self._fingerprint is not None and self._fingerprint != fingerprint:
+			logger.info ("Data files changed, dropping cached results")
+			self._clear_locked ()
+			self.invalidations += 1
+		self._fingerprint = fingerprint
+
+	def _clear_locked (self):
+		self._memory.clear ()
+		self._memory_size = 0
+		self._spilling.clear ()
+		self._generation += 1
+		for path, _, _ in self._disk.values ():
+			path.unlink (missing_ok = True)
+		self._disk.clear ()
+		self._disk_size = 0
+
+	def _store (self, key: str, entry: _CachedResult) -> List[Tuple[str, _CachedResult]]:
+		"""Put the entry in memory; returns the evicted entries to write to disk once the lock is released"""
+		previous = self._memory.pop (key, None)
+		if previous is not None:
+			self._memory_size -= previous.size
+		self._spilling.pop (key, None)
+
+		evicted = []
+		if entry.size > self.memory_budget:
+			evicted.append ((key, entry))
+		else:
+			self._memory[key] = entry
+			self._memory_size += entry.size
+			while self._memory_size > self.memory_budget:
+				old_key, old_entry = self._memory.popitem (last = False)
+				self._memory_size -= old_entry.size
+				evicted.append ((old_key, old_entry))
+
+		spills = []
+		for old_key, old_entry in evicted:
+			if not self.spill_path or old_entry.table.num_rows == 0:
+				self.evictions += 1
+				continue
+			self._spilling[old_key] = old_entry
+			spills.append ((old_key, old_entry))
+		return spills
+
+	def _spill (self, spills: List[Tuple[str, _CachedResult]], generation: int):
+		"""Write evicted entries to parquet without the lock, then record the files that are still wanted"""
+		for key, entry in spills:
+			path = self.spill_path / f"{key}.parquet"
+			# A concurrent spill of the same key may be writing too; the file appears complete or not at all
+			partial = path.with_name (f".{path.name}.{threading.get_ident ()}")
+			try:
+				pq.write_table (entry.table, partial)
+				size = partial.stat ().st_size
+			except Exception as e:
+				logger.warning (f"Failed to spill cached result: {e}")
+				partial.unlink (missing_ok = True)
+				with self._lock:
+					if self._spilling.get (key) is entry:
+						del self._spilling[key]
+					self.evictions += 1
+				continue
+
+			with self._lock:
+				# Cleared, stored again or taken back into memory while the file was written
+				if generation != self._generation or self._spilling.get (key) is not entry:
+					partial.unlink (missing_ok = True)
+					continue
+				del self._spilling[key]
+
+				partial.replace (path)
+				previous = self._disk.pop (key, None)
+				if previous is not None:
+					self._disk_size -= previous[1]
+				self._disk[key] = (path, size, entry.truncated)
+				self._disk_size += size
+
+				while self._disk_size > self.disk_budget and self._disk:
+					_, (old_path, old_size, _) = self._disk.popitem (last = False)
+					old_path.unlink (missing_ok = True)
+					self._disk_size -= old_size
+					self.evictions += 1
+
+
+def _worker_spill_path (spill_path: str) -> str:
+	"""Each worker process spills to its own subdirectory; those of exited workers are removed"""
+	if not spill_path or settings.workers <= 1:
+		return spill_path
+
+	root = Path (spill_path)
+	if root.exists ():
+		for directory in root.glob ("worker-*"):
+			try:
+				os.kill (int (directory.name.split ("-", 1)[1]), 0)
+			except ProcessLookupError:
+				shutil.rmtree (directory, ignore_errors = True)
+			except (ValueError, PermissionError):
+				continue
+	return str (root / f"worker-{os.getpid ()}")
+
+
+_result_cache_instance: Optional[ResultCache] = None
+
+
+def get_result_cache () -> Optional[ResultCache]:
+	global _result_cache_instance
+
+	if not settings.result_cache_enabled:
+		return None
+
+	if _result_cache_instance is None:
+		_result_cache_instance = ResultCache (
+			memory_budget = settings.result_cache_memory_mb * MB,
+			spill_path = _worker_spill_path (settings.result_cache_spill_path),
+			disk_budget = settings.result_cache_disk_mb * MB
+		)
+
+	return _result_cache_instance
@@ -0,0 +1,144 @@
+import datetime
+import decimal
+import json
+import uuid
+from typing import Any, Dict, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+JSON = "json"
+COLUMNAR = "columnar"
+ARROW = "arrow"
+NDJSON = "ndjson"
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.agentic.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_FORMATS = {JSON, COLUMNAR, ARROW}
+_STREAM_FORMATS = {NDJSON, ARROW}
+
+
+def negotiate_format (requested: Optional[str], accept: Optional[str]) -> str:
+	"""Explicit ?format= wins over the Accept header; row-wise JSON is the default"""
+	if requested:
+		requested = requested.lower ()
+		if requested not in _FORMATS:
+			raise ValueError (f"Unknown result format '{requested}'. Use one of: {', '.join (sorted (_FORMATS))}")
+		return requested
+
+	accept = (accept or "").lower ()
+	if ARROW_MEDIA_TYPE in accept:
+		return ARROW
+	if COLUMNAR_MEDIA_TYPE in accept:
+		return COLUMNAR
+	return JSON
+
+
+def negotiate_stream_format (requested: Optional[str], accept: Optional[str]) -> str:
+	if requested:
+		requested = requested.lower ()
+		if requested not in _STREAM_FORMATS:
+			raise ValueError (f"Unknown stream format '{requested}'. Use one of: {', '.join (sorted (_STREAM_FORMATS))}")
+		return requested
+
+	return ARROW if ARROW_MEDIA_TYPE in (accept or "").lower () else NDJSON
+
+
+def json_default (value: Any) -> Any:
+	if isinstance (value, (datetime.date, datetime.time)):
+		return value.isoformat ()
+	if isinstance (value, decimal.Decimal):
+		return float (value)
+	if isinstance (value, datetime.timedelta):
+		return value.total_seconds ()
+	if isinstance (value, (uuid.UUID, bytes)):
+		return str (value)
+	raise TypeError (f"Object of type {type (value).__name__} is not JSON serializable")
+
+
+def column_values (column) -> list:
+	# Cast in Arrow where the JSON form is known, so no per-value Python fallback is needed
+	if pa.types.is_decimal (column.type):
+		column = pc.cast (column, pa.float64 ())
+	elif pa.types.is_date (column.type):
+		column = pc.cast (column, pa.string ())
+	return column.to_pylist ()
+
+
+def to_columnar_json (payload: Dict[str, Any], table: pa.Table) -> bytes:
+	"""Serialize as {..., "columns": [...], "data": [[column values], ...]} without per-row dicts"""
+	body = dict (payload)
+	body["columns"] = table.column_names
+	body["data"] = [column_values (column) for column in table.columns]
+	return json.dumps (body, default = json_default, ensure_ascii = False, separators = (",", ":")).encode ("utf-8")
+
+
+def ndjson_line (payload: Dict[str, Any]) -> bytes:
+	return json.dumps (payload, default = json_default, ensure_ascii = False, separators = (",", ":")).encode ("utf-8") + b"\n"
+
+
+def ndjson_batch (batch: pa.RecordBatch) -> bytes:
+	"""One NDJSON line per record batch, with column arrays like the columnar format"""
+	return ndjson_line ({
+		"type": "batch",
+		"row_count": batch.num_rows,
+		"data": [column_values (column) for column in batch.columns]
+	})
+
+
+def _schema_with_metadata (schema: pa.Schema, metadata: Dict[str, Any]) -> pa.Schema:
+	return schema.with_metadata ({
+		key: value if isinstance (value, str) else json.dumps (value)
+		for key, value in metadata.items ()
+		if value is not None
+	})
+
+
+class _ChunkSink:
+	"""File-like sink that hands out whatever the IPC writer produced since the last call"""
+
+	closed = False
+
+	def __init__ (self):
+		self._chunks = []
+
+	def write (self, data) -> int:
+		self._chunks.append (bytes (data))
+		return len (data)
+
+	def flush (self):
+		pass
+
+	def close (self):
+		self.closed = True
+
+	def take (self) -> bytes:
+		data = b"".join (self._chunks)
+		self._chunks.clear ()
+		return data
+
+
+class ArrowStreamEncoder:
+	"""Incremental Arrow IPC stream: schema message first, then one message per batch"""
+
+	def __init__ (self, schema: pa.Schema, metadata: Dict[str, Any]):
+		self._sink = _ChunkSink ()
+		self._writer = pa.ipc.new_stream (self._sink, _schema_with_metadata (schema, metadata))
+
+	def encode (self, batch: pa.RecordBatch) -> bytes:
+		self._writer.write_batch (batch)
+		return self._sink.take ()
+
+	def finish (self) -> bytes:
+		self._writer.close ()
+		return self._sink.take ()
+
+
+def to_arrow_ipc (table: pa.Table, metadata: Dict[str, Any]) -> bytes:
+	schema = _schema_with_metadata (table.schema, metadata)
+	sink = pa.BufferOutputStream ()
+	with pa.ipc.new_stream (sink, schema) as writer:
+		writer.write_table (table.replace_schema_metadata (schema.metadata))
+	return sink.getvalue ().to_pybytes ()
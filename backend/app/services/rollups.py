@@ -0,0 +1,402 @@
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import duckdb
+
+from ..config import settings
+from .sql_tokens import Token, date_literal_at, ends_operand, tokenize
+
+logger = logging.getLogger (__name__)
+
+_DATE_LITERAL_RE = re.compile (r"^'\d{4}-\d{2}-\d{2}'$")
+_IDENTIFIER_RE = re.compile (r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_KEYWORDS = {
+	"select", "from", "where", "group", "by", "order", "having", "limit", "offset", "as",
+	"and", "or", "not", "in", "is", "null", "like", "ilike", "between", "asc", "desc",
+	"nulls", "first", "last", "all", "case", "when", "then", "else", "end", "true", "false",
+	"date", "timestamp", "varchar", "text", "integer", "int", "bigint", "double", "float", "decimal",
+	"year", "month", "day", "quarter", "week", "dow", "doy", "dayofweek", "dayofyear"
+}
+# Anything that changes how rows are combined, or filters groups, is answered from the base table
+_UNSUPPORTED = {
+	"join", "union", "intersect", "except", "with", "over", "distinct", "qualify", "window", "having",
+	"using", "natural", "lateral", "pivot", "unpivot", "sample", "tablesample"
+}
+_SCALAR_FUNCTIONS = {
+	"date_trunc", "date_part", "datepart", "extract", "year", "month", "quarter", "day", "dayofmonth",
+	"week", "weekofyear", "monthname", "dayname", "strftime", "cast", "round", "coalesce",
+	"lower", "upper", "abs", "concat", "nullif", "in"
+}
+_AGGREGATES = {"sum", "min", "max", "avg", "count"}
+
+# Date expressions exact on month-grain rollups; everything else needs day grain
+_MONTH_PARTS = {"year", "month", "quarter"}
+_DAY_PARTS = _MONTH_PARTS | {"day", "week", "dow", "doy", "dayofweek", "dayofyear", "dayofmonth", "weekofyear", "isodow"}
+_MONTH_FORMAT_CODES = set ("YymBb")
+_DAY_FORMAT_CODES = _MONTH_FORMAT_CODES | set ("dejaAwUWu")
+
+# Finer grains answer everything coarser ones can
+_GRAIN_ORDER = {"day": 0, "month": 1}
+
+
+@dataclass
+class Rollup:
+	name: str
+	dimensions: Tuple[str, ...]
+	grain: str
+	row_count: int = 0
+
+
+def _quote (identifier: str) -> str:
+	return '"' + identifier.replace ('"', '""') + '"'
+
+
+class RollupManager:
+	"""
+	Summary tables over the source table (sum/count/min/max of the measure per dimension set
+	and day or month) and a conservative rewriter that routes matching GROUP BY queries to the
+	smallest rollup able to answer them exactly. Queries it does not fully understand are left alone.
+	"""
+
+	def __init__ (self):
+		self.source = settings.rollup_source_table
+		self.measure = settings.rollup_measure_column
+		self.date_column = settings.rollup_date_column
+		self.rollups: List[Rollup] = []
+		self.date_is_date = False
+		self.rewrites = 0
+
+	def refresh (self, connection: duckdb.DuckDBPyConnection, rebuild: bool = True, read_only: bool = False):
+		"""
+		(Re)build every configured rollup; with rebuild=False existing rollup tables are reused,
+		with read_only=True missing ones are left out instead of built
+		"""
+		self.rollups = []
+
+		try:
+			columns = {row[0].lower (): (row[0], row[1]) for row in connection.execute (f"DESCRIBE {self.source}").fetchall ()}
+		except duckdb.Error:
+			logger.info (f"Rollups skipped: no table {self.source}")
+			return
+
+		date_type = columns.get (self.date_column.lower (), (None, ""))[1].upper ()
+		if self.measure.lower () not in columns or date_type not in ("DATE", "TIMESTAMP"):
+			logger.warning (f"Rollups skipped: {self.source} has no {self.measure} or DATE/TIMESTAMP {self.date_column}")
+			return
+		self.date_is_date = date_type == "DATE"
+
+		existing = {
+			row[0] for row in connection.execute (
+				"SELECT table_name FROM information_schema.tables WHERE table_schema = 'main'"
+			).fetchall ()
+		}
+
+		for dimensions in self._dimension_sets ():
+			if any (dimension.lower () not in columns for dimension in dimensions):
+				logger.warning (f"Rollup over {dimensions} skipped: unknown column")
+				continue
+
+			for grain in [grain.strip () for grain in settings.rollup_grains.split (",") if grain.strip ()]:
+				rollup = Rollup (
+					name = "_rollup_" + "_".join ([grain] + [dimension.lower ().replace (" ", "") for dimension in dimensions]),
+					dimensions = tuple (columns[dimension.lower ()][0] for dimension in dimensions),
+					grain = grain
+				)
+				if read_only and rollup.name not in existing:
+					logger.warning (f"Rollup {rollup.name} is not in the read-only database, skipped")
+					continue
+				try:
+					if rebuild or rollup.name not in existing:
+						connection.execute (self._build_sql (rollup, date_type))
+					rollup.row_count = connection.execute (f"SELECT COUNT(*) FROM {rollup.name}").fetchone ()[0]
+					self.rollups.append (rollup)
+				except duckdb.Error as e:
+					logger.error (f"Failed to build rollup {rollup.name}: {e}")
+
+		self.rollups.sort (key = lambda item: item.row_count)
+		logger.info ("Rollups ready: %s", ", ".join (f"{item.name} ({item.row_count} rows)" for item in self.rollups))
+
+	def rewrite (self, sql: str) -> Optional[str]:
+		"""SQL over the smallest matching rollup, or None if the query must run on the source table"""
+		if not self.rollups or "--" in sql or "/*" in sql:
+			return None
+
+		tokens = tokenize (sql)
+		if not tokens or not tokens[0].is_word ("select"):
+			return None
+
+		select_list = self._select_list (tokens)
+		if select_list is None:
+			return None
+		aliases, output_names = select_list
+
+		requirements = self._requirements (tokens, aliases)
+		if requirements is None:
+			return None
+		dimensions, grain = requirements
+
+		for rollup in self.rollups:
+			if _GRAIN_ORDER[rollup.grain] > _GRAIN_ORDER[grain]:
+				continue
+			if not dimensions <= {dimension.lower () for dimension in rollup.dimensions}:
+				continue
+
+			self.rewrites += 1
+			rewritten = self._render (tokens, rollup, output_names)
+			logger.info (f"Query routed to rollup {rollup.name}")
+			return rewritten
+
+		return None
+
+	def stats (self) -> Dict[str, object]:
+		return {
+			"rollups": {rollup.name: rollup.row_count for rollup in self.rollups},
+			"rewrites": self.rewrites
+		}
+
+	def _dimension_sets (self) -> List[Tuple[str, ...]]:
+		return [
+			tuple (dimension.strip () for dimension in group.split (",") if dimension.strip ())
+			for group in settings.rollup_dimension_sets.split (";")
+		]
+
+	def _build_sql (self, rollup: Rollup, date_type: str) -> str:
+		date_column = _quote (self.date_column)
+		measure = _quote (self.measure)
+		dimensions = "".join (f"{_quote (dimension)}, " for dimension in rollup.dimensions)
+		return f"""
+			CREATE OR REPLACE TABLE {rollup.name} AS
+			SELECT
+				{dimensions}CAST(date_trunc('{rollup.grain}', {date_column}) AS {date_type}) AS {date_column},
+				SUM({measure}) AS sum_amount,
+				COUNT(*) AS row_count,
+				COUNT({measure}) AS amount_count,
+				MIN({measure}) AS min_amount,
+				MAX({measure}) AS max_amount
+			FROM {self.source}
+			GROUP BY ALL
+		"""
+
+	def _aggregate_span (self, tokens: List[Token], i: int) -> Optional[int]:
+		"""Length of an aggregate over the measure (or COUNT(*)) starting at i, else None"""
+		if i + 3 >= len (tokens) or tokens[i].kind != "word" or tokens[i + 1].text != "(" or tokens[i + 3].text != ")":
+			return None
+
+		function = tokens[i].name
+		argument = tokens[i + 2]
+		if function == "count" and argument.text in ("*", "1"):
+			return 4
+		if function in _AGGREGATES and argument.kind in ("word", "quoted") and argument.name == self.measure.lower ():
+			return 4
+		return None
+
+	def _select_list (self, tokens: List[Token]) -> Optional[Tuple[Set[str], Dict[int, str]]]:
+		"""
+		Aliases declared in the select list, and the column name DuckDB would give each unaliased
+		aggregate, so the rewritten query returns the same columns as the original one
+		"""
+		items = []
+		start = 1
+		depth = 0
+		for i in range (1, len (tokens)):
+			token = tokens[i]
+			if token.text == "(":
+				depth += 1
+			elif token.text == ")":
+				depth -= 1
+			elif depth == 0 and (token.text == "," or token.is_word ("from")):
+				items.append ((start, i))
+				start = i + 1
+				if token.kind == "word":
+					break
+		else:
+			return None
+
+		aliases: Set[str] = set ()
+		output_names: Dict[int, str] = {}
+		for start, end in items:
+			item = tokens[start:end]
+			if not item:
+				return None
+
+			last = item[-1]
+			if len (item) >= 2 and item[-2].is_word ("as"):
+				aliases.add (last.name)
+				continue
+			if len (item) >= 2 and (last.kind == "quoted" or (last.kind == "word" and last.name not in _KEYWORDS)) \
+					and (item[-2].kind in ("word", "quoted", "number", "string") or item[-2].text == ")"):
+				aliases.add (last.name)
+				continue
+
+			span = self._aggregate_span (tokens, start)
+			if span == len (item):
+				output_names[start] = self._default_name (item)
+			elif any (self._aggregate_span (tokens, i) for i in range (start, end)):
+				# An aggregate inside a bigger unaliased expression would change the column name
+				return None
+
+		return aliases, output_names
+
+	@staticmethod
+	def _default_name (item: List[Token]) -> str:
+		function, argument = item[0].name, item[2]
+		if function == "count" and argument.text == "*":
+			return "count_star()"
+		if argument.kind == "quoted" and _IDENTIFIER_RE.match (argument.text[1:-1]):
+			return f"{function}({argument.text[1:-1]})"
+		return f"{function}({argument.text})"
+
+	def _requirements (self, tokens: List[Token], aliases: Set[str]) -> Optional[Tuple[Set[str], str]]:
+		dimensions = {dimension.lower () for rollup in self.rollups for dimension in rollup.dimensions}
+		selects = 0
+		froms = 0
+		used: Set[str] = set ()
+		grain = "month"
+
+		i = 0
+		while i < len (tokens):
+			token = tokens[i]
+
+			span = self._aggregate_span (tokens, i)
+			if span:
+				i += span
+				continue
+
+			if token.text == "." or token.text == ";":
+				return None
+
+			if token.text == "*" and (i == 0 or tokens[i - 1].text == "," or tokens[i - 1].is_word ("select")):
+				return None
+
+			if token.kind not in ("word", "quoted"):
+				i += 1
+				continue
+
+			name = token.name
+			followed_by_call = i + 1 < len (tokens) and tokens[i + 1].text == "("
+
+			if token.kind == "word" and name in _UNSUPPORTED:
+				return None
+			if token.kind == "word" and name == "select":
+				selects += 1
+			elif token.kind == "word" and name == "from":
+				inside_extract = i >= 3 and tokens[i - 3].is_word ("extract")
+				if not inside_extract:
+					froms += 1
+					following = tokens[i + 2] if i + 2 < len (tokens) else None
+					if i + 1 >= len (tokens) or tokens[i + 1].name != self.source.lower () or (
+						following is not None and not following.is_word ("where", "group", "order", "limit")
+					):
+						return None
+					i += 2
+					continue
+			elif token.kind == "word" and followed_by_call:
+				if name in _AGGREGATES or name not in _SCALAR_FUNCTIONS:
+					return None
+			elif name == self.date_column.lower ():
+				date_grain = self._date_grain (tokens, i)
+				if date_grain is None:
+					return None
+				if date_grain == "day":
+					grain = "day"
+			elif name == self.measure.lower ():
+				# The measure outside of SUM/COUNT/MIN/MAX/AVG cannot be answered from a rollup
+				return None
+			elif name in dimensions:
+				used.add (name)
+			elif name not in aliases and (token.kind == "quoted" or name not in _KEYWORDS):
+				return None
+
+			i += 1
+
+		if selects != 1 or froms != 1:
+			return None
+		return used, grain
+
+	def _date_grain (self, tokens: List[Token], i: int) -> Optional[str]:
+		"""Finest rollup grain needed to evaluate this occurrence of the date column exactly"""
+
+		def text (offset: int) -> str:
+			index = i + offset
+			return tokens[index].text.lower () if 0 <= index < len (tokens) else ""
+
+		# year(col), month(col), day(col) ...
+		if text (-1) == "(" and text (1) == ")":
+			function = text (-2)
+			if function in _MONTH_PARTS or function == "monthname":
+				return "month"
+			if function in _DAY_PARTS or function == "dayname":
+				return "day"
+
+		# date_trunc('unit', col)
+		if text (-1) == "," and text (-3) == "(" and text (-4) == "date_trunc" and text (1) == ")":
+			unit = text (-2).strip ("'")
+			if unit in _MONTH_PARTS:
+				return "month"
+			if unit in ("day", "week"):
+				return "day"
+			return None
+
+		# extract(part FROM col), date_part('part', col)
+		if text (-1) == "from" and text (-3) == "(" and text (-4) == "extract" and text (1) == ")":
+			part = text (-2)
+			return "month" if part in _MONTH_PARTS else "day" if part in _DAY_PARTS else None
+		if text (-1) == "," and text (-3) == "(" and text (-4) in ("date_part", "datepart") and text (1) == ")":
+			part = text (-2).strip ("'")
+			return "month" if part in _MONTH_PARTS else "day" if part in _DAY_PARTS else None
+
+		# strftime(col, 'format')
+		if text (-1) == "(" and text (-2) == "strftime" and text (1) == "," and text (3) == ")":
+			codes = set (re.findall (r"%(.)", tokens[i + 2].text))
+			if codes <= _MONTH_FORMAT_CODES:
+				return "month"
+			return "day" if codes <= _DAY_FORMAT_CODES else None
+
+		# CAST(col AS DATE), col::DATE
+		if (text (-1) == "(" and text (-2) == "cast" and text (1) == "as" and text (2) == "date" and text (3) == ")") \
+				or (text (1) == "::" and text (2) == "date"):
+			return "day"
+
+		# col >= '2024-01-01', col < DATE '2024-02-01', col < '2024-02-01'::DATE; not col >= DATE '2024-02-01' - 15
+		if text (1) in ("=", "<", ">", "<=", ">=", "<>", "!="):
+			literal, end = date_literal_at (tokens, i + 2)
+			if literal is not None and _DATE_LITERAL_RE.match (literal) and ends_operand (tokens, end):
+				if text (1) in (">=", "<") and literal.endswith ("-01'"):
+					return "month"
+				if self.date_is_date or text (1) in (">=", "<"):
+					return "day"
+			return None
+
+		# A DATE column keeps its exact values in day rollups
+		return "day" if self.date_is_date else None
+
+	def _render (self, tokens: List[Token], rollup: Rollup, output_names: Dict[int, str]) -> str:
+		parts = []
+		i = 0
+		while i < len (tokens):
+			span = self._aggregate_span (tokens, i)
+			if span:
+				function = tokens[i].name
+				if function == "count":
+					column = "row_count" if tokens[i + 2].text in ("*", "1") else "amount_count"
+					parts.append (f"CAST(COALESCE(SUM({column}), 0) AS BIGINT)")
+				elif function == "avg":
+					parts.append ("(SUM(sum_amount) / SUM(amount_count))")
+				else:
+					parts.append (f"{function.upper ()}({function}_amount)")
+				if i in output_names:
+					parts.append (f"AS {_quote (output_names[i])}")
+				i += span
+				continue
+
+			token = tokens[i]
+			if token.kind == "word" and token.name == self.source.lower () and i > 0 and tokens[i - 1].is_word ("from"):
+				parts.append (rollup.name)
+			else:
+				parts.append (token.text)
+			i += 1
+
+		return " ".join (parts)
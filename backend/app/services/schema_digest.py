@@ -0,0 +1,290 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+
+from ..config import settings
+from .similarity import Bm25Index, search_terms
+
+logger = logging.getLogger (__name__)
+
+_PLAIN_IDENTIFIER_RE = re.compile (r"^[A-Za-z_][A-Za-z0-9_]*$")
+_TEXT_TYPES = ("VARCHAR",)
+_DATE_TYPES = ("DATE", "TIMESTAMP")
+# Described catalog kept in the database file (persistent mode, and shared snapshots written by app.ingest)
+CATALOG_TABLE = "_schema_catalog"
+
+
+def _quote (identifier: str) -> str:
+	return '"' + identifier.replace ('"', '""') + '"'
+
+
+def _display_name (identifier: str) -> str:
+	"""Column name the way it has to be written in SQL"""
+	return identifier if _PLAIN_IDENTIFIER_RE.match (identifier) else _quote (identifier)
+
+
+def _literal (value: Any) -> str:
+	return "'" + str (value).replace ("'", "''") + "'"
+
+
+@dataclass(frozen = True)
+class SchemaDigest:
+	text: str
+	hash: str
+	fingerprint: str
+
+
+@dataclass
+class _ColumnEntry:
+	name: str
+	line: str
+	terms: List[str]
+
+
+@dataclass
+class _TableEntry:
+	name: str
+	header: str
+	columns: List[_ColumnEntry]
+	row_count: int = 0
+	column_index: Optional[Bm25Index] = None
+
+
+class SchemaDigestBuilder:
+	"""
+	Compact description of the tables for the text-to-SQL prompt: column names and types,
+	the values of low-cardinality text columns and the range of date columns.
+	The catalog is described once per data fingerprint and indexed with BM25, so a prompt
+	only carries the tables and columns relevant to its question once the catalog is large.
+	The hash lets the ml-service cache the text on its side.
+	Describing scans every table, so it happens on the first question after a data change
+	(on the database pool), and a database file keeps the result for the data it holds.
+	"""
+
+	def __init__ (self, max_values: int, top_tables: int, top_columns: int):
+		self.max_values = max_values
+		self.top_tables = top_tables
+		self.top_columns = top_columns
+		self._tables: List[_TableEntry] = []
+		self._table_index: Optional[Bm25Index] = None
+		self._fingerprint: Optional[str] = None
+		self._lock = threading.Lock ()
+		self.builds = 0
+		self.loads = 0
+
+	def refresh (self, db):
+		"""Describe and index every table now; the writer of shared snapshots stores the digest with them"""
+		with self._lock:
+			self._refresh_locked (db)
+
+	def get (self, db, question: str = "") -> SchemaDigest:
+		"""Blocking, run it on the database pool"""
+		with self._lock:
+			if self._fingerprint != db.schema_version:
+				self._refresh_locked (db)
+			tables, fingerprint = self._select (search_terms (question)), self._fingerprint
+
+		text = self._render (tables)
+		# Generated SQL only depends on the digest, so its hash versions cached SQL as well
+		digest_hash = hashlib.sha1 (text.encode ("utf-8")).hexdigest ()[:16] if text else fingerprint
+		return SchemaDigest (text = text, hash = digest_hash, fingerprint = fingerprint)
+
+	def stats (self) -> Dict[str, Any]:
+		return {
+			"tables": len (self._tables),
+			"columns": sum (len (table.columns) for table in self._tables),
+			"builds": self.builds,
+			"loads": self.loads
+		}
+
+	def _refresh_locked (self, db):
+		tables = self._load_catalog (db)
+		if tables is None:
+			tables = []
+			for table in db.get_tables ():
+				try:
+					tables.append (self._describe_table (db, table))
+				except Exception as e:
+					logger.error (f"Failed to describe table {table} for the schema digest: {e}")
+			self._store_catalog (db, tables)
+			self.builds += 1
+		else:
+			self.loads += 1
+
+		for table in tables:
+			if len (table.columns) > self.top_columns:
+				table.column_index = Bm25Index ({i: column.terms for i, column in enumerate (table.columns)})
+
+		self._tables = tables
+		self._table_index = Bm25Index ({
+			i: search_terms (table.name) + [term for column in table.columns for term in column.terms]
+			for i, table in enumerate (tables)
+		})
+		self._fingerprint = db.schema_version
+		logger.info (f"Schema catalog indexed: {len (tables)} tables, {sum (len (table.columns) for table in tables)} columns")
+
+	@staticmethod
+	def _load_catalog (db) -> Optional[List[_TableEntry]]:
+		"""Tables described earlier for the same data, None if there are none (or no database file)"""
+		if not (db.persistent or db.shared) or not db.catalog_key:
+			return None
+
+		cursor = db.connection.cursor ()
+		try:
+			row = cursor.execute (f"SELECT catalog FROM {CATALOG_TABLE} WHERE key = ?", [db.catalog_key]).fetchone ()
+		except duckdb.Error:
+			return None
+		finally:
+			cursor.close ()
+		if row is None:
+			return None
+
+		try:
+			return [
+				_TableEntry (
+					name = table["name"],
+					header = table["header"],
+					columns = [_ColumnEntry (**column) for column in table["columns"]],
+					row_count = table["row_count"]
+				)
+				for table in json.loads (row[0])
+			]
+		except (ValueError, KeyError, TypeError) as e:
+			logger.warning (f"Stored schema catalog is unreadable, describing the tables again: {e}")
+			return None
+
+	@staticmethod
+	def _store_catalog (db, tables: List[_TableEntry]):
+		if not db.persistent or not db.catalog_key:
+			return
+
+		catalog = json.dumps ([
+			{
+				"name": table.name,
+				"header": table.header,
+				"columns": [{"name": column.name, "line": column.line, "terms": column.terms} for column in table.columns],
+				"row_count": table.row_count
+			}
+			for table in tables
+		], ensure_ascii = False, default = str)
+
+		cursor = db.connection.cursor ()
+		try:
+			cursor.execute (f"CREATE OR REPLACE TABLE {CATALOG_TABLE} (key VARCHAR, catalog VARCHAR)")
+			cursor.execute (f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?)", [db.catalog_key, catalog])
+		except duckdb.Error as e:
+			logger.warning (f"Failed to store the schema catalog: {e}")
+		finally:
+			cursor.close ()
+
+	def _select (self, terms: List[str]) -> List[Tuple[_TableEntry, List[_ColumnEntry]]]:
+		"""Top tables for the question and, in wide tables, their top columns; catalog order is kept"""
+		tables = list (range (len (self._tables)))
+		if len (tables) > self.top_tables:
+			# Ties (and questions matching nothing) go to the biggest tables, usually the fact tables
+			scores = self._table_index.scores (terms)
+			ranked = sorted (tables, key = lambda i: (-scores.get (i, 0.0), -self._tables[i].row_count, i))
+			tables = sorted (ranked[:self.top_tables])
+
+		selected = []
+		for i in tables:
+			table = self._tables[i]
+			columns = list (range (len (table.columns)))
+			if table.column_index is not None:
+				# Unmatched columns fill the remaining places, so a vague question still sees the table's key columns
+				scores = table.column_index.scores (terms)
+				columns = sorted (sorted (columns, key = lambda j: (-scores.get (j, 0.0), j))[:self.top_columns])
+			selected.append ((table, [table.columns[j] for j in columns]))
+		return selected
+
+	def _render (self, selected: List[Tuple[_TableEntry, List[_ColumnEntry]]]) -> str:
+		if not selected:
+			return ""
+
+		sections = []
+		for table, columns in selected:
+			header = table.header
+			if len (columns) < len (table.columns):
+				header += f", {len (columns)} of {len (table.columns)} columns shown"
+			sections.append ("\n".join ([header] + [column.line for column in columns]))
+
+		sections.append ('Write column names exactly as listed, keep the double quotes where shown.')
+		return "\n\n".join (sections)
+
+	def _describe_table (self, db, table: str) -> _TableEntry:
+		columns = db.get_table_schema (table)
+		text_columns = [column["name"] for column in columns if column["type"].upper () in _TEXT_TYPES]
+		date_columns = [column["name"] for column in columns if column["type"].upper ().startswith (_DATE_TYPES)]
+
+		# One pass over the table for row count, cardinalities and date ranges
+		aggregates = ["COUNT(*) AS row_count"]
+		for i, name in enumerate (text_columns):
+			aggregates.append (f"approx_count_distinct({_quote (name)}) AS distinct_{i}")
+		for i, name in enumerate (date_columns):
+			aggregates.append (f"MIN({_quote (name)}) AS min_{i}, MAX({_quote (name)}) AS max_{i}")
+
+		rows, _ = db.execute_query (f"SELECT {', '.join (aggregates)} FROM {_quote (table)}")
+		stats = rows[0] if rows else {}
+
+		details: Dict[str, str] = {}
+		for i, name in enumerate (date_columns):
+			if stats.get (f"min_{i}") is not None:
+				details[name] = f"from {stats[f'min_{i}']} to {stats[f'max_{i}']}"
+
+		for i, name in enumerate (text_columns):
+			if (stats.get (f"distinct_{i}") or 0) > self.max_values * 2:
+				continue
+			values = self._distinct_values (db, table, name)
+			if values is not None:
+				details[name] = "values: " + ", ".join (_literal (value) for value in values)
+
+		entries = []
+		for column in columns:
+			line = f"- {_display_name (column['name'])} {column['type']}"
+			detail = details.get (column["name"], "")
+			if detail:
+				line += f", {detail}"
+			entries.append (_ColumnEntry (
+				name = column["name"],
+				line = line,
+				terms = search_terms (column["name"]) + (search_terms (detail[len ("values:"):]) if detail.startswith ("values") else [])
+			))
+
+		return _TableEntry (
+			name = table,
+			header = f"Table: {table} ({stats.get ('row_count', 0)} rows)",
+			columns = entries,
+			row_count = stats.get ("row_count", 0)
+		)
+
+	def _distinct_values (self, db, table: str, column: str) -> Optional[List[Any]]:
+		# approx_count_distinct can be off, the LIMIT decides
+		rows, _ = db.execute_query (
+			f"SELECT DISTINCT {_quote (column)} AS value FROM {_quote (table)} "
+			f"WHERE {_quote (column)} IS NOT NULL ORDER BY 1 LIMIT {self.max_values + 1}"
+		)
+		if len (rows) > self.max_values:
+			return None
+		return [row["value"] for row in rows]
+
+
+_schema_digest_instance: Optional[SchemaDigestBuilder] = None
+
+
+def get_schema_digest () -> SchemaDigestBuilder:
+	global _schema_digest_instance
+
+	if _schema_digest_instance is None:
+		_schema_digest_instance = SchemaDigestBuilder (
+			max_values = settings.schema_digest_max_values,
+			top_tables = settings.schema_digest_top_tables,
+			top_columns = settings.schema_digest_top_columns
+		)
+
+	return _schema_digest_instance
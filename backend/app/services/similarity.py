@@ -0,0 +1,166 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+_PUNCTUATION_RE = re.compile (r"[^\w\s]+", re.UNICODE)
+_LITERAL_RE = re.compile (r"\w*\d\w*", re.UNICODE)
+_CAMEL_RE = re.compile (r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+_WORD_RE = re.compile (r"[^\W_]+", re.UNICODE)
+
+
+def normalize_question (text: str) -> str:
+	text = unicodedata.normalize ("NFKC", text).lower ()
+	text = _PUNCTUATION_RE.sub (" ", text)
+	return " ".join (text.split ())
+
+
+def literal_tokens (normalized: str) -> List[str]:
+	"""Tokens carrying digits (counts, dates, IDs) - they must match exactly"""
+	return _LITERAL_RE.findall (normalized)
+
+
+# Words that never change what a question asks for; negations and every other word count
+_FILLER_WORDS = {"a", "an", "the", "please", "show", "me", "пожалуйста", "покажи", "покажите"}
+
+
+def _within_one_edit (a: str, b: str) -> bool:
+	"""One substitution, insertion, deletion or swap of adjacent characters"""
+	if abs (len (a) - len (b)) > 1:
+		return False
+	if len (a) == len (b):
+		diff = [i for i in range (len (a)) if a[i] != b[i]]
+		return len (diff) <= 1 or (len (diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+	if len (a) > len (b):
+		a, b = b, a
+	i = 0
+	while i < len (a) and a[i] == b[i]:
+		i += 1
+	return a[i:] == b[i + 1:]
+
+
+def same_content_words (a: str, b: str) -> bool:
+	"""
+	True if two normalized questions use the same content words in the same order, up to
+	spacing and one-character typos in words of five or more letters. "ascending" / "descending",
+	"including" / "excluding", an added "not" and swapped words ("from Almaty to Astana")
+	all make questions different.
+	"""
+	words_a = [word for word in a.split () if word not in _FILLER_WORDS]
+	words_b = [word for word in b.split () if word not in _FILLER_WORDS]
+	if "".join (words_a) == "".join (words_b):
+		return True
+	if len (words_a) != len (words_b):
+		return False
+	return all (
+		word == other or (min (len (word), len (other)) >= 5 and _within_one_edit (word, other))
+		for word, other in zip (words_a, words_b)
+	)
+
+
+def search_terms (text: str) -> List[str]:
+	"""Lowercased words with identifiers split (TransactionAmount, ip_address) and plurals folded"""
+	terms = []
+	for word in _WORD_RE.findall (_CAMEL_RE.sub (" ", unicodedata.normalize ("NFKC", text))):
+		word = word.lower ()
+		if len (word) > 3 and word.endswith ("s") and not word.endswith ("ss"):
+			word = word[:-1]
+		terms.append (word)
+	return terms
+
+
+def char_ngrams (text: str, n: int = 3) -> Set[str]:
+	padded = f" {text} "
+	if len (padded) <= n:
+		return {padded}
+	return {padded[i:i + n] for i in range (len (padded) - n + 1)}
+
+
+class NgramIndex:
+	"""Inverted index of character n-grams with Jaccard scoring"""
+
+	def __init__ (self, n: int = 3):
+		self.n = n
+		self._grams: Dict[Hashable, Set[str]] = {}
+		self._postings: Dict[str, Set[Hashable]] = {}
+
+	def __len__ (self) -> int:
+		return len (self._grams)
+
+	def add (self, key: Hashable, text: str):
+		self.remove (key)
+		grams = char_ngrams (text, self.n)
+		self._grams[key] = grams
+		for gram in grams:
+			self._postings.setdefault (gram, set ()).add (key)
+
+	def remove (self, key: Hashable):
+		grams = self._grams.pop (key, None)
+		if not grams:
+			return
+		for gram in grams:
+			keys = self._postings.get (gram)
+			if keys is None:
+				continue
+			keys.discard (key)
+			if not keys:
+				del self._postings[gram]
+
+	def clear (self):
+		self._grams.clear ()
+		self._postings.clear ()
+
+	def search (self, text: str, limit: int = 5, min_score: float = 0.0) -> List[Tuple[Hashable, float]]:
+		grams = char_ngrams (text, self.n)
+		shared: Dict[Hashable, int] = {}
+		for gram in grams:
+			for key in self._postings.get (gram, ()):
+				shared[key] = shared.get (key, 0) + 1
+
+		scored = []
+		for key, common in shared.items ():
+			score = common / (len (grams) + len (self._grams[key]) - common)
+			if score >= min_score:
+				scored.append ((key, score))
+
+		scored.sort (key = lambda item: item[1], reverse = True)
+		return scored[:limit]
+
+	def best (self, text: str, min_score: float = 0.0) -> Optional[Tuple[Hashable, float]]:
+		matches = self.search (text, limit = 1, min_score = min_score)
+		return matches[0] if matches else None
+
+
+class Bm25Index:
+	"""Okapi BM25 over small documents (table and column descriptions), rebuilt as a whole"""
+
+	def __init__ (self, documents: Dict[Hashable, Iterable[str]], k1: float = 1.2, b: float = 0.75):
+		self.k1 = k1
+		self.b = b
+		self._terms: Dict[Hashable, Counter] = {key: Counter (terms) for key, terms in documents.items ()}
+		self._lengths = {key: sum (counts.values ()) for key, counts in self._terms.items ()}
+		self._average_length = (sum (self._lengths.values ()) / len (self._lengths)) if self._lengths else 0.0
+
+		frequency: Counter = Counter ()
+		for counts in self._terms.values ():
+			frequency.update (counts.keys ())
+		total = len (self._terms)
+		self._idf = {term: math.log (1 + (total - count + 0.5) / (count + 0.5)) for term, count in frequency.items ()}
+
+	def __len__ (self) -> int:
+		return len (self._terms)
+
+	def scores (self, terms: Iterable[str]) -> Dict[Hashable, float]:
+		query = set (terms) & self._idf.keys ()
+		scores: Dict[Hashable, float] = {}
+		for key, counts in self._terms.items ():
+			score = 0.0
+			norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / (self._average_length or 1))
+			for term in query:
+				count = counts.get (term)
+				if count:
+					score += self._idf[term] * count * (self.k1 + 1) / (count + norm)
+			if score > 0:
+				scores[key] = score
+		return scores
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar ("T")
+
+
+class SingleFlight:
+	"""
+	Coalesces concurrent calls with the same key: the first caller starts the work,
+	callers arriving while it runs await the same result (or exception).
+	The work runs as its own task, so a caller that disconnects does not cancel it for the others.
+	"""
+
+	def __init__ (self):
+		self._calls: Dict[Hashable, asyncio.Task] = {}
+		self.calls = 0
+		self.shared = 0
+
+	async def do (self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+		task = self._calls.get (key)
+		if task is None:
+			self.calls += 1
+			task = asyncio.ensure_future (func ())
+			self._calls[key] = task
+			task.add_done_callback (lambda done: self._finish (key, done))
+		else:
+			self.shared += 1
+
+		return await asyncio.shield (task)
+
+	def stats (self) -> Dict[str, Any]:
+		return {
+			"in_flight": len (self._calls),
+			"calls": self.calls,
+			"shared": self.shared
+		}
+
+	def _finish (self, key: Hashable, task: asyncio.Task):
+		if self._calls.get (key) is task:
+			del self._calls[key]
+		# Mark the exception as retrieved in case every caller went away
+		if not task.cancelled ():
+			task.exception ()
@@ -0,0 +1,63 @@
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+# Enough of the SQL lexicon for the query rewriters (rollups, partition pruning); comments are not tokens
+TOKEN_RE = re.compile (r"""
+	(?P<string>'(?:[^']|'')*')
+	| (?P<quoted>"(?:[^"]|"")*")
+	| (?P<number>\d+(?:\.\d+)?)
+	| (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+	| (?P<op><=|>=|<>|!=|::|\|\||[(),.*=<>+\-/%])
+	| (?P<space>\s+)
+""", re.VERBOSE)
+
+# Words that may follow a complete comparison operand
+OPERAND_END = {"and", "or", "group", "order", "having", "limit", "offset", "qualify", "window"}
+
+
+class Token (NamedTuple):
+	kind: str
+	text: str
+	start: int = 0
+	end: int = 0
+
+	@property
+	def name (self) -> str:
+		if self.kind == "quoted":
+			return self.text[1:-1].replace ('""', '"').lower ()
+		return self.text.lower ()
+
+	def is_word (self, *names: str) -> bool:
+		return self.kind == "word" and self.text.lower () in names
+
+
+def tokenize (sql: str) -> Optional[List[Token]]:
+	"""Tokens without whitespace, None if the query has anything TOKEN_RE does not know"""
+	tokens = []
+	position = 0
+	while position < len (sql):
+		match = TOKEN_RE.match (sql, position)
+		if not match:
+			return None
+		position = match.end ()
+		if match.lastgroup != "space":
+			tokens.append (Token (match.lastgroup, match.group (), match.start (), match.end ()))
+	return tokens
+
+
+def date_literal_at (tokens: List[Token], i: int) -> Tuple[Optional[str], int]:
+	"""Date literal at i ('2024-01-01', DATE '2024-01-01' or '2024-01-01'::DATE) and the index after it"""
+	if i < len (tokens) and tokens[i].is_word ("date", "timestamp"):
+		i += 1
+	if i >= len (tokens) or tokens[i].kind != "string":
+		return None, i
+	literal = tokens[i].text
+	i += 1
+	if i + 1 < len (tokens) and tokens[i].text == "::" and tokens[i + 1].is_word ("date", "timestamp"):
+		i += 2
+	return literal, i
+
+
+def ends_operand (tokens: List[Token], i: int) -> bool:
+	"""Nothing binds to the operand before i: arithmetic such as DATE '2024-01-01' - 15 moves the bound"""
+	return i >= len (tokens) or tokens[i].text == ")" or tokens[i].is_word (*OPERAND_END)
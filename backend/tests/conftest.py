@@ -0,0 +1,34 @@
+import duckdb
+import pytest
+
+# Same columns as the transactions dataset, with deterministic values
+TRANSACTIONS_SQL = """
+	SELECT
+		'T' || i AS TransactionID,
+		'A' || (i % 97) AS AccountID,
+		round (((i * 7919) % 100000) / 100.0, 2) AS TransactionAmount,
+		TIMESTAMP '2022-11-01 00:00:00' + to_seconds ((i * 3607) % (550 * 86400)) AS TransactionDate,
+		CASE WHEN i % 3 = 0 THEN 'Credit' ELSE 'Debit' END AS TransactionType,
+		list_extract (['Almaty', 'Astana', 'Shymkent', 'Aktobe'], 1 + i % 4) AS Location,
+		'D' || (i % 50) AS DeviceID,
+		'10.0.0.' || (i % 200) AS "IP Address",
+		'M' || (i % 13) AS MerchantID,
+		list_extract (['ATM', 'Online', 'Branch'], 1 + i % 3) AS Channel
+	FROM range (20000) AS numbers (i)
+"""
+
+
+@pytest.fixture (scope = "module")
+def transactions () -> duckdb.DuckDBPyConnection:
+	connection = duckdb.connect ()
+	connection.execute (f"CREATE TABLE transactions AS {TRANSACTIONS_SQL}")
+	yield connection
+	connection.close ()
+
+
+def rows (connection: duckdb.DuckDBPyConnection, sql: str) -> list:
+	"""Result rows with floats rounded, so SUM over rollups and over rows compare equal"""
+	return [
+		tuple (round (value, 6) if isinstance (value, float) else value for value in row)
+		for row in connection.execute (sql).fetchall ()
+	]
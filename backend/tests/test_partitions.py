@@ -0,0 +1,78 @@
+import duckdb
+import pytest
+
+from app.services.partitions import PartitionedTable, PartitionPruner
+
+from conftest import TRANSACTIONS_SQL, rows
+
+
+@pytest.fixture (scope = "module")
+def dataset (tmp_path_factory):
+	return tmp_path_factory.mktemp ("partitions") / "transactions"
+
+
+@pytest.fixture (scope = "module")
+def pruner (dataset) -> PartitionPruner:
+	pruner = PartitionPruner ()
+	pruner.refresh ([PartitionedTable ("transactions", dataset, ["year", "month"], "TransactionDate")])
+	return pruner
+
+
+@pytest.fixture (scope = "module")
+def partitioned (dataset) -> duckdb.DuckDBPyConnection:
+	"""Transactions written as year=/month= partitions and read back through a view, like the service does"""
+	connection = duckdb.connect ()
+	connection.execute (f"""
+		COPY (
+			SELECT *, year (TransactionDate) AS year, month (TransactionDate) AS month FROM ({TRANSACTIONS_SQL})
+		) TO '{dataset}' (FORMAT PARQUET, PARTITION_BY (year, month))
+	""")
+	connection.execute (f"CREATE VIEW transactions AS SELECT * FROM read_parquet ('{dataset}/**/*.parquet', hive_partitioning = true)")
+	yield connection
+	connection.close ()
+
+
+@pytest.mark.parametrize ("sql, predicate", [
+	("SELECT COUNT(*), SUM(TransactionAmount) FROM transactions WHERE TransactionDate < '2024-01-01'", "(year * 100 + month) <= 202312"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate <= '2023-12-31 23:59:59'", "(year * 100 + month) <= 202312"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate < '2023-03-01 00:00:00'", "(year * 100 + month) <= 202302"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate < '2023-03-01 00:00:01'", "(year * 100 + month) <= 202303"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate >= '2023-12-31'", "(year * 100 + month) >= 202312"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate > '2023-01-31 23:00:00'", "(year * 100 + month) >= 202301"),
+	("SELECT Channel, COUNT(*) FROM transactions WHERE TransactionDate BETWEEN '2023-12-15' AND '2024-01-15' GROUP BY Channel ORDER BY Channel", "(year * 100 + month) BETWEEN 202312 AND 202401"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate BETWEEN DATE '2023-12-01' AND DATE '2024-01-01'", "(year * 100 + month) BETWEEN 202312 AND 202401"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate >= '2023-12-01'::DATE AND TransactionDate < '2024-01-01'::DATE", "(year * 100 + month) BETWEEN 202312 AND 202312"),
+	("SELECT COUNT(*) FROM transactions t WHERE t.TransactionDate >= '2023-02-28' AND t.TransactionDate < '2023-03-01' AND Channel = 'ATM'", "(year * 100 + month) BETWEEN 202302 AND 202302"),
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate = '2024-02-29'", "(year * 100 + month) BETWEEN 202402 AND 202402"),
+	("SELECT TransactionID, TransactionAmount FROM transactions WHERE TransactionDate >= '2023-06-01' AND TransactionDate < '2023-07-01' ORDER BY TransactionID LIMIT 20", "(year * 100 + month) BETWEEN 202306 AND 202306"),
+	# Arithmetic on the upper literal keeps only the lower bound
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate BETWEEN '2023-01-01' AND DATE '2023-02-01' + INTERVAL 10 DAY AND Channel = 'ATM'", "(year * 100 + month) >= 202301"),
+	# Range outside the data: both sides must come back empty
+	("SELECT COUNT(*) FROM transactions WHERE TransactionDate < '2022-11-01'", "(year * 100 + month) <= 202210"),
+])
+def test_rewritten_query_returns_the_same_result (partitioned, pruner, sql, predicate):
+	rewritten = pruner.rewrite (sql)
+
+	assert rewritten is not None and predicate in rewritten
+	assert rows (partitioned, rewritten) == rows (partitioned, sql)
+
+
+@pytest.mark.parametrize ("sql", [
+	"SELECT COUNT(*) FROM transactions WHERE TransactionDate < '2024-01-01' OR Channel = 'ATM'",
+	"SELECT COUNT(*) FROM transactions t JOIN transactions u ON t.TransactionID = u.TransactionID WHERE t.TransactionDate < '2024-01-01'",
+	"SELECT COUNT(*) FROM transactions",
+	"SELECT COUNT(*) FROM transactions WHERE Channel = 'ATM'",
+	"SELECT COUNT(*) FROM transactions WHERE NOT TransactionDate < '2024-01-01'",
+	"SELECT COUNT(*) FROM transactions WHERE TransactionDate NOT BETWEEN '2023-01-01' AND '2023-12-31'",
+	"SELECT COUNT(*) FROM transactions WHERE (TransactionDate < '2023-01-01' OR TransactionDate > '2024-01-01')",
+	"SELECT COUNT(*) FROM transactions WHERE TransactionDate < '2024-01-01' -- comment",
+	"SELECT COUNT(*) FROM transactions /* hint */ WHERE TransactionDate < '2024-01-01'",
+	"SELECT COUNT(*) FROM accounts WHERE TransactionDate < '2024-01-01'",
+	"SELECT COUNT(*) FROM transactions WHERE TransactionDate < '2023-02-30'",
+	"SELECT COUNT(*) FROM transactions WHERE TransactionDate >= DATE '2023-02-01' - INTERVAL 15 DAY",
+	"SELECT COUNT(*) FROM transactions WHERE TransactionDate < '2023-02-01'::DATE + INTERVAL 10 DAY",
+	"WITH t AS (SELECT * FROM transactions) SELECT COUNT(*) FROM t WHERE TransactionDate < '2024-01-01'",
+	"SELECT COUNT(*) FROM transactions WHERE TransactionID IN (SELECT TransactionID FROM transactions WHERE TransactionDate < '2024-01-01')",
+])
+def test_query_left_unchanged (pruner, sql):
+	assert pruner.rewrite (sql) is None
@@ -0,0 +1,33 @@
+import pytest
+
+from app.services.query_history import QueryHistory
+
+
+@pytest.fixture
+def history (tmp_path) -> QueryHistory:
+	history = QueryHistory (str (tmp_path / "history.jsonl"), max_entries = 100)
+	history.record (
+		"Total amount sent from Almaty to Astana in 2023",
+		"SELECT SUM(TransactionAmount) FROM transactions WHERE Location = 'Almaty' AND year(TransactionDate) = 2023"
+	)
+	history.record (
+		"Accounts with more than 5 transactions and less than 2 devices",
+		"SELECT AccountID FROM transactions GROUP BY AccountID HAVING COUNT(*) > 5 AND COUNT(DISTINCT DeviceID) < 2"
+	)
+	return history
+
+
+def test_changed_literal_is_swapped (history):
+	sql = history.reuse ("Total amount sent from Almaty to Astana in 2024", 0.9)
+
+	assert sql == "SELECT SUM(TransactionAmount) FROM transactions WHERE Location = 'Almaty' AND year(TransactionDate) = 2024"
+	assert history.reused == 1
+
+
+@pytest.mark.parametrize ("question", [
+	"Total amount sent from Astana to Almaty in 2023",
+	"Accounts with less than 5 transactions and more than 2 devices"
+])
+def test_reordered_question_is_not_reused (history, question):
+	assert history.reuse (question, 0.9) is None
+	assert history.reused == 0
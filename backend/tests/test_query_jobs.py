@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.database import Database
+from app.services.query_jobs import CANCELLED, DONE, FAILED, RUNNING, QueryJob, QueryJobManager
+
+
+@pytest.fixture
+def manager (tmp_path) -> QueryJobManager:
+	manager = QueryJobManager (str (tmp_path / "jobs"), concurrency = 2, ttl = 3600, max_pending = 10)
+	yield manager
+	manager.close ()
+
+
+def write_result (manager: QueryJobManager, job_id: str, group_sizes: list):
+	"""A finished job whose result has one row group per entry of group_sizes, rows numbered from 0"""
+	schema = pa.schema ([("n", pa.int64 ())])
+	start = 0
+	with pq.ParquetWriter (manager.result_path (job_id), schema) as writer:
+		for size in group_sizes:
+			writer.write_batch (pa.record_batch ([pa.array (range (start, start + size), pa.int64 ())], schema = schema))
+			start += size
+	manager._save (QueryJob (job_id = job_id, question = "q", state = DONE, row_count = start, finished_at = time.time ()))
+
+
+@pytest.mark.parametrize ("offset, limit", [
+	(0, 10), (0, 4), (3, 5), (4, 1), (9, 6), (5, 100), (14, 1), (15, 10), (100, 5), (0, 0)
+])
+def test_read_page_spans_row_groups (manager, offset, limit):
+	write_result (manager, "paged", [4, 1, 6, 4])
+	assert pq.ParquetFile (manager.result_path ("paged")).metadata.num_row_groups == 4
+
+	page, total = manager.read_page ("paged", offset, limit)
+
+	assert total == 15
+	assert page.column_names == ["n"]
+	assert page.column ("n").to_pylist () == list (range (15))[offset:offset + limit]
+
+
+def test_cancel_finished_job_removes_its_files (manager):
+	write_result (manager, "finished", [3])
+
+	job = manager.cancel ("finished")
+
+	assert job.state == DONE
+	assert not manager.result_path ("finished").exists ()
+	assert manager.get ("finished") is None
+	assert manager.cancel ("finished") is None
+
+
+def test_cancel_job_of_another_worker_leaves_a_marker (manager):
+	manager._save (QueryJob (job_id = "remote", question = "q", state = RUNNING, worker = os.getppid ()))
+
+	job = manager.cancel ("remote")
+
+	assert job.state == RUNNING
+	assert manager._cancel_marker ("remote").exists ()
+	# The owning worker sees the marker between batches
+	assert manager._is_cancelled (job)
+
+
+def test_sweep_fails_jobs_of_exited_workers (manager):
+	manager._save (QueryJob (job_id = "orphan", question = "q", state = RUNNING, worker = 2 ** 22 + 1))
+	manager.result_path ("orphan").with_suffix (".parquet.partial").write_bytes (b"partial")
+
+	manager.sweep ()
+
+	job = manager.get ("orphan")
+	assert job.state == FAILED and "exited" in job.error
+	assert not manager.result_path ("orphan").with_suffix (".parquet.partial").exists ()
+
+
+def run_job (manager: QueryJobManager, sql: str, cancel_after: float = None) -> QueryJob:
+	db = Database (mode = ":memory:")
+
+	async def prepare ():
+		return sql, None
+
+	async def scenario ():
+		job = manager.submit (db, "q", prepare)
+		if cancel_after is not None:
+			await asyncio.sleep (cancel_after)
+			manager.cancel (job.job_id)
+		while job.job_id in manager._tasks:
+			await asyncio.sleep (0.01)
+		return job
+
+	try:
+		return asyncio.run (scenario ())
+	finally:
+		db.close ()
+
+
+def test_job_writes_result (manager):
+	job = run_job (manager, "SELECT range AS n FROM range (25000)")
+
+	assert job.state == DONE and job.row_count == 25000
+	page, total = manager.read_page (job.job_id, 24990, 20)
+	assert total == 25000
+	assert page.column ("n").to_pylist () == list (range (24990, 25000))
+
+
+def test_cancel_running_job (manager):
+	started = time.perf_counter ()
+	job = run_job (manager, "SELECT range AS n, md5 (range::VARCHAR) AS h FROM range (1000000000)", cancel_after = 0.3)
+
+	assert job.state == CANCELLED
+	assert time.perf_counter () - started < 10
+	assert not manager.result_path (job.job_id).exists ()
+	assert not manager.result_path (job.job_id).with_suffix (".parquet.partial").exists ()
+	assert manager.get (job.job_id).state == CANCELLED
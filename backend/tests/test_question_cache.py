@@ -0,0 +1,55 @@
+import pytest
+
+from app.services.ml_service import QuestionCache
+from app.services.similarity import same_content_words, normalize_question
+
+
+def _cache () -> QuestionCache:
+	return QuestionCache (max_entries = 100, ttl = 0, similarity = 0.9)
+
+
+@pytest.mark.parametrize ("cached, asked", [
+	("Total revenue per merchant category sorted descending", "Total revenue per merchant category sorted ascending"),
+	("Count of transactions including refunds and chargebacks", "Count of transactions excluding refunds and chargebacks"),
+	("Merchants whose average transaction amount is not above the average", "Merchants whose average transaction amount is above the average"),
+	("Merchants whose average transaction amount is above the average", "Merchants whose average transaction amount is not above the average"),
+	("Top 10 merchants by revenue", "Top 20 merchants by revenue"),
+	("Покажи транзакции, где сумма больше 100 000", "Покажи транзакции, где сумма меньше 100 000"),
+	("Total amount sent from Almaty to Astana", "Total amount sent from Astana to Almaty"),
+	("Accounts with more than 5 transactions and less than 2 devices", "Accounts with less than 5 transactions and more than 2 devices")
+])
+def test_opposite_questions_are_not_served (cached, asked):
+	cache = _cache ()
+	cache.put (cached, "SELECT 1")
+
+	assert cache.get (asked) is None
+	assert cache.near_hits == 0
+
+
+@pytest.mark.parametrize ("cached, asked", [
+	("Total revenue per merchant category sorted descending", "total revenue per merchant category, sorted descending"),
+	("Total revenue per merchant category sorted descending", "Total revenue per merchant catgory sorted descending"),
+	("Total revenue per merchant category sorted descending", "Total  revenue per merchant category sorted descnding"),
+	("Number of transactions per e-mail domain and channel", "Number of transactions per email domain and channel")
+])
+def test_spelling_and_spacing_variants_are_served (cached, asked):
+	cache = _cache ()
+	cache.put (cached, "SELECT 1")
+
+	assert cache.get (asked) == "SELECT 1"
+
+
+def test_exact_match_only_when_similarity_is_zero ():
+	cache = QuestionCache (max_entries = 100, ttl = 0, similarity = 0)
+	cache.put ("Total revenue per merchant category", "SELECT 1")
+
+	assert cache.get ("Total revenue per merchant catgory") is None
+	assert cache.get ("total revenue per merchant category?") == "SELECT 1"
+
+
+def test_short_words_must_match_exactly ():
+	assert not same_content_words (normalize_question ("max amount per day"), normalize_question ("min amount per day"))
+
+
+def test_filler_words_do_not_count ():
+	assert same_content_words (normalize_question ("Show me the top merchants by revenue"), normalize_question ("top merchants by revenue"))
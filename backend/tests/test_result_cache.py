@@ -0,0 +1,62 @@
+import pyarrow as pa
+import pytest
+
+from app.services import result_cache
+from app.services.result_cache import ResultCache
+
+
+def table (rows: int) -> pa.Table:
+	return pa.table ({"n": list (range (rows))})
+
+
+@pytest.fixture
+def cache (tmp_path) -> ResultCache:
+	# Room for one result in memory, the rest spills
+	return ResultCache (memory_budget = table (1000).nbytes, spill_path = str (tmp_path / "spill"), disk_budget = 10 * 1024 * 1024)
+
+
+def test_evicted_result_is_served_from_disk (cache):
+	cache.put ("SELECT 1", "v1", table (1000))
+	cache.put ("SELECT 2", "v1", table (1000), truncated = True)
+
+	assert cache.stats ()["disk_entries"] == 1
+	cached, truncated = cache.get ("select  1", "v1")
+	assert cached.equals (table (1000)) and not truncated
+	assert cache.disk_hits == 1
+
+	# Loading it back evicted the other one
+	cached, truncated = cache.get ("SELECT 2", "v1")
+	assert cached.equals (table (1000)) and truncated
+
+
+def test_spill_is_written_without_the_lock (cache, monkeypatch):
+	write_table = result_cache.pq.write_table
+	seen = []
+
+	def checked_write (data, path):
+		seen.append (cache._lock.locked ())
+		# Lookups are answered while the file is written
+		assert cache.get ("SELECT 1", "v1") is not None
+		write_table (data, path)
+
+	monkeypatch.setattr (result_cache.pq, "write_table", checked_write)
+	cache.put ("SELECT 1", "v1", table (1000))
+	cache.put ("SELECT 2", "v1", table (1000))
+
+	assert seen == [False]
+	assert cache.stats ()["spilling"] == 0 and cache.stats ()["disk_entries"] == 1
+
+
+def test_spill_finished_after_a_data_change_is_dropped (cache, monkeypatch):
+	write_table = result_cache.pq.write_table
+
+	def write_during_change (data, path):
+		write_table (data, path)
+		cache.get ("SELECT 3", "v2")
+
+	monkeypatch.setattr (result_cache.pq, "write_table", write_during_change)
+	cache.put ("SELECT 1", "v1", table (1000))
+	cache.put ("SELECT 2", "v1", table (1000))
+
+	assert cache.stats ()["disk_entries"] == 0
+	assert not list (cache.spill_path.iterdir ())
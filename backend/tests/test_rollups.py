@@ -0,0 +1,62 @@
+import pytest
+
+from app.services.rollups import RollupManager
+
+from conftest import rows
+
+
+@pytest.fixture (scope = "module")
+def rollups (transactions) -> RollupManager:
+	manager = RollupManager ()
+	manager.refresh (transactions)
+	assert manager.rollups, "rollups were not built"
+	return manager
+
+
+@pytest.mark.parametrize ("sql", [
+	"SELECT MerchantID, SUM(TransactionAmount) AS revenue FROM transactions GROUP BY MerchantID ORDER BY revenue DESC LIMIT 5",
+	"SELECT Channel, COUNT(*) AS n, SUM(TransactionAmount) AS s FROM transactions WHERE TransactionDate >= '2023-02-01' AND TransactionDate < '2023-03-01' GROUP BY Channel ORDER BY Channel",
+	"SELECT date_trunc('month', TransactionDate) AS m, COUNT(*) FROM transactions GROUP BY 1 ORDER BY 1",
+	"SELECT CAST(TransactionDate AS DATE) d, MAX(TransactionAmount), MIN(TransactionAmount) FROM transactions WHERE Channel = 'ATM' GROUP BY d ORDER BY d",
+	"SELECT COUNT(*) FROM transactions WHERE Channel = 'Nope'",
+	"SELECT Location, AVG(TransactionAmount) AS a FROM transactions GROUP BY Location ORDER BY a",
+	"SELECT strftime(TransactionDate, '%Y-%m') ym, SUM(TransactionAmount) FROM transactions GROUP BY ym ORDER BY ym",
+	"SELECT year(TransactionDate) y, \"Location\", COUNT(*) FROM transactions WHERE TransactionType = 'Debit' GROUP BY ALL ORDER BY ALL",
+	"SELECT Channel, Location, TransactionType, COUNT(TransactionAmount) FROM transactions GROUP BY ALL ORDER BY ALL"
+])
+def test_rewritten_query_returns_the_same_result (transactions, rollups, sql):
+	rewritten = rollups.rewrite (sql)
+
+	assert rewritten is not None and "_rollup_" in rewritten
+	assert [column[0] for column in transactions.execute (rewritten).description] == [column[0] for column in transactions.execute (sql).description]
+	assert rows (transactions, rewritten) == rows (transactions, sql)
+
+
+@pytest.mark.parametrize ("sql", [
+	# HAVING and DISTINCT
+	"SELECT Location, COUNT(*) FROM transactions GROUP BY Location HAVING COUNT(*) > 10",
+	"SELECT COUNT(DISTINCT MerchantID) FROM transactions",
+	"SELECT DISTINCT Channel FROM transactions",
+	# Aggregates a rollup cannot answer exactly
+	"SELECT Channel, median(TransactionAmount) FROM transactions GROUP BY Channel",
+	"SELECT Channel, stddev(TransactionAmount) FROM transactions GROUP BY Channel",
+	"SELECT Channel, quantile_cont(TransactionAmount, 0.9) FROM transactions GROUP BY Channel",
+	"SELECT Channel, SUM(TransactionAmount * 2) FROM transactions GROUP BY Channel",
+	# Filters and groups on columns that are not rollup dimensions
+	"SELECT AccountID, SUM(TransactionAmount) FROM transactions GROUP BY AccountID",
+	"SELECT Channel, SUM(TransactionAmount) FROM transactions WHERE AccountID = 'A1' GROUP BY Channel",
+	"SELECT Channel, SUM(TransactionAmount) FROM transactions WHERE TransactionAmount > 100 GROUP BY Channel",
+	"SELECT Channel, SUM(TransactionAmount) FROM transactions WHERE TransactionDate <= '2023-02-01' GROUP BY Channel",
+	"SELECT TransactionDate, COUNT(*) FROM transactions GROUP BY 1",
+	# Date arithmetic moves the bound off the month boundary
+	"SELECT Channel, COUNT(*) FROM transactions WHERE TransactionDate >= DATE '2023-02-01' - 15 GROUP BY Channel",
+	"SELECT Channel, COUNT(*) FROM transactions WHERE TransactionDate < '2023-02-01'::DATE + 10 GROUP BY Channel",
+	# Shapes the rewriter does not parse
+	"SELECT * FROM transactions",
+	"SELECT t.Channel, COUNT(*) FROM transactions t GROUP BY 1",
+	"SELECT Channel, COUNT(*) FROM transactions JOIN transactions USING (TransactionID) GROUP BY 1",
+	"SELECT Channel, SUM(TransactionAmount) OVER () FROM transactions",
+	"SELECT Channel, COUNT(*) FROM transactions GROUP BY 1 -- comment"
+])
+def test_query_is_left_on_the_source_table (rollups, sql):
+	assert rollups.rewrite (sql) is None
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк точечных запросов (WHERE column = value) по колонкам поиска:
+Parquet view -> таблица DuckDB -> таблица с ART индексом, как их строит backend в persistent режиме
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import duckdb
+
+# Те же значения по умолчанию, что index_columns и index_max_rows_per_key в backend/app/config.py
+DEFAULT_COLUMNS = "AccountID,TransactionID,MerchantID,DeviceID,IP Address"
+DEFAULT_MAX_ROWS_PER_KEY = 200
+
+
+def _quote (identifier: str) -> str:
+	return '"' + identifier.replace ('"', '""') + '"'
+
+
+def _literal (value: str) -> str:
+	return "'" + value.replace ("'", "''") + "'"
+
+
+def _source_sql (source: Path) -> str:
+	if source.is_dir ():
+		return f"read_parquet ({_literal (str (source / '**' / '*.parquet'))}, hive_partitioning = true)"
+	return f"read_parquet ({_literal (str (source))})"
+
+
+def _time_lookups (connection: duckdb.DuckDBPyConnection, relation: str, column: str, values: List, repeat: int) -> Dict[str, float]:
+	"""Медиана и p95 в мс по всем значениям; первый прогон прогревает кэш и не учитывается"""
+	query = f"SELECT * FROM {relation} WHERE {_quote (column)} = ?"
+	connection.execute (query, [values[0]]).fetchall ()
+
+	timings = []
+	rows = 0
+	for _ in range (repeat):
+		for value in values:
+			started = time.perf_counter ()
+			rows += len (connection.execute (query, [value]).fetchall ())
+			timings.append ((time.perf_counter () - started) * 1000)
+
+	timings.sort ()
+	return {
+		"median": statistics.median (timings),
+		"p95": timings[min (len (timings) - 1, int (0.95 * len (timings)))],
+		"rows": rows / len (timings)
+	}
+
+
+def run_benchmark (
+		source: str,
+		columns: List[str],
+		samples: int = 20,
+		repeat: int = 3,
+		max_rows_per_key: int = DEFAULT_MAX_ROWS_PER_KEY,
+		force: bool = False,
+		threads: Optional[int] = None,
+		memory_limit: str = "2GB"
+) -> bool:
+	"""
+	Args:
+		source: Parquet файл или секционированный каталог (см. convert_csv_to_parquet.py --partition-by)
+		columns: колонки поиска
+		samples: случайных значений на колонку
+		repeat: прогонов по каждому значению
+		max_rows_per_key: колонки с большим числом строк на значение не индексируются (как в backend)
+		force: индексировать все колонки
+		threads: потоков DuckDB, по умолчанию все ядра
+		memory_limit: лимит памяти DuckDB
+	"""
+	source_path = Path (source)
+	if not source_path.exists ():
+		print (f"❌ Ошибка: {source} не найден!")
+		return False
+
+	with tempfile.TemporaryDirectory () as scratch:
+		connection = duckdb.connect (str (Path (scratch) / "bench.duckdb"))
+		try:
+			connection.execute (f"SET threads = {int (threads or os.cpu_count () or 1)}")
+			connection.execute (f"SET memory_limit = {_literal (memory_limit)}")
+			connection.execute (f"CREATE VIEW parquet_view AS SELECT * FROM {_source_sql (source_path)}")
+
+			started = time.time ()
+			connection.execute ("CREATE TABLE lookup_table AS SELECT * FROM parquet_view")
+			total_rows = connection.execute ("SELECT COUNT(*) FROM lookup_table").fetchone ()[0]
+			print (f"📦 Загружено {total_rows} строк из {source} за {time.time () - started:.2f}s")
+
+			known = {row[0].lower (): row[0] for row in connection.execute ("DESCRIBE lookup_table").fetchall ()}
+			results = []
+			for requested in columns:
+				column = known.get (requested.lower ())
+				if column is None:
+					print (f"⚠️  Колонка {requested} не найдена, пропускаю")
+					continue
+
+				values = [row[0] for row in connection.execute (
+					f"SELECT {_quote (column)} FROM lookup_table WHERE {_quote (column)} IS NOT NULL USING SAMPLE {int (samples)} ROWS"
+				).fetchall ()]
+				if not values:
+					continue
+
+				distinct = connection.execute (f"SELECT approx_count_distinct ({_quote (column)}) FROM lookup_table").fetchone ()[0]
+				rows_per_key = total_rows / distinct if distinct else float (total_rows)
+				print (f"\n🔍 {column}: ~{rows_per_key:.1f} строк на значение")
+
+				view = _time_lookups (connection, "parquet_view", column, values, repeat)
+				table = _time_lookups (connection, "lookup_table", column, values, repeat)
+
+				indexed = None
+				build_time = None
+				if force or rows_per_key <= max_rows_per_key:
+					started = time.time ()
+					connection.execute (f"CREATE INDEX lookup_{len (results)} ON lookup_table ({_quote (column)})")
+					build_time = time.time () - started
+					indexed = _time_lookups (connection, "lookup_table", column, values, repeat)
+				else:
+					print (f"   индекс не строится: больше {max_rows_per_key} строк на значение")
+
+				results.append ((column, rows_per_key, view, table, indexed, build_time))
+
+			print ("\n" + "=" * 96)
+			print (f"{'колонка':<16}{'строк/знач.':>12}{'parquet view':>18}{'таблица':>18}{'таблица + ART':>18}{'индекс, s':>12}")
+			print (f"{'':<16}{'':>12}{'медиана / p95 мс':>18}{'медиана / p95 мс':>18}{'медиана / p95 мс':>18}")
+			print ("-" * 96)
+			for column, rows_per_key, view, table, indexed, build_time in results:
+				cells = [
+					f"{timing['median']:.2f} / {timing['p95']:.2f}" if timing else "-"
+					for timing in (view, table, indexed)
+				]
+				build = f"{build_time:.2f}" if build_time is not None else "-"
+				print (f"{column:<16}{rows_per_key:>12.1f}{cells[0]:>18}{cells[1]:>18}{cells[2]:>18}{build:>12}")
+			print ("=" * 96)
+			return True
+
+		finally:
+			connection.close ()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser (description = "Point lookup benchmark")
+	parser.add_argument ("source", nargs = "?", default = "data/transactions.parquet", help = "Parquet файл или секционированный каталог")
+	parser.add_argument ("--columns", default = DEFAULT_COLUMNS)
+	parser.add_argument ("--samples", type = int, default = 20, help = "Случайных значений на колонку")
+	parser.add_argument ("--repeat", type = int, default = 3)
+	parser.add_argument ("--max-rows-per-key", type = int, default = DEFAULT_MAX_ROWS_PER_KEY)
+	parser.add_argument ("--force", action = "store_true", help = "Индексировать все колонки, даже неселективные (долго)")
+	parser.add_argument ("--threads", type = int, default = None, help = "По умолчанию все ядра")
+	parser.add_argument ("--memory-limit", default = "2GB")
+	args = parser.parse_args ()
+
+	print ("=" * 60)
+	print ("🚀 Point Lookup Benchmark")
+	print ("=" * 60)
+
+	success = run_benchmark (
+		args.source,
+		[column.strip () for column in args.columns.split (",") if column.strip ()],
+		samples = args.samples,
+		repeat = args.repeat,
+		max_rows_per_key = args.max_rows_per_key,
+		force = args.force,
+		threads = args.threads,
+		memory_limit = args.memory_limit
+	)
+	sys.exit (0 if success else 1)
@@ -56,96 +56,417 @@ def _register_data_files (self):
 # Полный скрипт конвертации CSV в Parquet
 # ============================================================
 
-import pandas as pd
+import argparse
+import csv
+import json
+import os
+import shutil
 import sys
+import time
 from pathlib import Path
-
-
-def convert_csv_to_parquet (csv_path: str, output_name: str = "transactions"):
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+import pyarrow.parquet as pq
+
+# Явные типы колонок: docs/DATABASE_SCHEMA.md и схема transactions из ml-сервиса.
+# Колонки не из списка получают тип, определенный DuckDB по выборке.
+COLUMN_TYPES: Dict[str, str] = {
+	# bank_transactions_data_2.csv
+	"TransactionID": "VARCHAR",
+	"AccountID": "VARCHAR",
+	"TransactionAmount": "DECIMAL(18,2)",
+	"TransactionDate": "DATE",
+	"TransactionType": "VARCHAR",
+	"Location": "VARCHAR",
+	"DeviceID": "VARCHAR",
+	"IP Address": "VARCHAR",
+	"MerchantID": "VARCHAR",
+	"Channel": "VARCHAR",
+	# docs/DATABASE_SCHEMA.md
+	"transaction_id": "VARCHAR",
+	"transaction_timestamp": "TIMESTAMP",
+	"expiry_date": "VARCHAR",
+	"card_id": "BIGINT",
+	"issuer_bank_name": "VARCHAR",
+	"issuer_country_iso": "VARCHAR",
+	"merchant_id": "INTEGER",
+	"merchant_mcc": "INTEGER",
+	"mcc_category": "VARCHAR",
+	"merchant_city": "VARCHAR",
+	"transaction_type": "VARCHAR",
+	"transaction_amount_kzt": "DECIMAL(18,2)",
+	"original_amount": "DECIMAL(18,2)",
+	"transaction_currency": "VARCHAR",
+	"acquirer_country_iso": "VARCHAR",
+	"pos_entry_mode": "VARCHAR",
+	"wallet_type": "VARCHAR",
+	"_index_level_0_": "BIGINT",
+}
+
+# Первая найденная колонка задает порядок строк: zone maps (min/max row group) отсекают лишнее при фильтре по дате
+SORT_COLUMNS = ("TransactionDate", "transaction_timestamp")
+
+# Ключи секционирования, которые вычисляются из колонки даты (SORT_COLUMNS), если их нет в CSV
+DERIVED_PARTITION_KEYS = {"year": "year", "month": "month"}
+
+# Описание секционированного набора рядом с каталогами секций, его читает backend (services/partitions.py)
+LAYOUT_FILE = "_partitioning.json"
+
+# 120 векторов DuckDB по 2048 строк: row group обрабатывается одним потоком, небольшие группы дают точнее zone maps
+DEFAULT_ROW_GROUP_SIZE = 122880
+
+
+def _quote (identifier: str) -> str:
+	return '"' + identifier.replace ('"', '""') + '"'
+
+
+def _literal (value: str) -> str:
+	return "'" + value.replace ("'", "''") + "'"
+
+
+def _read_header (csv_path: Path) -> List[str]:
+	with csv_path.open (newline = "", encoding = "utf-8-sig") as file:
+		return next (csv.reader (file))
+
+
+def _build_query (
+		csv_path: Path,
+		columns: List[str],
+		types: Dict[str, str],
+		sort_column: Optional[str],
+		derived: Optional[Dict[str, str]] = None,
+		date_column: Optional[str] = None
+) -> str:
+	# CSV читается с явными типами; даты читаются как TIMESTAMP и приводятся к DATE в SELECT,
+	# так строки вида "2023-04-11 16:29:14" тоже проходят
+	read_types = {
+		column: ("TIMESTAMP" if types[column] == "DATE" else types[column])
+		for column in columns if column in types
+	}
+	types_arg = "{" + ", ".join (f"{_literal (column)}: {_literal (read_type)}" for column, read_type in read_types.items ()) + "}"
+
+	select = []
+	for column in columns:
+		if types.get (column) == "DATE":
+			select.append (f"CAST ({_quote (column)} AS DATE) AS {_quote (column)}")
+		else:
+			select.append (_quote (column))
+	for key, function in (derived or {}).items ():
+		select.append (f"{function} ({_quote (date_column)}) AS {_quote (key)}")
+
+	query = (
+		f"SELECT {', '.join (select)} FROM read_csv ({_literal (str (csv_path))}, "
+		f"header = true, auto_detect = true, parallel = true, types = {types_arg})"
+	)
+	if sort_column:
+		query += f" ORDER BY {_quote (sort_column)}"
+	return query
+
+
+def verify_parquet (path: Path, expected_rows: Optional[int], sort_column: Optional[str]) -> Tuple[bool, Dict[str, object]]:
+	"""
+	Проверка по метаданным футера, без чтения данных: число строк (если expected_rows задан), row groups,
+	сжатие и порядок сортировки по статистике min/max каждой группы
+	"""
+	metadata = pq.ParquetFile (path).metadata
+	report = {
+		"rows": metadata.num_rows,
+		"row_groups": metadata.num_row_groups,
+		"columns": metadata.num_columns,
+		"compression": sorted ({
+			metadata.row_group (0).column (i).compression for i in range (metadata.num_columns)
+		}) if metadata.num_row_groups else [],
+		"sorted": None
+	}
+	ok = expected_rows is None or metadata.num_rows == expected_rows
+
+	if sort_column and metadata.num_row_groups:
+		names = [metadata.schema.column (i).name for i in range (metadata.num_columns)]
+		index = names.index (sort_column)
+		previous_max = None
+		report["sorted"] = True
+		for i in range (metadata.num_row_groups):
+			statistics = metadata.row_group (i).column (index).statistics
+			if statistics is None or not statistics.has_min_max:
+				report["sorted"] = None  # Нет статистики - проверить по футеру нельзя
+				break
+			if previous_max is not None and statistics.min < previous_max:
+				report["sorted"] = False
+				break
+			previous_max = statistics.max
+		ok = ok and report["sorted"] is not False
+
+	return ok, report
+
+
+def convert_csv_to_parquet (
+		csv_path: str,
+		output_name: str = "transactions",
+		output_dir: str = "data",
+		row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+		compression: str = "zstd",
+		threads: Optional[int] = None,
+		memory_limit: str = "2GB",
+		temp_dir: Optional[str] = None,
+		type_overrides: Optional[Dict[str, str]] = None,
+		sort: bool = True,
+		partition_by: Optional[List[str]] = None,
+		replace_partitions: bool = False
+):
 	"""
-	Конвертирует CSV в Parquet формат
+	Потоковая конвертация CSV в Parquet через DuckDB
+
+	CSV читается параллельно блоками на всех ядрах, сортировка внешняя: при нехватке
+	memory_limit данные сбрасываются во временный каталог, так что память ограничена
+	при любом размере файла.
 
 	Args:
 		csv_path: путь к CSV файлу
 		output_name: имя выходного файла (без расширения)
+		output_dir: каталог для Parquet файла
+		row_group_size: строк в row group
+		compression: zstd, snappy, gzip или uncompressed
+		threads: потоков DuckDB, по умолчанию все ядра
+		memory_limit: лимит памяти DuckDB, например "2GB"
+		temp_dir: каталог для сброса данных сортировки
+		type_overrides: типы колонок поверх COLUMN_TYPES, например {"TransactionDate": "TIMESTAMP"}
+		sort: сортировать по дате транзакции
+		partition_by: ключи секционирования, например ["year", "month", "Channel"]; тогда результат -
+			каталог output_dir/output_name/year=2023/month=5/Channel=ATM/*.parquet, новые файлы
+			добавляются к уже записанным секциям
+		replace_partitions: файлы секций, которые есть в этом CSV, заменяют прежние файлы этих секций
 	"""
-	try:
-		print (f"📂 Читаю CSV файл: {csv_path}")
-
-		# Читаем CSV
-		df = pd.read_csv (csv_path)
-
-		print (f"✅ Загружено {len (df)} строк, {len (df.columns)} колонок")
-		print (f"📋 Колонки: {', '.join (df.columns.tolist ())}")
-
-		# Показываем первые строки
-		print ("\n📊 Первые 3 строки:")
-		print (df.head (3))
-
-		# Информация о типах данных
-		print ("\n🔍 Типы данных:")
-		print (df.dtypes)
-
-		# Конвертируем в Parquet
-		data_dir = Path ("data")
-		data_dir.mkdir (exist_ok = True)
+	csv_file = Path (csv_path)
+	if not csv_file.exists ():
+		print (f"❌ Ошибка: Файл {csv_path} не найден!")
+		return False
 
-		output_path = data_dir / f"{output_name}.parquet"
+	data_dir = Path (output_dir)
+	data_dir.mkdir (parents = True, exist_ok = True)
+	output_path = data_dir / f"{output_name}.parquet"
+	# Пишем во временный файл и заменяем целевой только после проверки
+	partial_path = data_dir / f".{output_name}.parquet.partial"
 
-		print (f"\n💾 Сохраняю в Parquet: {output_path}")
-		df.to_parquet (output_path, index = False, engine = 'pyarrow')
+	types = dict (COLUMN_TYPES, **(type_overrides or {}))
+	threads = threads or os.cpu_count () or 1
 
-		# Проверяем размер файла
+	connection = None
+	try:
+		columns = _read_header (csv_file)
+		date_column = next ((column for column in SORT_COLUMNS if column in columns), None)
+		sort_column = date_column if sort else None
+
+		derived = {}
+		for key in partition_by or []:
+			if key in columns:
+				continue
+			if key not in DERIVED_PARTITION_KEYS or date_column is None:
+				print (f"❌ Ошибка: ключ секционирования {key} не найден в CSV")
+				return False
+			derived[key] = DERIVED_PARTITION_KEYS[key]
+
+		print (f"📂 Читаю CSV файл: {csv_path} ({csv_file.stat ().st_size / (1024 * 1024):.2f} MB)")
+		print (f"📋 Колонки ({len (columns)}): {', '.join (columns)}")
+		typed = [column for column in columns if column in types]
+		print (f"🔍 Явные типы: {', '.join (f'{column} {types[column]}' for column in typed) or 'нет'}")
+		print (f"↕️  Сортировка: {sort_column or 'нет'}")
+		if partition_by:
+			print (f"🗂️  Секции: {'/'.join (partition_by)}{' (замена секций)' if replace_partitions else ''}")
+		print (f"⚙️  Потоков: {threads}, память: {memory_limit}, row group: {row_group_size}, сжатие: {compression}")
+
+		connection = duckdb.connect ()
+		connection.execute (f"SET threads = {int (threads)}")
+		connection.execute (f"SET memory_limit = {_literal (memory_limit)}")
+		connection.execute (f"SET temp_directory = {_literal (str (temp_dir or data_dir / '.duckdb_tmp'))}")
+		# Без сортировки порядок строк CSV не нужен, так потоки не ждут друг друга
+		connection.execute (f"SET preserve_insertion_order = {'true' if sort_column else 'false'}")
+
+		query = _build_query (csv_file, columns, types, sort_column, derived, date_column)
+		if partition_by:
+			return _write_partitioned (
+				connection, query, data_dir, output_name, partition_by, date_column if derived else None,
+				compression, row_group_size, sort_column, replace_partitions
+			)
+
+		start_time = time.time ()
+		written = connection.execute (
+			f"COPY ({query}) TO {_literal (str (partial_path))} "
+			f"(FORMAT PARQUET, COMPRESSION {compression.upper ()}, ROW_GROUP_SIZE {int (row_group_size)})"
+		).fetchone ()[0]
+		elapsed = time.time () - start_time
+		print (f"\n💾 Записано {written} строк за {elapsed:.2f}s")
+
+		print (f"🔍 Проверяю Parquet файл по метаданным...")
+		ok, report = verify_parquet (partial_path, written, sort_column)
+		print (
+			f"   строк: {report['rows']}, row groups: {report['row_groups']}, "
+			f"сжатие: {', '.join (report['compression'])}, отсортирован: {report['sorted']}"
+		)
+		if not ok:
+			print (f"❌ Проверка не пройдена, {output_path} не изменен")
+			partial_path.unlink (missing_ok = True)
+			return False
+
+		partial_path.replace (output_path)
 		file_size = output_path.stat ().st_size / (1024 * 1024)  # MB
-		print (f"✅ Успешно сохранено!")
+		print (f"✅ Успешно сохранено: {output_path}")
 		print (f"📦 Размер файла: {file_size:.2f} MB")
 
-		# Проверяем что файл читается
-		print (f"\n🔍 Проверяю Parquet файл...")
-		df_check = pd.read_parquet (output_path)
-		print (f"✅ Файл читается корректно: {len (df_check)} строк")
-
 		return True
 
-	except FileNotFoundError:
-		print (f"❌ Ошибка: Файл {csv_path} не найден!")
-		return False
-
 	except Exception as e:
 		print (f"❌ Ошибка при конвертации: {e}")
 		import traceback
 		traceback.print_exc ()
+		partial_path.unlink (missing_ok = True)
 		return False
 
+	finally:
+		if connection is not None:
+			connection.close ()
+
+
+def _write_partitioned (
+		connection: duckdb.DuckDBPyConnection,
+		query: str,
+		data_dir: Path,
+		output_name: str,
+		partition_by: List[str],
+		date_column: Optional[str],
+		compression: str,
+		row_group_size: int,
+		sort_column: Optional[str],
+		replace_partitions: bool
+) -> bool:
+	"""
+	Запись в hive-каталоги key=value: DuckDB раскладывает строки по секциям за один проход,
+	файлы пишутся во временный каталог, проверяются и только потом переносятся в набор.
+	Файлы каждого запуска получают свое имя, так что повторная загрузка только добавляет секции.
+	"""
+	output_path = data_dir / output_name
+	staging_path = data_dir / f".{output_name}.partial"
+	layout_path = output_path / LAYOUT_FILE
+
+	if layout_path.exists ():
+		layout = json.loads (layout_path.read_text (encoding = "utf-8"))
+		if layout.get ("keys") != partition_by:
+			print (f"❌ Набор {output_path} секционирован по {'/'.join (layout.get ('keys', []))}, а не по {'/'.join (partition_by)}")
+			return False
+
+	shutil.rmtree (staging_path, ignore_errors = True)
+	batch = time.strftime ("%Y%m%d%H%M%S")
+	try:
+		start_time = time.time ()
+		written = connection.execute (
+			f"COPY ({query}) TO {_literal (str (staging_path))} "
+			f"(FORMAT PARQUET, PARTITION_BY ({', '.join (_quote (key) for key in partition_by)}), "
+			f"COMPRESSION {compression.upper ()}, ROW_GROUP_SIZE {int (row_group_size)}, "
+			f"FILENAME_PATTERN {_literal (f'part-{batch}-{{i}}')})"
+		).fetchone ()[0]
+		elapsed = time.time () - start_time
+		files = sorted (staging_path.glob ("**/*.parquet"))
+
+		print (f"🔍 Проверяю файлы секций по метаданным...")
+		rows = 0
+		for file in files:
+			ok, report = verify_parquet (file, None, sort_column)
+			rows += report["rows"]
+			if not ok:
+				print (f"❌ {file.relative_to (staging_path)}: порядок строк нарушен, {output_path} не изменен")
+				return False
+		# DuckDB 0.9 возвращает 0 строк для COPY с PARTITION_BY, тогда число строк берется из футеров
+		if written and rows != written:
+			print (f"❌ В файлах {rows} строк вместо {written}, {output_path} не изменен")
+			return False
+		print (f"\n💾 Записано {rows} строк в {len (files)} файлов за {elapsed:.2f}s")
+
+		partitions = sorted ({file.parent.relative_to (staging_path) for file in files})
+		new_partitions = [partition for partition in partitions if not (output_path / partition).exists ()]
+		for partition in partitions:
+			target = output_path / partition
+			target.mkdir (parents = True, exist_ok = True)
+			if replace_partitions:
+				for old_file in target.glob ("*.parquet"):
+					old_file.unlink ()
+			for file in (staging_path / partition).glob ("*.parquet"):
+				file.replace (target / file.name)
+
+		# Перезапись описания меняет mtime каталога набора, по нему backend замечает новые данные
+		partial_layout = output_path / f".{LAYOUT_FILE}.partial"
+		partial_layout.write_text (json.dumps ({"keys": partition_by, "date_column": date_column}, ensure_ascii = False), encoding = "utf-8")
+		partial_layout.replace (layout_path)
+
+		size = sum (file.stat ().st_size for file in output_path.glob ("**/*.parquet")) / (1024 * 1024)
+		print (f"✅ Успешно сохранено: {output_path}")
+		print (f"🗂️  Секций в загрузке: {len (partitions)}, новых: {len (new_partitions)}, дополнено: {len (partitions) - len (new_partitions)}")
+		print (f"📦 Размер набора: {size:.2f} MB")
+		return True
 
-if __name__ == "__main__":
-	# Путь к вашему CSV файлу
-	csv_file = "data/bank_transactions_data_2.csv"
+	finally:
+		shutil.rmtree (staging_path, ignore_errors = True)
 
-	# Имя таблицы в базе данных
-	table_name = "transactions"
 
-	if len (sys.argv) > 1:
-		csv_file = sys.argv[1]
-	if len (sys.argv) > 2:
-		table_name = sys.argv[2]
+def _parse_type_overrides (values: List[str]) -> Dict[str, str]:
+	overrides = {}
+	for value in values:
+		column, _, column_type = value.partition ("=")
+		if not column or not column_type:
+			raise argparse.ArgumentTypeError (f"Ожидается COLUMN=TYPE, получено: {value}")
+		overrides[column] = column_type
+	return overrides
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser (description = "CSV to Parquet Converter")
+	# Путь к вашему CSV файлу и имя таблицы в базе данных
+	parser.add_argument ("csv_file", nargs = "?", default = "data/bank_transactions_data_2.csv")
+	parser.add_argument ("table_name", nargs = "?", default = "transactions")
+	parser.add_argument ("--output-dir", default = "data")
+	parser.add_argument ("--row-group-size", type = int, default = DEFAULT_ROW_GROUP_SIZE)
+	parser.add_argument ("--compression", default = "zstd", choices = ["zstd", "snappy", "gzip", "uncompressed"])
+	parser.add_argument ("--threads", type = int, default = None, help = "По умолчанию все ядра")
+	parser.add_argument ("--memory-limit", default = "2GB")
+	parser.add_argument ("--temp-dir", default = None, help = "Каталог для сброса данных сортировки")
+	parser.add_argument ("--type", dest = "types", action = "append", default = [], metavar = "COLUMN=TYPE", help = "Например TransactionDate=TIMESTAMP")
+	parser.add_argument ("--no-sort", action = "store_true", help = "Не сортировать по дате")
+	parser.add_argument ("--partition-by", default = "", metavar = "KEYS", help = "Например year,month,Channel; year и month вычисляются из даты")
+	parser.add_argument ("--replace-partitions", action = "store_true", help = "Заменить файлы секций, которые есть в CSV, вместо добавления")
+	args = parser.parse_args ()
+
+	csv_file = args.csv_file
+	table_name = args.table_name
 
 	print ("=" * 60)
 	print ("🚀 CSV to Parquet Converter")
 	print ("=" * 60)
 
-	success = convert_csv_to_parquet (csv_file, table_name)
+	success = convert_csv_to_parquet (
+		csv_file,
+		table_name,
+		output_dir = args.output_dir,
+		row_group_size = args.row_group_size,
+		compression = args.compression,
+		threads = args.threads,
+		memory_limit = args.memory_limit,
+		temp_dir = args.temp_dir,
+		type_overrides = _parse_type_overrides (args.types),
+		sort = not args.no_sort,
+		partition_by = [key.strip () for key in args.partition_by.split (",") if key.strip ()],
+		replace_partitions = args.replace_partitions
+	)
 
 	if success:
 		print ("\n" + "=" * 60)
 		print ("🎉 Конвертация завершена успешно!")
 		print ("=" * 60)
 		print (f"\n📝 Следующие шаги:")
-		print (f"1. Проверьте файл: data/{table_name}.parquet")
+		output = f"{args.output_dir}/{table_name}/" if args.partition_by else f"{args.output_dir}/{table_name}.parquet"
+		print (f"1. Проверьте {'каталог' if args.partition_by else 'файл'}: {output}")
 		print (f"2. Запустите Docker: make up")
 		print (f"3. Откройте http://localhost:3000")
 	else:
 		print ("\n" + "=" * 60)
 		print ("❌ Конвертация не удалась")
 		print ("=" * 60)
-		sys.exit (1)
\ No newline at end of file
+		sys.exit (1)
@@ -3,13 +3,19 @@ ML Service для text-to-SQL преобразования
 FastAPI приложение с использованием Google Gemini
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import asyncio
 import logging
 import os
-import google.generativeai as genai
+import time
+
+from metrics import CONTENT_TYPE, GENERATION_DURATION, REQUEST_DURATION, registry
+from providers import GenerationRequest, ProviderError, build_chain
 
 # Настройка логирования
 logging.basicConfig(
@@ -34,14 +40,143 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Инициализация Google Gemini
+
+@app.middleware("http")
+async def record_duration(request: Request, call_next):
+    """Длительность каждого запроса в гистограмму"""
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_DURATION.observe(
+        time.perf_counter() - start_time,
+        request.method,
+        route.path if route is not None else "unmatched",
+        str(response.status_code)
+    )
+    return response
+
+# Инициализация провайдеров text-to-SQL (шаблоны, затем Gemini по умолчанию, см. providers.build_chain)
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-    # Используем gemini-pro - стабильная модель с хорошей поддержкой
-    model = genai.GenerativeModel('gemini-2.5-flash')
-else:
-    model = None
+providers = build_chain()
+
+# Ограничения для /generate-sql/batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+
+# Ограничения на вызовы модели
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "8"))  # Parallel Gemini calls per worker
+MODEL_MAX_QUEUE = int(os.getenv("MODEL_MAX_QUEUE", "32"))  # Requests waiting for a slot before 503
+MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", "30"))  # Deadline per request in seconds, queueing included
+
+# Схемы, присланные бэкендом, по их хэшу
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", "64"))
+_schemas: "OrderedDict[str, str]" = OrderedDict()
+
+
+def resolve_schema(schema: Optional[str], schema_hash: Optional[str]) -> Optional[str]:
+    """
+    Remember a schema sent together with its hash, or look it up by hash alone.
+    An unknown hash is answered with 409 so the backend resends the full schema.
+    """
+    if not schema_hash:
+        return schema
+
+    if schema:
+        _schemas[schema_hash] = schema
+        _schemas.move_to_end(schema_hash)
+        while len(_schemas) > SCHEMA_CACHE_SIZE:
+            _schemas.popitem(last=False)
+        return schema
+
+    cached = _schemas.get(schema_hash)
+    if cached is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Unknown schema hash {schema_hash}, send the schema"
+        )
+    _schemas.move_to_end(schema_hash)
+    return cached
+
+
+class ModelGate:
+    """
+    Caps concurrent model calls. Requests beyond the cap wait in a bounded queue;
+    when the queue is full they are rejected at once instead of piling up.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def enter(self, bounded: bool = True):
+        """Take a place in the queue, raises 503 if it is full"""
+        # active + waiting counts requests that entered but have not got their slot yet as well
+        if bounded and self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            logger.warning(f"Model queue is full ({self.waiting} waiting), rejecting request")
+            raise HTTPException(
+                status_code=503,
+                detail="Model is overloaded, try again later",
+                headers={"Retry-After": "1"}
+            )
+        self.waiting += 1
+
+    async def run(self, call):
+        """Wait for a free slot (after enter()) and await call() in it"""
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            return await call()
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts
+        }
+
+
+model_gate = ModelGate(MODEL_MAX_CONCURRENCY, MODEL_MAX_QUEUE)
+
+# Генерации в процессе: одинаковые одновременные вопросы ждут один вызов модели
+_inflight: Dict[tuple, asyncio.Task] = {}
+inflight_stats = {"calls": 0, "shared": 0}
+
+
+async def _coalesced(key: tuple, factory):
+    """Await the in-flight task for key, starting it with factory() if there is none"""
+    task = _inflight.get(key)
+    if task is None:
+        inflight_stats["calls"] += 1
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+
+        def finish(done):
+            if _inflight.get(key) is done:
+                del _inflight[key]
+            if not done.cancelled():
+                done.exception()
+
+        task.add_done_callback(finish)
+    else:
+        inflight_stats["shared"] += 1
+
+    return await asyncio.shield(task)
 
 # Database schema
 DATABASE_SCHEMA = """
@@ -75,10 +210,18 @@ Question: {question}
 Return ONLY the SQL query, nothing else."""
 
 
+class SQLExample(BaseModel):
+    question: str
+    sql: str
+
+
 class SQLRequest(BaseModel):
     question: str
     schema: Optional[str] = None
+    schema_hash: Optional[str] = None  # Digest hash; the schema text can be omitted once sent
     language: Optional[str] = "eng_Latn"
+    timeout: Optional[float] = None  # Caller's deadline in seconds, capped by MODEL_TIMEOUT
+    examples: Optional[List[SQLExample]] = None  # Similar questions answered before
 
 
 class SQLResponse(BaseModel):
@@ -86,6 +229,24 @@ class SQLResponse(BaseModel):
     original_question: str
 
 
+class BatchSQLRequest(BaseModel):
+    questions: List[str]
+    schema: Optional[str] = None
+    schema_hash: Optional[str] = None
+    examples: Optional[Dict[str, List[SQLExample]]] = None  # Per question
+    language: Optional[str] = "eng_Latn"
+
+
+class BatchSQLItem(BaseModel):
+    question: str
+    sql: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchSQLResponse(BaseModel):
+    results: List[BatchSQLItem]
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -93,139 +254,177 @@ async def health_check():
         "status": "healthy",
         "service": "ml-service",
         "model": "gemini-pro",
-        "api_configured": GOOGLE_API_KEY != ""
+        "api_configured": GOOGLE_API_KEY != "",
+        "model_gate": model_gate.stats(),
+        "coalescing": {"in_flight": len(_inflight), **inflight_stats},
+        "cached_schemas": len(_schemas),
+        "providers": providers.info()
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/model-info")
 async def model_info():
     """Return model information"""
     return {
-        "model_name": "gemini-2.5-flash",
+        "model_name": os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
         "provider": "Google",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "providers": [provider.name for provider in providers.providers]
     }
 
 
-@app.post("/generate-sql", response_model=SQLResponse)
-async def generate_sql(request: SQLRequest):
+def _generation_request(
+        question: str,
+        language: Optional[str],
+        schema: Optional[str],
+        examples: Optional[List[SQLExample]] = None
+) -> GenerationRequest:
+    return GenerationRequest(
+        question=question,
+        # Use provided schema or default
+        schema=schema or DATABASE_SCHEMA,
+        language=language,
+        examples=[(example.question, example.sql) for example in examples or []]
+    )
+
+
+async def _local_answer(question: str, language: Optional[str], schema: Optional[str]) -> Optional[str]:
     """
-    Generate SQL query from natural language question
+    Answer from the local providers at the head of the chain (templates), without a model slot
     """
-    logger.info(f"Received question: {request.question}")
-
-    if not GOOGLE_API_KEY or not model:
-        logger.error("Google API key not configured")
+    try:
+        sql_query, provider = await providers.generate(_generation_request(question, language, schema), local=True)
+    except ProviderError:
+        return None
+    logger.info(f"Answered locally ({provider}): {sql_query}")
+    return sql_query
+
+
+async def _generate_sql_text(
+        question: str,
+        language: Optional[str],
+        schema: Optional[str],
+        timeout: Optional[float] = None,
+        bounded_queue: bool = True,
+        examples: Optional[List[SQLExample]] = None
+) -> str:
+    """
+    Generate SQL query for one question, raises HTTPException on failure
+    """
+    if not providers.providers:
         raise HTTPException(
             status_code=500,
-            detail="Google API key not configured"
+            detail="No text-to-SQL provider configured"
         )
 
-    # Language mapping
-    lang_map = {
-        'rus_Cyrl': 'Russian',
-        'kaz_Cyrl': 'Kazakh',
-        'eng_Latn': 'English'
-    }
-    language_name = lang_map.get(request.language, 'English')
+    request = _generation_request(question, language, schema, examples)
 
-    # Use provided schema or default
-    schema = request.schema or DATABASE_SCHEMA
+    deadline = min(timeout, MODEL_TIMEOUT) if timeout else MODEL_TIMEOUT
+    model_gate.enter(bounded=bounded_queue)
 
-    # Construct prompt
-    prompt = f"""You are a SQL expert for Mastercard analytics.
+    try:
+        # The rest of the chain is tried in order until one answers, local providers already missed
+        call = lambda: providers.generate(request, local=False)
+        if bounded_queue:
+            # Interactive request: the deadline covers waiting for a slot too
+            sql_query, provider = await asyncio.wait_for(model_gate.run(call), timeout=deadline)
+        else:
+            # Batch item: queueing behind the rest of the batch is expected, only the call is timed
+            sql_query, provider = await model_gate.run(lambda: asyncio.wait_for(call(), timeout=deadline))
 
-User's question (in {language_name}): {request.question}
+        logger.info(f"Generated SQL ({provider}): {sql_query}")
+        return sql_query
 
-Database schema:
-{schema}
+    except asyncio.TimeoutError:
+        model_gate.timeouts += 1
+        logger.error(f"Model call exceeded the {deadline}s deadline")
+        raise HTTPException(
+            status_code=504,
+            detail=f"Model did not answer within {deadline}s"
+        )
 
-Tasks:
-1. If the question is not in English, first translate it to English
-2. Generate a valid SQL query to answer the question
-3. Return ONLY valid SQL query, nothing else
-4. DO NOT include any explanation, markdown formatting, or SQL: prefix
-5. Return only the raw SQL query
+    except Exception as e:
+        logger.error(f"Error generating SQL: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating SQL: {str(e)}"
+        )
 
-Example good response:
-SELECT * FROM transactions WHERE transaction_date >= '2023-08-01' AND transaction_date < '2023-09-01'
 
-Example bad response:
-SQL: SELECT * FROM...
-```sql
-SELECT * FROM...
-```
-Here's the query: SELECT * FROM..."""
+@app.post("/generate-sql", response_model=SQLResponse)
+async def generate_sql(request: SQLRequest):
+    """
+    Generate SQL query from natural language question
+    """
+    logger.info(f"Received question: {request.question}")
+    start_time = time.perf_counter()
 
-    try:
-        logger.info("Calling Google Gemini...")
-
-        # Call Gemini
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=1000,
-            )
-        )
+    schema = resolve_schema(request.schema, request.schema_hash)
 
-        # Проверяем, был ли ответ заблокирован или обрезан
-        if not response.text:
-            logger.error("Empty response from Gemini")
-            raise HTTPException(
-                status_code=500,
-                detail="Empty response from model"
-            )
+    sql_query = await _local_answer(request.question, request.language, schema)
+    if sql_query:
+        GENERATION_DURATION.observe(time.perf_counter() - start_time, "template")
+        return SQLResponse(sql=sql_query, original_question=request.question)
 
-        result = response.text.strip()
-        logger.info(f"Raw Gemini response: {result}")
+    key = (" ".join(request.question.lower().split()), request.language, request.schema_hash or schema)
+    sql_query = await _coalesced(
+        key,
+        lambda: _generate_sql_text(
+            request.question, request.language, schema, request.timeout, examples=request.examples
+        )
+    )
+    GENERATION_DURATION.observe(time.perf_counter() - start_time, "model")
 
-        # Extract SQL from response (in case model didn't follow instructions)
-        if "SQL:" in result:
-            sql_query = result.split("SQL:")[-1].strip()
-        else:
-            sql_query = result
-
-        # Clean SQL query - remove markdown code blocks
-        if "```sql" in sql_query:
-            sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
-        elif "```" in sql_query:
-            sql_query = sql_query.split("```")[1].split("```")[0].strip()
-
-        # Remove any explanatory text after the SQL (like "This query will...")
-        lines = sql_query.split('\n')
-        sql_lines = []
-        for line in lines:
-            line = line.strip()
-            # Stop if we hit explanatory text
-            if line and not line.upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'FROM', 'WHERE', 'AND', 'OR', 'ORDER', 'GROUP', 'HAVING', 'LIMIT', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'ON', 'AS')):
-                if sql_lines:  # Only break if we already have SQL
-                    break
-            if line:
-                sql_lines.append(line)
-
-        sql_query = ' '.join(sql_lines).strip()
-
-        logger.info(f"Generated SQL: {sql_query}")
-
-        if not sql_query:
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to extract valid SQL from response"
-            )
+    return SQLResponse(
+        sql=sql_query,
+        original_question=request.question
+    )
 
-        return SQLResponse(
-            sql=sql_query,
-            original_question=request.question
-        )
 
-    except Exception as e:
-        logger.error(f"Error generating SQL: {e}")
+@app.post("/generate-sql/batch", response_model=BatchSQLResponse)
+async def generate_sql_batch(request: BatchSQLRequest):
+    """
+    Generate SQL for several questions at once.
+    Duplicates are generated once, at most BATCH_CONCURRENCY model calls run in parallel,
+    a failed question gets an error instead of failing the whole batch.
+    """
+    questions = list(dict.fromkeys(question.strip() for question in request.questions if question.strip()))
+    logger.info(f"Received batch of {len(request.questions)} questions ({len(questions)} unique)")
+
+    if len(questions) > BATCH_MAX_QUESTIONS:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error generating SQL: {str(e)}"
+            status_code=400,
+            detail=f"Too many questions in batch: {len(questions)} (max {BATCH_MAX_QUESTIONS})"
         )
 
+    schema = resolve_schema(request.schema, request.schema_hash)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def generate_one(question: str) -> BatchSQLItem:
+        sql_query = await _local_answer(question, request.language, schema)
+        if sql_query:
+            return BatchSQLItem(question=question, sql=sql_query)
+
+        async with semaphore:
+            try:
+                # Batch items wait for a model slot instead of being rejected by the queue limit
+                sql_query = await _generate_sql_text(
+                    question, request.language, schema, bounded_queue=False,
+                    examples=(request.examples or {}).get(question)
+                )
+                return BatchSQLItem(question=question, sql=sql_query)
+            except HTTPException as e:
+                return BatchSQLItem(question=question, error=e.detail)
+
+    results = await asyncio.gather(*(generate_one(question) for question in questions))
+    return BatchSQLResponse(results=list(results))
+
 
 @app.get("/")
 async def root():
@@ -236,7 +435,9 @@ async def root():
         "endpoints": {
             "health": "/health",
             "generate_sql": "/generate-sql",
-            "model_info": "/model-info"
+            "generate_sql_batch": "/generate-sql/batch",
+            "model_info": "/model-info",
+            "metrics": "/metrics"
         }
     }
 
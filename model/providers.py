@@ -0,0 +1,393 @@
+"""
+Провайдеры text-to-SQL: Google Gemini, локальные шаблоны и воспроизведение записанных ответов.
+Цепочка провайдеров задается через MODEL_PROVIDERS, следующий провайдер пробуется,
+если предыдущий не ответил, ответил ошибкой или не уложился в свой таймаут.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from metrics import PROVIDER_DURATION
+from sql_templates import TemplateMatcher
+
+logger = logging.getLogger(__name__)
+
+LANGUAGES = {
+    'rus_Cyrl': 'Russian',
+    'kaz_Cyrl': 'Kazakh',
+    'eng_Latn': 'English'
+}
+
+
+class ProviderError(Exception):
+    """The provider has no answer for the request, the next one in the chain is tried"""
+
+
+@dataclass
+class GenerationRequest:
+    question: str
+    schema: str
+    language: Optional[str] = "eng_Latn"
+    examples: List[Tuple[str, str]] = field(default_factory=list)  # (question, sql), closest first
+
+
+def normalize(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+class Provider(ABC):
+    name = "provider"
+    # Answers in-process without I/O: tried before the request takes a model slot
+    local = False
+
+    def __init__(self, timeout: Optional[float] = None):
+        # Own deadline, lets the chain move on while the request deadline still has time left
+        self.timeout = timeout
+
+    @abstractmethod
+    async def generate(self, request: GenerationRequest) -> str:
+        """SQL for the request, raises ProviderError when there is no answer"""
+
+    def info(self) -> dict:
+        return {}
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash", timeout: Optional[float] = None):
+        super().__init__(timeout)
+        self.model_name = model_name
+        self.model = None
+        if api_key:
+            genai.configure(api_key=api_key)
+            self.model = genai.GenerativeModel(model_name)
+
+    async def generate(self, request: GenerationRequest) -> str:
+        if self.model is None:
+            raise ProviderError("Google API key not configured")
+
+        logger.info("Calling Google Gemini...")
+
+        # Call Gemini without blocking the event loop
+        response = await self.model.generate_content_async(
+            build_prompt(request),
+            generation_config=genai.types.GenerationConfig(
+                temperature=0.1,
+                max_output_tokens=1000,
+            )
+        )
+
+        # Проверяем, был ли ответ заблокирован или обрезан
+        if not response.text:
+            raise ProviderError("Empty response from model")
+
+        result = response.text.strip()
+        logger.info(f"Raw Gemini response: {result}")
+
+        sql_query = extract_sql(result)
+        if not sql_query:
+            raise ProviderError("Failed to extract valid SQL from response")
+        return sql_query
+
+    def info(self) -> dict:
+        return {"model_name": self.model_name, "configured": self.model is not None}
+
+
+class TemplateProvider(Provider):
+    """Local rule engine, only answers the question shapes sql_templates knows"""
+
+    name = "template"
+    local = True
+
+    def __init__(self, timeout: Optional[float] = None):
+        super().__init__(timeout)
+        self.matcher = TemplateMatcher()
+
+    async def generate(self, request: GenerationRequest) -> str:
+        match = self.matcher.match(request.question, request.schema)
+        if match is None:
+            raise ProviderError("No template matches the question")
+        return match.sql
+
+    def info(self) -> dict:
+        return self.matcher.stats()
+
+
+class ReplayProvider(Provider):
+    """
+    Answers from a fixture file of recorded question -> SQL pairs (JSON lines with
+    "question", "sql" and an optional "latency" in seconds to replay the original timing).
+    Used to run and benchmark the pipeline offline.
+    """
+
+    name = "replay"
+
+    def __init__(
+            self,
+            path: str,
+            default_sql: str = "",
+            latency: Optional[float] = None,
+            timeout: Optional[float] = None
+    ):
+        super().__init__(timeout)
+        self.path = Path(path) if path else None
+        self.default_sql = default_sql
+        self.latency = latency  # Overrides the recorded latency when set
+        self.fixtures: Dict[str, Tuple[str, float]] = {}
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if self.path is None or not self.path.exists():
+            logger.warning(f"Replay fixture {self.path} not found")
+            return
+
+        with self.path.open(encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    self.fixtures[normalize(entry["question"])] = (entry["sql"], float(entry.get("latency") or 0))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        logger.info(f"Replay fixture loaded: {len(self.fixtures)} answers from {self.path}")
+
+    async def generate(self, request: GenerationRequest) -> str:
+        sql, latency = self.fixtures.get(normalize(request.question), (self.default_sql, 0.0))
+        if not sql:
+            self.misses += 1
+            raise ProviderError("Question is not in the replay fixture")
+
+        latency = self.latency if self.latency is not None else latency
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return sql
+
+    def info(self) -> dict:
+        return {"fixture": str(self.path) if self.path else None, "answers": len(self.fixtures), "misses": self.misses}
+
+
+class LatencyStats:
+    """Counters and a window of recent latencies for percentiles"""
+
+    def __init__(self, window: int = 1000):
+        self.calls = 0
+        self.answered = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, elapsed: float):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self._recent.append(elapsed)
+
+    def percentile(self, q: float) -> float:
+        if not self._recent:
+            return 0.0
+        values = sorted(self._recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "answered": self.answered,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total_time / self.calls * 1000, 2) if self.calls else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 2),
+            "p95_ms": round(self.percentile(0.95) * 1000, 2),
+            "max_ms": round(self.max_time * 1000, 2)
+        }
+
+
+class ProviderChain:
+    """Tries the providers in order and returns the first answer"""
+
+    def __init__(self, providers: List[Provider], record_path: str = ""):
+        self.providers = providers
+        self.stats: Dict[str, LatencyStats] = {provider.name: LatencyStats() for provider in providers}
+        self.record_path = Path(record_path) if record_path else None
+
+    def _select(self, local: Optional[bool]) -> List[Provider]:
+        """The leading local providers (local=True), the rest of the chain (local=False) or all of it"""
+        if local is None:
+            return self.providers
+        split = next((i for i, provider in enumerate(self.providers) if not provider.local), len(self.providers))
+        return self.providers[:split] if local else self.providers[split:]
+
+    async def generate(self, request: GenerationRequest, local: Optional[bool] = None) -> Tuple[str, str]:
+        """(sql, provider name), raises ProviderError with every provider's reason if none answered"""
+        errors = []
+        for provider in self._select(local):
+            stats = self.stats[provider.name]
+            started = time.perf_counter()
+            outcome = "answered"
+            try:
+                if provider.timeout:
+                    sql = await asyncio.wait_for(provider.generate(request), timeout=provider.timeout)
+                else:
+                    sql = await provider.generate(request)
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                stats.timeouts += 1
+                errors.append(f"{provider.name}: no answer within {provider.timeout}s")
+                logger.warning(f"Provider {provider.name} timed out, trying the next one")
+                continue
+            except Exception as e:
+                outcome = "error"
+                stats.errors += 1
+                errors.append(f"{provider.name}: {e}")
+                # A template or fixture miss is the normal case, only real failures are warnings
+                log = logger.info if isinstance(e, ProviderError) else logger.warning
+                log(f"Provider {provider.name} failed: {e}")
+                continue
+            finally:
+                elapsed = time.perf_counter() - started
+                stats.observe(elapsed)
+                PROVIDER_DURATION.observe(elapsed, provider.name, outcome)
+
+            stats.answered += 1
+            if provider.name != ReplayProvider.name:
+                self._record(request.question, sql, time.perf_counter() - started)
+            return sql, provider.name
+
+        raise ProviderError("; ".join(errors) or "No text-to-SQL provider configured")
+
+    def _record(self, question: str, sql: str, latency: float):
+        """Append the answer to a fixture the replay provider can load"""
+        if self.record_path is None:
+            return
+        try:
+            with self.record_path.open("a", encoding="utf-8") as file:
+                entry = {"question": question, "sql": sql, "latency": round(latency, 4)}
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to record answer to {self.record_path}: {e}")
+
+    def info(self) -> List[dict]:
+        return [
+            {"name": provider.name, "timeout": provider.timeout, **provider.info(), **self.stats[provider.name].to_dict()}
+            for provider in self.providers
+        ]
+
+
+# Recorded answers shipped with the service, see fixtures/replay.jsonl
+DEFAULT_FIXTURE = Path(__file__).parent / "fixtures" / "replay.jsonl"
+
+
+def _env_timeout(name: str) -> Optional[float]:
+    value = os.getenv(f"{name.upper()}_TIMEOUT", "")
+    return float(value) if value else None
+
+
+def build_chain() -> ProviderChain:
+    """
+    Provider chain from the environment:
+    MODEL_PROVIDERS - comma separated names in fallback order (template, gemini, replay)
+    <NAME>_TIMEOUT - deadline of one provider in seconds, e.g. GEMINI_TIMEOUT=5
+    REPLAY_FIXTURE, REPLAY_DEFAULT_SQL, REPLAY_LATENCY - replay provider settings
+    MODEL_RECORD_PATH - append the answers of the other providers to a replay fixture
+    """
+    providers: List[Provider] = []
+    for name in os.getenv("MODEL_PROVIDERS", "template,gemini").split(","):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name == GeminiProvider.name:
+            providers.append(GeminiProvider(
+                os.getenv("GOOGLE_API_KEY", ""),
+                os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
+                timeout=_env_timeout(name)
+            ))
+        elif name == TemplateProvider.name:
+            providers.append(TemplateProvider(timeout=_env_timeout(name)))
+        elif name == ReplayProvider.name:
+            latency = os.getenv("REPLAY_LATENCY", "")
+            providers.append(ReplayProvider(
+                os.getenv("REPLAY_FIXTURE", str(DEFAULT_FIXTURE)),
+                default_sql=os.getenv("REPLAY_DEFAULT_SQL", ""),
+                latency=float(latency) if latency else None,
+                timeout=_env_timeout(name)
+            ))
+        else:
+            logger.error(f"Unknown text-to-SQL provider '{name}', skipped")
+
+    logger.info(f"Text-to-SQL providers: {', '.join(provider.name for provider in providers)}")
+    return ProviderChain(providers, record_path=os.getenv("MODEL_RECORD_PATH", ""))
+
+
+def build_prompt(request: GenerationRequest) -> str:
+    language_name = LANGUAGES.get(request.language, 'English')
+
+    # Past questions with SQL that worked, closest first
+    examples_block = ""
+    if request.examples:
+        examples_block = "\nSimilar questions answered before:\n" + "\n".join(
+            f"Q: {question}\nSQL: {sql}" for question, sql in request.examples
+        ) + "\n"
+
+    return f"""You are a SQL expert for Mastercard analytics.
+
+User's question (in {language_name}): {request.question}
+
+Database schema:
+{request.schema}
+{examples_block}
+Tasks:
+1. If the question is not in English, first translate it to English
+2. Generate a valid SQL query to answer the question
+3. Return ONLY valid SQL query, nothing else
+4. DO NOT include any explanation, markdown formatting, or SQL: prefix
+5. Return only the raw SQL query
+
+Example good response:
+SELECT * FROM transactions WHERE transaction_date >= '2023-08-01' AND transaction_date < '2023-09-01'
+
+Example bad response:
+SQL: SELECT * FROM...
+```sql
+SELECT * FROM...
+```
+Here's the query: SELECT * FROM..."""
+
+
+def extract_sql(result: str) -> str:
+    # Extract SQL from response (in case model didn't follow instructions)
+    if "SQL:" in result:
+        sql_query = result.split("SQL:")[-1].strip()
+    else:
+        sql_query = result
+
+    # Clean SQL query - remove markdown code blocks
+    if "```sql" in sql_query:
+        sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
+    elif "```" in sql_query:
+        sql_query = sql_query.split("```")[1].split("```")[0].strip()
+
+    # Remove any explanatory text after the SQL (like "This query will...")
+    lines = sql_query.split('\n')
+    sql_lines = []
+    for line in lines:
+        line = line.strip()
+        # Stop if we hit explanatory text
+        if line and not line.upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'FROM', 'WHERE', 'AND', 'OR', 'ORDER', 'GROUP', 'HAVING', 'LIMIT', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'ON', 'AS')):
+            if sql_lines:  # Only break if we already have SQL
+                break
+        if line:
+            sql_lines.append(line)
+
+    return ' '.join(sql_lines).strip()
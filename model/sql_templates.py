@@ -0,0 +1,227 @@
+"""
+Детерминированный разбор типовых вопросов (английский и русский) в SQL по шаблонам.
+Вопрос должен целиком совпасть с одной из известных форм, иначе возвращается None
+и вопрос уходит в модель.
+"""
+
+import calendar
+import re
+import unicodedata
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+TABLE = "transactions"
+AMOUNT = "TransactionAmount"
+DATE = "TransactionDate"
+
+# Dimension words -> column
+DIMENSIONS = [
+    (r"merchants?|sellers?|stores?|мерчант\w*|продав\w*|магазин\w*", "MerchantID"),
+    (r"accounts?|clients?|customers?|сч[её]т\w*|аккаунт\w*|клиент\w*", "AccountID"),
+    (r"locations?|cit(?:y|ies)|локаци\w*|город\w*", "Location"),
+    (r"channels?|канал\w*", "Channel"),
+    (r"devices?|устройств\w*", "DeviceID"),
+    (r"transaction types?|types?|тип\w* транзакци\w*|тип\w*", "TransactionType"),
+]
+
+# Measure words -> (expression, alias)
+_SUM = (f"SUM({AMOUNT})", "total_amount")
+_COUNT = ("COUNT(*)", "transaction_count")
+_AVG = (f"AVG({AMOUNT})", "avg_amount")
+MEASURES = [
+    (r"(?:the )?(?:average|avg|mean) (?:transaction )?(?:amount|value|check|size)|average transaction|"
+     r"средн\w* (?:сумм\w*|чек\w*|размер\w*)(?: транзакци\w*)?", _AVG),
+    (r"(?:the )?(?:number|count|amount) of transactions|transaction count|transactions count|transactions|count|"
+     r"количеств\w* (?:транзакци\w*|операци\w*)|числ\w* (?:транзакци\w*|операци\w*)|транзакци\w*|операци\w*", _COUNT),
+    (r"(?:the )?(?:total |overall )?(?:transaction )?(?:amount|revenue|spend|spending|sales|volume|turnover|sum)|"
+     r"(?:общ\w* )?(?:сумм\w*|выручк\w*|оборот\w*|объ[её]м\w*)(?: транзакци\w*)?", _SUM),
+]
+
+_EN_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_EN_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+_RU_MONTHS = [
+    ("январ", 1), ("феврал", 2), ("март", 3), ("апрел", 4), ("ма", 5), ("июн", 6),
+    ("июл", 7), ("август", 8), ("сентябр", 9), ("октябр", 10), ("ноябр", 11), ("декабр", 12)
+]
+_RU_MONTH_RE = r"январ[ьяе]|феврал[ьяе]|март[ае]?|апрел[ьяе]|ма[йяе]|июн[ьяе]|июл[ьяе]|август[ае]?|сентябр[ьяе]|октябр[ьяе]|ноябр[ьяе]|декабр[ьяе]"
+_EN_MONTH_RE = "|".join(sorted(_EN_MONTHS, key=len, reverse=True))
+
+_DATE = r"\d{4}-\d{2}-\d{2}"
+_YEAR = r"(?:19|20)\d{2}"
+_ID = r"[A-Za-z0-9_-]*\d[A-Za-z0-9_-]*"
+
+_PERIOD_RE = re.compile(
+    rf"""\s+(?:
+        (?:in|during|for|в|во|за)\s+(?P<month>{_EN_MONTH_RE}|{_RU_MONTH_RE})\s+(?:of\s+)?(?P<month_year>{_YEAR})(?:\s+(?:года|год|г))?
+      | (?:in|during|for|в|за)\s+(?:the\s+year\s+)?(?P<year>{_YEAR})(?:\s+(?:году|года|год|г))?
+      | (?:on|for|на|за)\s+(?P<day>{_DATE})
+      | (?:between|from|с|между)\s+(?P<start>{_DATE})\s+(?:and|to|till|until|по|и|до)\s+(?P<end>{_DATE})
+    )$""",
+    re.IGNORECASE | re.VERBOSE
+)
+_PREFIX_RE = re.compile(
+    r"^(?:(?:please|пожалуйста)\s+)?(?:show(?: me)?|list|give me|get|find|what (?:is|are)|what's|"
+    r"покажи(?:те)?|показать|выведи(?:те)?|дай(?:те)?|найди(?:те)?|какой|какая|какие|каков[аы]?)\s+(?:the\s+)?",
+    re.IGNORECASE
+)
+
+
+def _alternatives(items) -> str:
+    return "|".join(f"(?:{pattern})" for pattern, _ in items)
+
+
+_DIMENSION_RE = _alternatives(DIMENSIONS)
+_MEASURE_RE = _alternatives(MEASURES)
+
+_TOP_RE = re.compile(
+    rf"^(?:top|топ|лучшие|первые)(?:\s+(?P<n>\d{{1,4}}))?\s+(?P<dimension>{_DIMENSION_RE})"
+    rf"\s+(?:by|по)\s+(?P<measure>{_MEASURE_RE})$",
+    re.IGNORECASE
+)
+_BREAKDOWN_RE = re.compile(
+    rf"^(?P<measure>{_MEASURE_RE})\s+(?:by|per|for each|по|в разрезе|для каждого|для каждой)\s+(?P<dimension>{_DIMENSION_RE})$",
+    re.IGNORECASE
+)
+_TOTAL_RE = re.compile(rf"^(?P<measure>{_MEASURE_RE})$", re.IGNORECASE)
+_LOOKUP_RE = re.compile(
+    rf"^(?:all\s+|все\s+)?(?:transactions|транзакции|операции)\s+(?:for|of|by|from|по|для|у)?\s*"
+    rf"(?P<dimension>{_DIMENSION_RE})\s+(?P<id>{_ID})$",
+    re.IGNORECASE
+)
+
+
+@dataclass(frozen=True)
+class TemplateMatch:
+    intent: str
+    sql: str
+
+
+def _normalize(question: str) -> str:
+    text = unicodedata.normalize("NFKC", question).replace("ё", "е").replace("Ё", "Е")
+    # Keep letters, digits and the characters of dates and IDs
+    text = re.sub(r"[^\w\s-]+", " ", text)
+    text = re.sub(r"(?<!\w)-|-(?!\w)", " ", text)
+    return " ".join(text.split())
+
+
+def _lookup(items, text: str):
+    for pattern, value in items:
+        if re.fullmatch(pattern, text, re.IGNORECASE):
+            return value
+    return None
+
+
+def _month_number(word: str) -> int:
+    word = word.lower()
+    if word in _EN_MONTHS:
+        return _EN_MONTHS[word]
+    for stem, number in _RU_MONTHS:
+        if word.startswith(stem):
+            return number
+    raise ValueError(word)
+
+
+def _parse_period(match: re.Match) -> Tuple[date, date]:
+    """Half-open [start, end) range"""
+    if match.group("month"):
+        year, month = int(match.group("month_year")), _month_number(match.group("month"))
+        start = date(year, month, 1)
+        return start, date(year + month // 12, month % 12 + 1, 1)
+    if match.group("year"):
+        year = int(match.group("year"))
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    if match.group("day"):
+        day = date.fromisoformat(match.group("day"))
+        return day, day + timedelta(days=1)
+    start, end = date.fromisoformat(match.group("start")), date.fromisoformat(match.group("end"))
+    if end < start:
+        raise ValueError("empty range")
+    return start, end + timedelta(days=1)
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def match_question(question: str) -> Optional[TemplateMatch]:
+    """SQL for a question of a known shape, None when unsure"""
+    text = _normalize(question)
+    text = _PREFIX_RE.sub("", text)
+
+    conditions = []
+    period = _PERIOD_RE.search(text)
+    if period:
+        try:
+            start, end = _parse_period(period)
+        except ValueError:
+            return None
+        conditions.append(f"{DATE} >= '{start.isoformat()}' AND {DATE} < '{end.isoformat()}'")
+        text = text[:period.start()]
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    match = _TOP_RE.match(text)
+    if match:
+        dimension = _lookup(DIMENSIONS, match.group("dimension"))
+        expression, alias = _lookup(MEASURES, match.group("measure"))
+        limit = min(int(match.group("n") or 10), 1000)
+        if limit == 0:
+            return None
+        return TemplateMatch("top", (
+            f"SELECT {dimension}, {expression} AS {alias} FROM {TABLE}{where} "
+            f"GROUP BY {dimension} ORDER BY {alias} DESC LIMIT {limit}"
+        ))
+
+    match = _BREAKDOWN_RE.match(text)
+    if match:
+        dimension = _lookup(DIMENSIONS, match.group("dimension"))
+        expression, alias = _lookup(MEASURES, match.group("measure"))
+        return TemplateMatch("breakdown", (
+            f"SELECT {dimension}, {expression} AS {alias} FROM {TABLE}{where} "
+            f"GROUP BY {dimension} ORDER BY {alias} DESC"
+        ))
+
+    match = _LOOKUP_RE.match(text)
+    if match:
+        dimension = _lookup(DIMENSIONS, match.group("dimension"))
+        if dimension not in ("AccountID", "MerchantID", "DeviceID"):
+            return None
+        condition = f"{dimension} = {_quote_literal(match.group('id'))}"
+        where = f" WHERE {' AND '.join([condition] + conditions)}"
+        return TemplateMatch("lookup", f"SELECT * FROM {TABLE}{where} ORDER BY {DATE} DESC")
+
+    match = _TOTAL_RE.match(text)
+    vague = match and (
+        re.fullmatch(r"transactions|транзакци\w*|операци\w*", match.group("measure"), re.IGNORECASE)
+        or (" " not in match.group("measure") and not conditions)
+    )
+    if match and not vague:
+        # "transactions in 2023" may ask for a list as well as a count, the model decides
+        expression, alias = _lookup(MEASURES, match.group("measure"))
+        return TemplateMatch("total", f"SELECT {expression} AS {alias} FROM {TABLE}{where}")
+
+    return None
+
+
+def schema_supports(schema: str) -> bool:
+    """Templates only target the transactions table with its known columns"""
+    columns = [AMOUNT, DATE] + [column for _, column in DIMENSIONS]
+    return f"{TABLE}" in schema and all(column in schema for column in columns)
+
+
+class TemplateMatcher:
+    def __init__(self):
+        self.hits: Dict[str, int] = {}
+        self.misses = 0
+
+    def match(self, question: str, schema: str) -> Optional[TemplateMatch]:
+        result = match_question(question) if schema_supports(schema) else None
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits[result.intent] = self.hits.get(result.intent, 0) + 1
+        return result
+
+    def stats(self) -> dict:
+        return {"hits": dict(self.hits), "misses": self.misses}